@@ -1,21 +1,38 @@
 import os
-import unirest
+import csv
+import time
+import hashlib
+import uuid
 import urllib2
 import urllib
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, stream_with_context, \
+                  get_flashed_messages, abort, session, has_request_context
 from flask_login import LoginManager, login_user, logout_user, current_user
-from sqlalchemy import func, or_
-from passlib.apps import custom_app_context as pwd_context
+from sqlalchemy import func, and_, or_, event
+from sqlalchemy.exc import IntegrityError
 from models import *
-from database import db_session
+from database import db_session, engine, replica_session, replica_engine
 from helpers import *
+from cache import TTLCache, GAMES_VERSION, list_cache_from_env
+from catalog import GameIndex, PlatformRegistry
+from igdb import IGDBError, client_from_env
+from hashing import Hasher, HashingPoolSaturated
+from metrics import Metrics, directory_from_env as metrics_directory_from_env
+from covers import PLACEHOLDER_SVG, store_from_env
+from assets import Assets
+from queries import get_or_create_game, add_list_entry, list_entries_page, list_groups, \
+                    move_list_entries, delete_list_entries, change_list_count, list_counts
+from transfer import export_entries, import_entries, to_csv, to_json, from_csv, from_json
 from flask_jsglue import JSGlue
 
 # configure app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY")
 
+# only route the lists that exist
+app.url_map.converters["list_type"] = ListTypeConverter
+
 # configure login_manager
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -24,6 +41,175 @@ login_manager.session_protection = "strong"
 # configure JSGlue
 JSGlue(app)
 
+# configure static assets, served from the files built by assets.py if it has been run
+assets = Assets(app)
+
+# configure request metrics, served at /metrics, logging requests slower than SLOW_REQUEST_MS
+# along with their SQL statements and, if PROFILE_DIR is set, profiling a PROFILE_SAMPLE_RATE
+# fraction of requests into it; every worker process saves its metrics in METRICS_DIR at most
+# every METRICS_FLUSH_INTERVAL seconds, so that /metrics serves the totals of all of them
+request_metrics = Metrics(app, engine,
+                          slow_request_ms=float(os.environ.get("SLOW_REQUEST_MS", 0)),
+                          profile_dir=os.environ.get("PROFILE_DIR"),
+                          profile_sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0.01)),
+                          directory=metrics_directory_from_env(),
+                          flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", 1)))
+if replica_engine is not engine:
+    request_metrics.init_engine(replica_engine)
+
+# configure password hashing, done in a pool of HASH_POOL_SIZE processes (or in the
+# request's thread if 0) with at most HASH_QUEUE_LIMIT passwords pending at once
+hasher = Hasher(rounds=int(os.environ.get("HASH_ROUNDS", 0)) or None,
+                pool_size=int(os.environ.get("HASH_POOL_SIZE", 2)),
+                max_pending=int(os.environ.get("HASH_QUEUE_LIMIT", 8)))
+
+# configure IGDB client and search cache
+igdb = client_from_env()
+search_cache = TTLCache(ttl=int(os.environ.get("SEARCH_CACHE_TTL", 3600)),
+                        max_size=int(os.environ.get("SEARCH_CACHE_SIZE", 5000)))
+
+# configure local game search index, IGDB is only searched
+# when fewer than LOCAL_SEARCH_MIN games are found in it; every GAME_INDEX_CHECK
+# seconds, it's reloaded if games were changed outside of the app
+game_index = GameIndex()
+SEARCH_LIMIT = 10
+LOCAL_SEARCH_MIN = int(os.environ.get("LOCAL_SEARCH_MIN", 5))
+GAME_INDEX_CHECK = float(os.environ.get("GAME_INDEX_CHECK", 60))
+
+# configure on-disk store of game covers, shared by every worker on the same machine
+cover_store = store_from_env()
+COVER_MAX_AGE = int(os.environ.get("COVER_MAX_AGE", 30 * 24 * 3600))
+
+# configure per-process copy of the platforms table, reloaded every PLATFORM_CACHE_TTL
+# seconds, or right away when platforms are changed through the ORM in this process
+platform_registry = PlatformRegistry(lambda: db_session.query(Platform.id, Platform.name).all(),
+                                     ttl=int(os.environ.get("PLATFORM_CACHE_TTL", 300)))
+for change in ["after_insert", "after_update", "after_delete"]:
+    event.listen(Platform, change, lambda mapper, connection, target: platform_registry.invalidate())
+
+# configure per-process cache of logged in users, so that requests
+# don't need to query the users table before getting to work; each user
+# is cached under a version kept in the shared list cache, so that changing
+# them outdates their copies in every worker process right away
+user_cache = TTLCache(ttl=int(os.environ.get("USER_CACHE_TTL", 60)),
+                      max_size=int(os.environ.get("USER_CACHE_SIZE", 10000)))
+
+# configure cache of users' list pages, shared by every worker process on the machine
+list_cache = list_cache_from_env()
+
+# expose the IGDB client's and caches' own metrics
+request_metrics.collect("tracklog_igdb_request_duration_seconds", "histogram",
+                        "Duration of each request sent to IGDB, retries included.", lambda: igdb.latency)
+request_metrics.collect("tracklog_igdb_circuit_open", "gauge",
+                        "Whether calls to IGDB are currently being stopped by the circuit breaker.",
+                        lambda: igdb.breaker.state == "open")
+for cache_name, cache in [("search", search_cache), ("user", user_cache), ("list", list_cache)]:
+    for stat in ["hits", "misses"]:
+        request_metrics.collect("tracklog_{}_cache_{}_total".format(cache_name, stat), "counter",
+                                "Lookups in the {} cache that were {}.".format(cache_name, stat),
+                                lambda cache=cache, stat=stat: cache.stats()[stat])
+
+def current_version(key):
+    """
+    Returns the version kept in the list cache under key, starting a new one if it's missing
+    """
+
+    version = list_cache.get(key)
+    # versions are random rather than counters, so that a version that got
+    # evicted from the cache is never reused for different contents
+    if version is None:
+        version = uuid.uuid4().hex
+        list_cache.set(key, version)
+    return version
+
+def list_version(user_id, list_type):
+    """
+    Returns a string identifying the current contents of a user's list (list_type)
+    """
+
+    # a list changes either by itself, along with all of the user's lists (e.g. when
+    # platforms change) or along with everyone's (when games are refreshed), so it's
+    # identified by all three versions
+    keys = ["version:{}".format(user_id), "version:{}:{}".format(user_id, list_type), GAMES_VERSION]
+    versions = [current_version(key) for key in keys]
+
+    return hashlib.sha1(":".join([str(user_id), list_type] + versions)).hexdigest()
+
+def user_cache_key(user_id):
+    """
+    Returns the key a user is cached under in user_cache, which changes along with their version
+    """
+
+    return "{}:{}".format(user_id, current_version("version:user:{}".format(user_id)))
+
+def invalidate_user(user_id):
+    """
+    Marks the cached copies of a user as outdated, in every worker process
+    """
+
+    list_cache.set("version:user:{}".format(user_id), uuid.uuid4().hex)
+
+def invalidate_lists(user_id, list_type=None):
+    """
+    Marks a user's cached list (list_type) as outdated, or all of their lists if list_type is None
+    """
+
+    if list_type is None:
+        list_cache.set("version:{}".format(user_id), uuid.uuid4().hex)
+    else:
+        list_cache.set("version:{}:{}".format(user_id, list_type), uuid.uuid4().hex)
+
+    # remember when the lists last changed, as pages read from a replica before
+    # the change has reached it mustn't be cached under the new version
+    if replica_session is not db_session:
+        list_cache.set("changed:{}".format(user_id), time.time())
+
+# after a user's request has written to the database, keep their reads on the primary
+# database for DATABASE_REPLICA_LAG seconds, so they see their changes even before
+# they reach the replica
+REPLICA_LAG = float(os.environ.get("DATABASE_REPLICA_LAG", 5))
+
+@event.listens_for(db_session, "after_commit")
+def read_primary_after_commit(committed_session):
+    if replica_session is not db_session and has_request_context():
+        session["read_primary_until"] = time.time() + REPLICA_LAG
+
+def read_session():
+    """
+    Returns the session read-only routes should query, the replica's unless
+    the current user has just written to the primary database
+    """
+
+    if time.time() < session.get("read_primary_until", 0):
+        return db_session
+    return replica_session
+
+@app.teardown_appcontext
+def remove_sessions(exception=None):
+    """
+    Returns the request's database connections to their pools once it's done
+    """
+
+    db_session.remove()
+    replica_session.remove()
+
+@app.before_first_request
+def load_game_index():
+    """
+    Builds the local game search index from the games already in the database
+    """
+
+    # read the version first, so that games changed while loading are reloaded later
+    version = current_version(GAMES_VERSION)
+    game_index.load(all_games(), version)
+
+def all_games():
+    """
+    Returns (igdb_id, name, image_url) rows of every game in the database
+    """
+
+    return db_session.query(Game.igdb_id, Game.name, Game.image_url).yield_per(10000)
+
 @app.route("/")
 def index():
     """
@@ -58,10 +244,16 @@ def login():
             return render_template("login.html")
 
         # check if the entered password is correct
-        if not pwd_context.verify(password, user.password):
+        verified, new_hash = hasher.verify_and_update(password, user.password)
+        if not verified:
             flash("You've entered a wrong password.")
             return render_template("login.html")
 
+        # upgrade the stored hash if it was made with outdated settings
+        if new_hash:
+            user.password = new_hash
+            db_session.commit()
+
         # determine whether to remember user or not
         if request.form.get("remember"):
             remember = True
@@ -129,7 +321,7 @@ def register():
             return redirect(url_for("register"))
 
         # everything went well, add user to database
-        user = User(username, email, pwd_context.encrypt(password))
+        user = User(username, email, hasher.encrypt(password))
         db_session.add(user)
         db_session.commit()
 
@@ -141,40 +333,187 @@ def register():
     else:
         return render_template("register.html")
 
-@app.route("/lists/<string:list_type>")
+@app.route("/lists/<list_type:list_type>")
 @login_required
 def lists(list_type):
     """
     Route for displaying user backlog
     """
 
-    # retrieve user's platforms
-    platforms = db_session.query(Platform.name). \
-                           join(UserPlatform). \
-                           filter(UserPlatform.user_id == current_user.id). \
-                           order_by(Platform.name). \
-                           all()
-
-    # retrieve user's entries for current list (list_type)
-    entries = db_session.query(ListEntry, Game, Platform.name). \
-                         join(Game). \
-                         join(Platform). \
-                         filter(ListEntry.user_id == current_user.id). \
-                         filter(ListEntry.list_type == list_type). \
-                         order_by(Platform.name, Game.name). \
-                         all()
-
-    # if the user's current list (list_type) is not emptry
-    if entries:
-        # https://developmentality.wordpress.com/2012/03/30/three-ways-of-creating-dictionaries-in-python/
-        games = dict([ (platform.name, []) for platform in platforms ])
-        for entry in entries:
-            games[entry[2]].append(entry[1])
+    # read any flashed messages now, since the session can't be
+    # updated anymore once the page has started streaming
+    flashes = get_flashed_messages(with_categories=True)
+
+    # let the browser use the page it already has if the list hasn't changed since,
+    # unless there's a message to show on it
+    version = list_version(current_user.id, list_type)
+    cached = list_cache.get("lists:" + version)
+    if not flashes and version in request.if_none_match:
+        response = Response(status=304)
+    # render list (list_type) from cache if it has been rendered before
+    elif cached is not None:
+        platforms, groups = cached
+        response = app.make_response(render_template("list.html", list_type=list_type,
+                                                     groups=groups, platforms=platforms))
     else:
-        games = None
+        # retrieve user's platforms
+        db = read_session()
+        platforms = db.query(Platform.name). \
+                       join(UserPlatform). \
+                       filter(UserPlatform.user_id == current_user.id). \
+                       order_by(Platform.name). \
+                       all()
+        platforms = [{"name": platform.name} for platform in platforms]
+
+        # render list (list_type) with user's entries and platforms, sending each platform's
+        # entries to the browser as soon as they're read from the database, and caching
+        # them once they've all been read
+        user_id = current_user.id
+        def cache_page(groups):
+            if db is db_session or time.time() - list_cache.get("changed:{}".format(user_id), 0) >= REPLICA_LAG:
+                list_cache.set("lists:" + version, (platforms, groups))
+        groups = collecting(list_groups(db, current_user.id, list_type), cache_page)
+        response = Response(stream_with_context(stream_template("list.html", list_type=list_type,
+                                                                groups=groups, platforms=platforms)))
+
+        # stream_with_context reopens the session from the request cookie, bringing
+        # the messages read above back with it, so remove them again
+        session.pop("_flashes", None)
+
+    # make the browser check whether the list has changed every time it's displayed
+    if not flashes:
+        response.set_etag(version)
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    return response
+
+@app.route("/api/lists/<list_type:list_type>")
+@login_required
+def list_entries(list_type):
+    """
+    Route for fetching the entries of a user's list as JSON, one page at a time
+    """
+
+    # retrieve page size and the position of the previous page's last entry, if any
+    limit = max(1, min(request.args.get("limit", 100, type=int), 500))
+    after = request.args.get("after")
+    try:
+        after = decode_cursor(after, 3) if after else None
+    except ValueError:
+        abort(400)
 
-    # render list (list_type) with user's entries and platforms
-    return render_template("list.html", list_type=list_type, games=games, platforms=platforms)
+    entries = list_entries_page(read_session(), current_user.id, list_type, after, limit)
+
+    # only point to a next page if this one was full
+    if len(entries) == limit:
+        last = entries[-1]
+        next_page = encode_cursor([last.platform, last.name, last.id])
+    else:
+        next_page = None
+
+    return jsonify(entries=[entry._asdict() for entry in entries], next=next_page)
+
+def bulk_selection():
+    """
+    Returns the entry IDs and platform ID selected by a bulk operation's JSON body,
+    {"entries": [<entry ID>, ...], "platform": <platform name>, "all": <bool>},
+    aborting with 400 if the selection is missing or invalid
+    """
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400)
+
+    entry_ids = body.get("entries")
+    if entry_ids is not None and (not isinstance(entry_ids, list) or
+                                  not all(type(entry_id) in (int, long) for entry_id in entry_ids)):
+        abort(400)
+
+    platform_id = None
+    if body.get("platform") is not None:
+        if not isinstance(body["platform"], basestring):
+            abort(400)
+        platform = platform_registry.by_name(body["platform"])
+        if not platform:
+            abort(400)
+        platform_id = platform.id
+
+    # make sure a whole list is never emptied by accident
+    if entry_ids is None and platform_id is None and body.get("all") is not True:
+        abort(400)
+
+    return entry_ids, platform_id
+
+@app.route("/api/lists/<list_type:list_type>/move", methods=["POST"])
+@login_required
+def move_entries(list_type):
+    """
+    Route for moving many entries of a user's list (list_type) to another list at once
+    """
+
+    # retrieve the entries to move and the list to move them to, and make sure they're valid
+    entry_ids, platform_id = bulk_selection()
+    to_list_type = request.get_json().get("to")
+    if not isinstance(to_list_type, basestring) or to_list_type not in LIST_TYPES or to_list_type == list_type:
+        abort(400)
+
+    moved = move_list_entries(db_session, current_user.id, list_type, to_list_type, entry_ids, platform_id)
+    db_session.commit()
+    if moved:
+        invalidate_lists(current_user.id, list_type)
+        invalidate_lists(current_user.id, to_list_type)
+
+    return jsonify(moved=moved)
+
+@app.route("/api/lists/<list_type:list_type>/delete", methods=["POST"])
+@login_required
+def delete_entries(list_type):
+    """
+    Route for deleting many entries of a user's list (list_type) at once
+    """
+
+    entry_ids, platform_id = bulk_selection()
+
+    deleted = delete_list_entries(db_session, current_user.id, list_type, entry_ids, platform_id)
+    db_session.commit()
+    if deleted:
+        invalidate_lists(current_user.id, list_type)
+
+    return jsonify(deleted=deleted)
+
+@app.route("/covers/<int:igdb_id>")
+def cover(igdb_id):
+    """
+    Route for serving a game's cover, fetched from IGDB the first time it's requested
+    """
+
+    image = cover_store.get(igdb_id, lambda: db_session.query(Game.image_url).
+                                                        filter(Game.igdb_id == igdb_id).
+                                                        scalar())
+
+    # covers that are missing might show up later, so only let browsers keep the placeholder for a while
+    if image is None:
+        response = cover_placeholder()
+        response.cache_control.max_age = 3600
+        return response
+
+    response = Response(image, mimetype="image/jpeg")
+    response.set_etag(hashlib.sha1(image).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = COVER_MAX_AGE
+    return response.make_conditional(request)
+
+@app.route("/covers/placeholder.svg")
+def cover_placeholder():
+    """
+    Route for serving the image shown in place of missing covers
+    """
+
+    response = Response(PLACEHOLDER_SVG, mimetype="image/svg+xml")
+    response.set_etag(hashlib.sha1(PLACEHOLDER_SVG).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = COVER_MAX_AGE
+    return response.make_conditional(request)
 
 @app.route("/search")
 def search():
@@ -193,73 +532,145 @@ def search():
     if not api_key:
         raise RuntimeError("API_KEY not set")
 
-    # search API for matching games
-    # http://unirest.io/python.html
-    response = unirest.get("https://igdbcom-internet-game-database-v1.p.mashape.com/games/",
-        headers={ 
-            "X-Mashape-Key": api_key,
-            "Accept": "application/json"
-        }, 
-        params={ 
-            "fields": "name,cover",
-            "limit": 10,
-            "search": q
-        }
-    ).body
+    # search games that were already added by users first, and
+    # return them right away if there are enough of them
+    game_index.reload(lambda: current_version(GAMES_VERSION), all_games, GAME_INDEX_CHECK)
+    local_results = game_index.search(q, SEARCH_LIMIT)
+    if len(local_results) >= LOCAL_SEARCH_MIN:
+        return jsonify(results=local_results)
+
+    # normalize the query so that differently cased or spaced
+    # versions of the same search share a cache entry
+    q = " ".join(q.lower().split())
+
+    # don't hold on to a database connection (e.g. from loading the user) while waiting on IGDB
+    db_session.remove()
+
+    # search API for matching games (only on a cache miss), making do
+    # with the local results if the API is failing or too slow to respond
+    try:
+        with request_metrics.timed("igdb"):
+            response = search_cache.get_or_load(q, lambda: igdb.search(q, SEARCH_LIMIT))
+    except IGDBError as e:
+        app.logger.warning("IGDB search failed: %s", e)
+        return jsonify(results=local_results)
+
+    # add API results the local search didn't already find
+    local_ids = set(game["id"] for game in local_results)
+    results = local_results + [game for game in response if game["id"] not in local_ids]
 
     # return the search results
-    return jsonify(results=response)
+    return jsonify(results=results[:SEARCH_LIMIT])
 
-@app.route("/add-game/<string:list_type>", methods=["POST"])
-@login_required
-def add_game(list_type):
+def add_entry(list_type, values):
     """
-    Route to handle adding games to various lists
+    Adds the game in values (the add game form's fields) to the current user's list (list_type)
+
+    Returns the added entry, as a dict of its id, platform, igdb_id, name and image_url,
+    and None, or None and a message saying why the game couldn't be added
     """
 
     # retrieve form data
-    platform = request.form.get("platform")
-    igdb_id = request.form.get("igdb_id")
-    game_name = request.form.get("game_name")
-    image_url = request.form.get("image_url")
+    platform = values.get("platform")
+    igdb_id = u"{}".format(values.get("igdb_id") or "")
+    game_name = values.get("game_name")
+    image_url = values.get("image_url") or ""
 
     # make sure none of the fields in the form were blank
-    if not all([platform, igdb_id]) or platform == "Platform":
-        flash("Game and/or platform missing, couldn't add to your {}. Please try again.".format(list_type), "danger")
-        return redirect(url_for("lists", list_type=list_type))
+    if not all([platform, igdb_id, game_name]) or platform == "Platform":
+        return None, "Game and/or platform missing, couldn't add to your {}. Please try again.".format(list_type)
+
+    # make sure the fields are text, as JSON bodies may hold anything
+    if not all(isinstance(value, basestring) for value in [platform, game_name, image_url]):
+        return None, "Uh oh, something went wrong."
+
+    # get platform ID based on the value provided in the form
+    platform_entry = platform_registry.by_name(platform)
+    if not platform_entry or not igdb_id.isdigit():
+        return None, "Uh oh, something went wrong."
+    platform_id = platform_entry.id
+
+    # insert the game unless it's already in the database, then insert the entry
+    # unless the user already has the game under this platform, all in one transaction
+    # (the unique indexes on both tables make this safe against concurrent adds)
+    game, created = get_or_create_game(db_session, int(igdb_id), game_name, image_url)
+    if not game:
+        db_session.rollback()
+        return None, "Game and/or platform missing, couldn't add to your {}. Please try again.".format(list_type)
+    # the entry's foreign key to the user's platforms rejects platforms the user doesn't have
+    try:
+        entry_id = add_list_entry(db_session, current_user.id, game.id, platform_id, list_type)
+    except IntegrityError:
+        db_session.rollback()
+        return None, "You don't have {} in your platforms.".format(platform)
+    db_session.commit()
+    if entry_id:
+        invalidate_lists(current_user.id, list_type)
 
-    # get platform ID from database based on the value provided in the form
-    platform_id = db_session.query(Platform).filter(Platform.name == platform).first().id
+    # make the new game searchable locally
+    if created:
+        game_index.add(game.igdb_id, game.name, game.image_url)
 
-    # query database for requested game
-    game = db_session.query(Game).filter(Game.igdb_id == igdb_id).first()
+    # if the entry was already in the database
+    if not entry_id:
+        return None, "{} is already in your {} under {}.".format(game.name, list_type, platform)
 
-    # if the game doesn't exist in the database, insert it
-    if not game:
-        game = Game(igdb_id, game_name, image_url)
-        db_session.add(game)
-        db_session.commit()
+    return {"id": entry_id, "platform": platform_entry.name, "igdb_id": game.igdb_id,
+            "name": game.name, "image_url": game.image_url}, None
 
-    # query the database and check if the entry the user is about to add
-    # already exists, in order to ensure the user doesn't add duplicates
-    if not db_session.query(ListEntry).filter(ListEntry.user_id == current_user.id). \
-                                       filter(ListEntry.game_id == game.id). \
-                                       filter(ListEntry.platform_id == platform_id). \
-                                       first():
-        # if the entry doesn't exist in the database, insert it
-        db_session.add(ListEntry(current_user.id, game.id, platform_id, list_type))
-        db_session.commit()
-    # if the entry is already in the database
-    else:
-        # redirect user to current list, displaying an error message
-        flash("{} is already in your {} under {}.".format(game.name,list_type, platform), "danger")
+def delete_entry(list_type, entry_filter):
+    """
+    Deletes the entry of the current user's list (list_type) matching entry_filter,
+    a SQLAlchemy condition on ListEntry, Game and Platform
+
+    Returns the deleted entry, as a dict like those of add_entry(), or None if
+    there wasn't such an entry
+    """
+
+    # query database for the ID of the entry to delete, as well as
+    # the associated game and platform
+    entry = db_session.query(ListEntry.id, ListEntry.platform_id, Platform.name.label("platform"), Game.igdb_id,
+                             Game.name, Game.image_url). \
+                       join(Game). \
+                       join(Platform). \
+                       filter(ListEntry.user_id == current_user.id). \
+                       filter(ListEntry.list_type == list_type). \
+                       filter(entry_filter). \
+                       first()
+
+    # make sure the entry exists in the database
+    if not entry:
+        return None
+
+    # delete the list entry, and count it out of the list in the same transaction
+    deleted = db_session.query(ListEntry).filter(ListEntry.id == entry.id).delete()
+    change_list_count(db_session, current_user.id, list_type, entry.platform_id, -deleted)
+    db_session.commit()
+    invalidate_lists(current_user.id, list_type)
+
+    entry = entry._asdict()
+    del entry["platform_id"]
+    return entry
+
+@app.route("/add-game/<list_type:list_type>", methods=["POST"])
+@login_required
+def add_game(list_type):
+    """
+    Route to handle adding games to various lists
+    """
+
+    entry, error = add_entry(list_type, request.form)
+
+    # redirect user to current list, displaying an error message
+    if error:
+        flash(error, "danger")
         return redirect(url_for("lists", list_type=list_type))
 
     # redirect user to current list, displaying a success message
-    flash("{} successfully added to your {} under {}.".format(game.name, list_type, platform), "success")
+    flash("{} successfully added to your {} under {}.".format(entry["name"], list_type, entry["platform"]), "success")
     return redirect(url_for("lists", list_type=list_type))
 
-@app.route("/delete-game/<string:list_type>", methods=["POST"])
+@app.route("/delete-game/<list_type:list_type>", methods=["POST"])
 @login_required
 def delete_game(list_type):
     """
@@ -276,30 +687,72 @@ def delete_game(list_type):
     if not platform:
         raise RuntimeError("missing parameter: platform")
 
-    # query database for the ID of the entry to delete, as well as 
-    # the associated game name
-    entry = db_session.query(ListEntry.id, Game.name). \
-                          join(Game). \
-                          join(Platform). \
-                          filter(ListEntry.list_type == list_type). \
-                          filter(Game.igdb_id == igdb_id). \
-                          filter(Platform.name == platform). \
-                          first()
-
-    # make sure the entry exists in the database
-    if not entry.id:
+    entry = delete_entry(list_type, and_(Game.igdb_id == igdb_id, Platform.name == platform))
+    if not entry:
         flash("Uh oh, something went wrong.", "danger")
-        redirect(url_for("lists"), list_type=list_type)
-
-    # delete the list entry
-    db_session.query(ListEntry).filter(ListEntry.id == entry.id).delete()
-    db_session.commit()
+        return redirect(url_for("lists", list_type=list_type))
 
     # redirect user to the current list, displaying a success message
     flash("{} under {} successfully deleted from your {}."
-        .format(entry.name, platform, list_type), "success")
+        .format(entry["name"], platform, list_type), "success")
     return redirect(url_for("lists", list_type=list_type))
 
+@app.route("/api/lists/<list_type:list_type>/entries", methods=["POST"])
+@login_required
+def add_entry_json(list_type):
+    """
+    Route for adding a game to a user's list (list_type) without reloading it, taking
+    the add game form's fields and responding with the added entry as JSON
+    """
+
+    # take the fields from a JSON object, or from the form if the body isn't JSON
+    values = request.get_json(silent=True)
+    if values is None:
+        values = request.form
+    elif not isinstance(values, dict):
+        return jsonify(error="Uh oh, something went wrong."), 400
+
+    entry, error = add_entry(list_type, values)
+    if error:
+        return jsonify(error=error), 400
+
+    return jsonify(entry=entry, message="{} successfully added to your {} under {}."
+                                        .format(entry["name"], list_type, entry["platform"])), 201
+
+@app.route("/api/lists/<list_type:list_type>/entries/<int:entry_id>", methods=["DELETE"])
+@login_required
+def delete_entry_json(list_type, entry_id):
+    """
+    Route for deleting an entry of a user's list (list_type) without reloading it,
+    responding with the deleted entry as JSON
+    """
+
+    entry = delete_entry(list_type, ListEntry.id == entry_id)
+    if not entry:
+        return jsonify(error="Uh oh, something went wrong."), 404
+
+    return jsonify(entry=entry, message="{} under {} successfully deleted from your {}."
+                                        .format(entry["name"], entry["platform"], list_type))
+
+@app.route("/stats")
+@login_required
+def stats():
+    """
+    Route for fetching the number of games in each of the user's lists as JSON,
+    in total and under each of their platforms
+    """
+
+    lists = dict((list_type, {"total": 0, "platforms": {}}) for list_type in LIST_TYPES)
+    for list_type, platform_id, entries in list_counts(read_session(), current_user.id):
+        # the platform may have been deleted since the counts were read
+        platform = platform_registry.get(platform_id)
+        if not platform:
+            continue
+        lists[list_type]["total"] += entries
+        lists[list_type]["platforms"][platform.name] = entries
+
+    return jsonify(lists=lists, total=sum(counts["total"] for counts in lists.values()))
+
 @app.route("/account-settings")
 @login_required
 def account_settings():
@@ -308,17 +761,14 @@ def account_settings():
     """
 
     # query database for user's platforms
-    user_platforms = db_session.query(UserPlatform, Platform.name). \
-                                join(Platform). \
-                                filter(UserPlatform.user_id == current_user.id). \
-                                order_by(Platform.name). \
-                                with_entities(Platform.name). \
-                                all()
-
-    # query database for all existing platforms
-    platforms = db_session.query(Platform.name). \
-                           order_by(Platform.name). \
-                           all()
+    user_platforms = read_session().query(UserPlatform.platform_id). \
+                                    filter(UserPlatform.user_id == current_user.id). \
+                                    all()
+    user_platforms = [platform_registry.get(platform.platform_id) for platform in user_platforms]
+    user_platforms = sorted([platform for platform in user_platforms if platform], key=lambda platform: platform.name)
+
+    # retrieve all existing platforms
+    platforms = platform_registry.all()
 
     return render_template("account-settings.html", user_platforms=user_platforms, platforms=platforms)
 
@@ -336,14 +786,17 @@ def change_email():
         flash("Password and/or email address missing.", "danger")
         return redirect(url_for("account_settings"))
 
-    # make sure the password the user has entered is correct
-    if not pwd_context.verify(password, current_user.password):
+    # make sure the password the user has entered is correct, checking it
+    # against the database since cached users don't have a password
+    user = User.query.get(current_user.id)
+    if not hasher.verify(password, user.password):
         flash("You've entered a wrong password.", "danger")
         return redirect(url_for("account_settings"))
 
     # change the user's email address
-    User.query.get(current_user.id).email = email
+    user.email = email
     db_session.commit()
+    invalidate_user(current_user.id)
 
     # redirect the user to their settings page with a success message
     flash("Email address successfully changed.", "success")
@@ -365,8 +818,10 @@ def change_password():
         flash("Current password, new password, and/or password confirmation missing", "danger")
         return redirect(url_for("account_settings"))
 
-    # make sure the current password is correct
-    if not pwd_context.verify(current_password, current_user.password):
+    # make sure the current password is correct, checking it against
+    # the database since cached users don't have a password
+    user = User.query.get(current_user.id)
+    if not hasher.verify(current_password, user.password):
         flash("You've entered a wrong current password.", "danger")
         return redirect(url_for("account_settings"))
 
@@ -376,13 +831,47 @@ def change_password():
         return redirect(url_for("account_settings"))
 
     # change the user's password
-    User.query.get(current_user.id).password = pwd_context.encrypt(new_password)
+    user.password = hasher.encrypt(new_password)
     db_session.commit()
+    invalidate_user(current_user.id)
 
     # redirect the user to their settings page with a success message
     flash("Password successfully changed.", "success")
     return redirect(url_for("account_settings"))
 
+@app.route("/delete-account", methods=["POST"])
+@login_required
+def delete_account():
+    """
+    Route for deleting the user's account, along with their platforms and lists
+    """
+
+    # retrieve user's password and make sure it's not missing
+    password = request.form.get("password")
+    if not password:
+        flash("Password missing.", "danger")
+        return redirect(url_for("account_settings"))
+
+    # make sure the password the user has entered is correct, checking it
+    # against the database since cached users don't have a password
+    user = User.query.get(current_user.id)
+    if not hasher.verify(password, user.password):
+        flash("You've entered a wrong password.", "danger")
+        return redirect(url_for("account_settings"))
+
+    # delete the user, which also deletes their platforms and list
+    # entries as they cascade on the user being deleted
+    user_id = current_user.id
+    db_session.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+    db_session.commit()
+
+    # forget everything cached about the user, as their ID may be reused
+    invalidate_user(current_user.id)
+    invalidate_lists(user_id)
+    logout_user()
+
+    return redirect(url_for("index"))
+
 @app.route("/add-platform", methods=["POST"])
 @login_required
 def add_platform():
@@ -395,11 +884,9 @@ def add_platform():
     if not platform_name:
         raise RuntimeError("missing parameter: platform_name")
 
-    # query database for requested platform, making sure to perform a case-insensitive
+    # look up requested platform, making sure to perform a case-insensitive
     # search (the user could have typed in all lower case, for instance)
-    platform = db_session.query(Platform). \
-                             filter(func.lower(Platform.name) == func.lower(platform_name)). \
-                             first()
+    platform = platform_registry.find(platform_name)
 
     # make sure the requested platform exists in the database
     if not platform:
@@ -419,6 +906,7 @@ def add_platform():
         # if the entry doesn't exist in the database, insert it
         db_session.add(UserPlatform(current_user.id, platform_id))
         db_session.commit()
+        invalidate_lists(current_user.id)
     # if the entry is already in the database
     else:
         # redirect user to current list, displaying an error message
@@ -441,37 +929,125 @@ def delete_platform():
     if not platform_name:
         raise RuntimeError("missing parameter: platform_name")
 
-    # query database for the ID of the platform to delete
-    platform_id = db_session.query(UserPlatform.id, Platform.id). \
-                             join(Platform). \
-                             filter(UserPlatform.user_id == current_user.id). \
-                             filter(Platform.name == platform_name). \
-                             first()
-
-    # make sure the platform exists in the database
-    if not platform_id[0]:
+    # delete the platform, which also deletes all games associated with it
+    # as list entries cascade on the user's platform being deleted
+    platform = platform_registry.by_name(platform_name)
+    deleted = platform and db_session.query(UserPlatform). \
+                                      filter(UserPlatform.user_id == current_user.id). \
+                                      filter(UserPlatform.platform_id == platform.id). \
+                                      delete(synchronize_session=False)
+
+    # make sure the platform existed in the database
+    if not deleted:
+        db_session.rollback()
         flash("Uh oh, something went wrong.", "danger")
         return redirect(url_for("account_settings"))
-
-    # delete all games associated with platform
-    db_session.query(ListEntry).filter(ListEntry.user_id == current_user.id). \
-                                filter(ListEntry.platform_id == platform_id[1]). \
-                                delete()
-    # delete platform
-    db_session.query(UserPlatform).filter(UserPlatform.id == platform_id[0]).delete()
     db_session.commit()
+    invalidate_lists(current_user.id)
 
     # redirect user to their settings page, displaying a success message
     flash("{} successfully deleted from your platforms.".format(platform_name), "success")
     return redirect(url_for("account_settings"))
 
+@app.route("/export/<string:file_format>")
+@login_required
+def export_lists(file_format):
+    """
+    Route for downloading all of the user's list entries as CSV or JSON
+    """
+
+    # make sure the requested format is supported
+    formats = {
+        "csv": (to_csv, "text/csv"),
+        "json": (to_json, "application/json")
+    }
+    if file_format not in formats:
+        raise RuntimeError("unsupported export format: {}".format(file_format))
+    formatter, mimetype = formats[file_format]
+
+    # stream the entries to the user as they are read from the database
+    # http://flask.pocoo.org/docs/0.12/patterns/streaming/
+    entries = formatter(export_entries(read_session(), current_user.id))
+    return Response(stream_with_context(entries), mimetype=mimetype, headers={
+        "Content-Disposition": "attachment; filename=tracklog.{}".format(file_format)
+    })
+
+@app.route("/import", methods=["POST"])
+@login_required
+def import_lists():
+    """
+    Route for adding list entries in bulk from an uploaded CSV or JSON file
+    """
+
+    # retrieve the uploaded file and make sure it's not missing
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Please choose a file to import.", "danger")
+        return redirect(url_for("account_settings"))
+
+    # determine the file format from its extension
+    parsers = {
+        "csv": from_csv,
+        "json": from_json
+    }
+    extension = upload.filename.rsplit(".", 1)[-1].lower()
+    if extension not in parsers:
+        flash("Only .csv and .json files can be imported.", "danger")
+        return redirect(url_for("account_settings"))
+
+    # parse and insert the file's entries in batches, all in one transaction
+    games = []
+    try:
+        imported, skipped = import_entries(db_session, current_user.id, parsers[extension](upload.stream),
+                                           platform_ids=platform_registry.ids(), on_games=games.extend)
+    except (ValueError, csv.Error):
+        db_session.rollback()
+        flash("The file you've uploaded couldn't be read. Please check its format and try again.", "danger")
+        return redirect(url_for("account_settings"))
+    db_session.commit()
+    invalidate_lists(current_user.id)
+
+    # make the imported games searchable locally, now that they're sure to be in the database
+    for game in games:
+        game_index.add(*game)
+
+    # redirect user to their settings page, displaying how many entries were imported
+    flash("{} game(s) imported, {} skipped (already in your lists or missing data).".format(imported, skipped), "success")
+    return redirect(url_for("account_settings"))
+
+@app.route("/metrics")
+def metrics():
+    """
+    Route for Prometheus to scrape the metrics of every worker process from, which
+    requires the token in METRICS_TOKEN as a bearer token if it's set
+    """
+
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != "Bearer " + token:
+        abort(401)
+
+    return Response(request_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.errorhandler(HashingPoolSaturated)
+def hashing_pool_saturated(error):
+    """
+    Tells the client to retry shortly when too many passwords are waiting to be hashed
+    """
+
+    return "Too many login attempts at once, please try again in a moment.", 503, {"Retry-After": "1"}
+
 @login_manager.user_loader
 def load_user(user_id):
     """
     https://flask-login.readthedocs.io/en/latest/
     """
 
-    return User.query.get(user_id)
+    # serve the user from cache, only querying the database on a miss
+    def query_user():
+        user = User.query.get(user_id)
+        return CachedUser(user) if user else None
+
+    return user_cache.get_or_load(user_cache_key(user_id), query_user)
 
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,236 @@
+"""
+Builds the static assets for production: concatenates each bundle's CSS and JS files,
+names every file after a hash of its contents and writes gzip (and, if the brotli
+package is installed, brotli) compressed copies next to them, into static/build/
+
+Assets then serves the built files with far-future cache headers, falling back to
+the original files when nothing has been built (e.g. in development).
+Usage: python assets.py
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+from collections import OrderedDict
+from io import BytesIO
+
+from flask import abort, request, send_file, url_for
+from flask.helpers import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# where built files go, relative to the static folder
+BUILD_DIR = "build"
+
+# files served together, in the order they're included in
+BUNDLES = OrderedDict([
+    ("css/tracklog.css", ["css/bootstrap.min.css", "css/font-awesome.min.css", "css/styles.css"]),
+    ("js/tracklog.js", ["js/jquery-3.1.1.min.js", "js/bootstrap.min.js", "js/script.js"])
+])
+
+# file types worth compressing, others (fonts like woff2, images) already are
+COMPRESSIBLE = (".css", ".js", ".svg", ".eot", ".ttf", ".otf", ".json", ".txt")
+
+# built files never change, since their names change along with their contents
+MAX_AGE = 365 * 24 * 3600
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+def fingerprinted(name, content):
+    """
+    Returns name with a hash of content added before its extension
+    """
+
+    base, extension = posixpath.splitext(name)
+    return "{}.{}{}".format(base, hashlib.md5(content).hexdigest()[:12], extension)
+
+def rewrite_css_urls(content, source, target, manifest):
+    """
+    Points the relative URLs in the CSS file source at the fingerprinted files in
+    manifest, relative to where the CSS file target is built
+    """
+
+    def rewrite(match):
+        url = match.group(2)
+        if url.startswith(("data:", "http:", "https:", "//", "/")):
+            return match.group(0)
+
+        # keep query strings and fragments (e.g. the ?#iefix font hack) as they are
+        path, suffix = re.match(r"([^?#]*)(.*)", url).groups()
+        name = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+        if name not in manifest:
+            return match.group(0)
+
+        path = posixpath.relpath(manifest[name], posixpath.dirname(posixpath.join(BUILD_DIR, target)))
+        return "url({0}{1}{2}{0})".format(match.group(1), path, suffix)
+
+    return CSS_URL.sub(rewrite, content)
+
+def compress(content):
+    """
+    Returns content compressed with gzip, and with brotli if it's available
+    """
+
+    buffer = BytesIO()
+    # a fixed mtime makes builds of the same files identical
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as gzip_file:
+        gzip_file.write(content)
+    compressed = {".gz": buffer.getvalue()}
+
+    if brotli is not None:
+        compressed[".br"] = brotli.compress(content)
+
+    return compressed
+
+def build(static_dir=STATIC_DIR):
+    """
+    Builds every static file and bundle into static_dir/build/, writing a manifest
+    of original to built names, and returns the size of each bundle, compressed or not
+    """
+
+    output_dir = os.path.join(static_dir, BUILD_DIR)
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    # read every static file, except earlier builds
+    sources = {}
+    for directory, subdirectories, files in os.walk(static_dir):
+        if os.path.abspath(directory) == os.path.abspath(static_dir) and BUILD_DIR in subdirectories:
+            subdirectories.remove(BUILD_DIR)
+        for filename in files:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, static_dir).replace(os.sep, "/")
+            with open(path, "rb") as source_file:
+                sources[name] = source_file.read()
+
+    manifest = {}
+    sizes = OrderedDict()
+
+    def write(name, content):
+        built_name = posixpath.join(BUILD_DIR, fingerprinted(name, content))
+        manifest[name] = built_name
+
+        path = os.path.join(static_dir, *built_name.split("/"))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as built_file:
+            built_file.write(content)
+
+        size = {"bytes": len(content)}
+        if name.endswith(COMPRESSIBLE):
+            for extension, compressed in compress(content).items():
+                # only keep compressed copies that are actually smaller
+                if len(compressed) < len(content):
+                    with open(path + extension, "wb") as compressed_file:
+                        compressed_file.write(compressed)
+                    size[{".gz": "gzip_bytes", ".br": "brotli_bytes"}[extension]] = len(compressed)
+        return size
+
+    # CSS refers to other files, so build it last, once their names are known
+    for name in sorted(sources, key=lambda name: (name.endswith(".css"), name)):
+        content = sources[name]
+        if name.endswith(".css"):
+            content = rewrite_css_urls(content, name, name, manifest)
+        write(name, content)
+
+    for bundle, names in BUNDLES.items():
+        if bundle.endswith(".css"):
+            parts = [rewrite_css_urls(sources[name], name, bundle, manifest) for name in names]
+            content = b"\n".join(parts)
+        else:
+            # guard against files that don't end their last statement
+            content = b";\n".join(sources[name] for name in names)
+        sizes[bundle] = write(bundle, content)
+        sizes[bundle]["source_files"] = len(names)
+
+    with open(os.path.join(output_dir, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    return sizes
+
+class Assets(object):
+    """
+    Makes url_for("static", ...) point at built files, and serves them
+    precompressed and with far-future cache headers
+    """
+
+    def __init__(self, app=None, static_dir=STATIC_DIR):
+        self.static_dir = static_dir
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.load()
+        app.url_defaults(self.built_url)
+        app.jinja_env.globals["bundle_urls"] = self.bundle_urls
+
+        # replace Flask's static file handler, which still serves files that weren't built
+        send_static_file = app.view_functions["static"]
+        app.view_functions["static"] = lambda filename: self.serve(filename, send_static_file)
+
+    def load(self):
+        """
+        Reads the manifest of built files, if there is one
+        """
+
+        try:
+            with open(os.path.join(self.static_dir, BUILD_DIR, "manifest.json")) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        except IOError:
+            self.manifest = {}
+
+    def built_url(self, endpoint, values):
+        if endpoint == "static" and values.get("filename") in self.manifest:
+            values["filename"] = self.manifest[values["filename"]]
+
+    def bundle_urls(self, bundle):
+        """
+        Returns the URLs to include a bundle with, the built bundle's or,
+        if it wasn't built, those of the files in it
+        """
+
+        names = [bundle] if bundle in self.manifest else BUNDLES[bundle]
+        return [url_for("static", filename=name) for name in names]
+
+    def serve(self, filename, send_static_file):
+        """
+        Serves a static file, built ones compressed with the best encoding the browser accepts
+        """
+
+        if not filename.startswith(BUILD_DIR + "/"):
+            return send_static_file(filename=filename)
+
+        path = safe_join(self.static_dir, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+        encoding = None
+        for name, extension in [("br", ".br"), ("gzip", ".gz")]:
+            if request.accept_encodings[name] and os.path.isfile(path + extension):
+                path += extension
+                encoding = name
+                break
+
+        response = send_file(path, mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                             conditional=True, cache_timeout=MAX_AGE)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = "public, max-age={}, immutable".format(MAX_AGE)
+        return response
+
+if __name__ == "__main__":
+    for bundle, size in build().items():
+        print("{}: {}".format(bundle, ", ".join("{} {}".format(size[key], key)
+                                                for key in sorted(size))))
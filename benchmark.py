@@ -0,0 +1,1243 @@
+"""
+Benchmarks for Tracklog
+
+Usage: python benchmark.py <benchmark> [options]
+Run python benchmark.py --help for the list of benchmarks.
+"""
+
+import argparse
+import json
+import os
+import posixpath
+import random
+import tempfile
+import time
+
+SYLLABLES = ["ka", "ze", "ri", "mo", "lu", "da", "so", "fi", "ne", "to", "ba", "gi", "ro", "mi",
+             "sa", "vo", "te", "na", "ku", "li", "ha", "do", "re", "xa", "pu", "che", "on", "ar"]
+
+def synthetic_words(rng, count):
+    """
+    Returns count random, pronounceable words to build game names from
+    """
+
+    return ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(count)]
+
+def synthetic_name(rng, words, i):
+    """
+    Returns a random, game-like name, made unique by its number
+    """
+
+    return "{} {}".format(" ".join(rng.choice(words) for _ in range(rng.randint(1, 4))).title(), i)
+
+def setup_database(args):
+    """
+    Points database.py at the benchmark database, a fresh SQLite file unless
+    --database was given, creates the tables and returns the engine
+    """
+
+    if not args.database:
+        args.database = "sqlite:///" + tempfile.mkstemp(prefix="tracklog-", suffix=".db")[1]
+    os.environ["DATABASE_URL"] = args.database
+    os.environ.setdefault("LIST_CACHE_URL", "sqlite:///" + tempfile.mkstemp(prefix="tracklog-lists-", suffix=".db")[1])
+
+    from database import Base, engine
+    import models
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+def chunked(rows, size=10000):
+    """
+    Splits rows into lists of at most size rows
+    """
+
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+def seed_database(engine, rng, entries, entries_per_user=1000, platforms_per_user=5, password_hash=""):
+    """
+    Fills an empty database with about entries list entries, spread over as many
+    users as needed, along with the platforms and games they reference
+    """
+
+    from models import User, Platform, UserPlatform, Game, ListEntry
+
+    users = max(1, entries // entries_per_user)
+    games = max(100, entries // 10, entries_per_user)
+    platforms = 20
+    words = synthetic_words(rng, 5000)
+
+    rows = {
+        Platform: [{"name": "Platform {}".format(i)} for i in range(1, platforms + 1)],
+        User: [{"username": "user{}".format(i), "email": "user{}@example.com".format(i),
+                "password": password_hash} for i in range(1, users + 1)],
+        Game: [{"igdb_id": i, "name": synthetic_name(rng, words, i),
+                "image_url": "//images.igdb.com/igdb/image/upload/t_thumb/{}.jpg".format(i)}
+               for i in range(1, games + 1)],
+        UserPlatform: [],
+        ListEntry: []
+    }
+    for user_id in range(1, users + 1):
+        user_platforms = rng.sample(range(1, platforms + 1), platforms_per_user)
+        rows[UserPlatform].extend({"user_id": user_id, "platform_id": platform_id}
+                                  for platform_id in user_platforms)
+        rows[ListEntry].extend({"user_id": user_id, "game_id": game_id,
+                                "platform_id": rng.choice(user_platforms),
+                                "list_type": rng.choice(["backlog", "wishlist"])}
+                               for game_id in rng.sample(range(1, games + 1), min(games, entries_per_user)))
+
+    # ids are assigned in insertion order, which the rows above rely on
+    with engine.begin() as connection:
+        for model in [Platform, User, Game, UserPlatform, ListEntry]:
+            for chunk in chunked(rows[model]):
+                connection.execute(model.__table__.insert(), chunk)
+
+    return {"users": users, "games": games, "platforms": platforms, "entries": len(rows[ListEntry])}
+
+def timed(f, repeat):
+    """
+    Calls f repeat times and returns the latency of each call in milliseconds
+    """
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.time()
+        f()
+        latencies.append((time.time() - start) * 1000)
+    return latencies
+
+def summarize(latencies):
+    """
+    Returns percentiles of a list of latencies in milliseconds
+    """
+
+    if not latencies:
+        return {"count": 0}
+
+    latencies = sorted(latencies)
+    percentile = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99)
+    }
+
+def bench_catalog(args):
+    """
+    Compares local game index lookups with a linear scan over the same names
+    """
+
+    from catalog import GameIndex, normalize
+
+    rng = random.Random(args.seed)
+    words = synthetic_words(rng, 5000)
+    rows = [(i, synthetic_name(rng, words, i), "//images.igdb.com/{}.jpg".format(i)) for i in range(args.games)]
+    queries = [rng.choice(words)[:rng.randint(2, 8)] for _ in range(args.repeat)]
+
+    index = GameIndex()
+    start = time.time()
+    index.load(rows)
+    build_ms = (time.time() - start) * 1000
+
+    names = [(normalize(name), igdb_id) for igdb_id, name, image_url in rows]
+    def scan(query):
+        return sorted(igdb_id for name, igdb_id in names if query in name)[:10]
+
+    queries_iter = iter(queries * 2)
+    return {
+        "games": args.games,
+        "build_ms": round(build_ms, 3),
+        "index": summarize(timed(lambda: index.search(next(queries_iter), 10), args.repeat)),
+        "scan": summarize(timed(lambda: scan(next(queries_iter)), args.repeat))
+    }
+
+def bench_indexes(args):
+    """
+    Times the queries behind lists(), add_game(), add_platform() and login()
+    before and after creating the indexes declared in models.py
+    """
+
+    engine = setup_database(args)
+
+    from sqlalchemy import func
+    from sqlalchemy.schema import DropIndex
+    from database import Base, db_session
+    from models import User, Platform, UserPlatform, Game, ListEntry
+    from db_migrate import create_indexes
+
+    # start from tables as they were before any indexes were declared
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(DropIndex(index))
+
+    rng = random.Random(args.seed)
+    seeded = seed_database(engine, rng, args.entries)
+    pick = lambda count: rng.randint(1, count)
+
+    queries = {
+        "lists": lambda: db_session.query(ListEntry, Game, Platform.name).join(Game).join(Platform). \
+            filter(ListEntry.user_id == pick(seeded["users"])). \
+            filter(ListEntry.list_type == "backlog"). \
+            order_by(Platform.name, Game.name).all(),
+        "add_game_game": lambda: db_session.query(Game). \
+            filter(Game.igdb_id == pick(seeded["games"])).first(),
+        "add_game_entry": lambda: db_session.query(ListEntry). \
+            filter(ListEntry.user_id == pick(seeded["users"])). \
+            filter(ListEntry.game_id == pick(seeded["games"])). \
+            filter(ListEntry.platform_id == pick(seeded["platforms"])).first(),
+        "add_platform": lambda: db_session.query(UserPlatform). \
+            filter(UserPlatform.user_id == pick(seeded["users"])). \
+            filter(UserPlatform.platform_id == pick(seeded["platforms"])).first(),
+        "login": lambda: db_session.query(User). \
+            filter(func.lower(User.username) == func.lower("USER{}".format(pick(seeded["users"])))).first()
+    }
+
+    def run():
+        results = dict((name, summarize(timed(query, args.repeat))) for name, query in queries.items())
+        db_session.remove()
+        return results
+
+    before = run()
+    with engine.begin() as connection:
+        create_indexes(connection)
+    after = run()
+
+    return {"seeded": seeded, "database": args.database, "without_indexes": before, "with_indexes": after}
+
+def bench_add_game(args):
+    """
+    Adds games from a small shared pool to random users' lists from concurrent
+    threads, reporting throughput and checking that no duplicates were created
+    """
+
+    engine = setup_database(args)
+
+    import threading
+    from sqlalchemy import func
+    from database import db_session
+    from models import Game, ListEntry, UserPlatform
+    from queries import get_or_create_game, add_list_entry
+    rng = random.Random(args.seed)
+    seeded = seed_database(engine, rng, args.entries)
+
+    # new games, not among the seeded ones, so that threads race to insert them
+    pool = range(seeded["games"] + 1, seeded["games"] + 51)
+    user_platforms = {}
+    for user_id, platform_id in db_session.query(UserPlatform.user_id, UserPlatform.platform_id):
+        user_platforms.setdefault(user_id, []).append(platform_id)
+    db_session.remove()
+    errors = []
+
+    def client(seed):
+        client_rng = random.Random(seed)
+        try:
+            for _ in range(args.repeat):
+                igdb_id = client_rng.choice(pool)
+                game, created = get_or_create_game(db_session, igdb_id, "Game {}".format(igdb_id), "")
+                user_id = client_rng.randint(1, seeded["users"])
+                add_list_entry(db_session, user_id, game.id, client_rng.choice(user_platforms[user_id]), "backlog")
+                db_session.commit()
+        except Exception as e:
+            errors.append(repr(e))
+        finally:
+            db_session.remove()
+
+    threads = [threading.Thread(target=client, args=(args.seed + i,)) for i in range(args.clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    duplicate_games = db_session.query(Game.igdb_id).group_by(Game.igdb_id). \
+                                 having(func.count() > 1).count()
+    duplicate_entries = db_session.query(ListEntry.user_id).group_by(ListEntry.user_id, ListEntry.game_id, ListEntry.platform_id). \
+                                   having(func.count() > 1).count()
+
+    return {
+        "clients": args.clients,
+        "adds": args.clients * args.repeat,
+        "adds_per_sec": round(args.clients * args.repeat / elapsed, 1),
+        "duplicate_games": duplicate_games,
+        "duplicate_entries": duplicate_entries,
+        "errors": errors
+    }
+
+def bench_import(args):
+    """
+    Imports a generated file of --entries list entries as CSV and as JSON,
+    then exports them again, reporting rows per second for each
+    """
+
+    engine = setup_database(args)
+
+    from io import BytesIO
+    from database import db_session
+    from transfer import export_entries, import_entries, to_csv, to_json, from_csv, from_json
+
+    rng = random.Random(args.seed)
+    seeded = seed_database(engine, rng, 1000, entries_per_user=500)
+    words = synthetic_words(rng, 5000)
+
+    # new games on every platform, so that both new and existing games get imported
+    rows = [{"list_type": rng.choice(["backlog", "wishlist"]), "platform": "Platform {}".format(i % seeded["platforms"] + 1),
+             "igdb_id": seeded["games"] + i // 2, "name": synthetic_name(rng, words, i), "image_url": ""}
+            for i in range(args.entries)]
+
+    results = {"rows": len(rows)}
+    for user_id, (name, formatter, parser) in enumerate([("csv", to_csv, from_csv), ("json", to_json, from_json)], 1):
+        data = "".join(formatter(iter(rows)))
+
+        start = time.time()
+        imported, skipped = import_entries(db_session, user_id, parser(BytesIO(data)))
+        db_session.commit()
+        import_seconds = time.time() - start
+
+        start = time.time()
+        exported = sum(1 for _ in export_entries(db_session, user_id))
+        export_seconds = time.time() - start
+
+        results[name] = {
+            "imported": imported,
+            "skipped": skipped,
+            "import_rows_per_sec": round(len(rows) / import_seconds, 1),
+            "export_rows_per_sec": round(exported / export_seconds, 1)
+        }
+
+    return results
+
+def login_client(app, username, password="password"):
+    """
+    Returns a test client for app logged in as username
+    """
+
+    client = app.test_client()
+    response = client.post("/login", data={"username": username, "password": password})
+    if response.status_code != 302:
+        raise RuntimeError("couldn't log in as {}".format(username))
+    return client
+
+def bench_lists_page(args):
+    """
+    Measures time to first byte, total time and peak memory growth (Linux only)
+    of rendering a list of --entries entries, streamed and fully rendered up front
+    """
+
+    engine = setup_database(args)
+
+    import multiprocessing
+    import resource
+    from passlib.apps import custom_app_context as pwd_context
+    from flask import render_template
+    from database import db_session
+    import app as tracklog
+    from queries import list_groups
+
+    rng = random.Random(args.seed)
+    seed_database(engine, rng, args.entries, entries_per_user=args.entries,
+                  password_hash=pwd_context.encrypt("password"))
+    client = login_client(tracklog.app, "user1")
+
+    # the same page, rendered in one piece the way it was before streaming
+    @tracklog.app.route("/benchmark/lists/<string:list_type>")
+    def rendered_lists(list_type):
+        groups = list(list_groups(db_session, 1, list_type))
+        return render_template("list.html", list_type=list_type, groups=groups, platforms=[])
+
+    def measure(url, results):
+        with open("/proc/self/statm") as statm:
+            start_rss_kb = int(statm.read().split()[1]) * resource.getpagesize() // 1024
+
+        start = time.time()
+        response = client.get(url, buffered=False)
+        chunks = iter(response.response)
+        size = len(next(chunks))
+        first_byte = time.time() - start
+        size += sum(len(chunk) for chunk in chunks)
+        results.put({
+            "ttfb_ms": round(first_byte * 1000, 3),
+            "total_ms": round((time.time() - start) * 1000, 3),
+            "bytes": size,
+            "peak_rss_growth_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss_kb
+        })
+
+    # measure each page in a fresh child process so that peak memory
+    # usage of one doesn't hide the other's
+    results = {"entries": args.entries}
+    for name, url in [("streamed", "/lists/backlog"), ("rendered", "/benchmark/lists/backlog")]:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measure, args=(url, queue))
+        process.start()
+        results[name] = queue.get()
+        process.join()
+
+    return results
+
+def bench_login(args):
+    """
+    Logs in from concurrent clients with passwords hashed at increasing costs,
+    reporting login latency and throughput for each
+    """
+
+    engine = setup_database(args)
+
+    import threading
+    import app as tracklog
+    from hashing import Hasher, password_context
+    from models import User
+
+    rng = random.Random(args.seed)
+    seed_database(engine, rng, args.clients * 10, entries_per_user=10)
+
+    results = {"clients": args.clients, "pool_size": int(os.environ.get("HASH_POOL_SIZE", 2))}
+    for rounds in [5000, 20000, 80000, 535000]:
+        # store hashes made with the same cost the hasher uses, so logins don't rehash
+        password = password_context(rounds).encrypt("password")
+        with engine.begin() as connection:
+            connection.execute(User.__table__.update().values(password=password))
+        tracklog.hasher = Hasher(rounds=rounds, pool_size=results["pool_size"],
+                                 max_pending=args.clients)
+        tracklog.user_cache.clear()
+
+        latencies = []
+        errors = []
+
+        def client(user_id):
+            test_client = tracklog.app.test_client()
+            data = {"username": "user{}".format(user_id), "password": "password"}
+            try:
+                for _ in range(args.repeat // args.clients):
+                    start = time.time()
+                    response = test_client.post("/login", data=data)
+                    latencies.append((time.time() - start) * 1000)
+                    if response.status_code != 302:
+                        errors.append(response.status_code)
+                    test_client.get("/logout")
+            except Exception as e:
+                errors.append(repr(e))
+
+        threads = [threading.Thread(target=client, args=(i + 1,)) for i in range(args.clients)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        results[str(rounds)] = dict(summarize(latencies),
+                                    logins_per_sec=round(len(latencies) / elapsed, 1),
+                                    errors=errors[:10])
+
+    return results
+
+def start_fake_igdb(delay=0):
+    """
+    Starts a local HTTP server answering like IGDB's game search, with IDs well
+    above those of the seeded games, and lookups of games by ID, and points
+    IGDB_URL at it
+
+    Each response is delayed by delay seconds, to stand in for a slow API.
+    """
+
+    import threading
+    import urlparse
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from BaseHTTPServer import HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse.urlparse(self.path)
+            params = urlparse.parse_qs(url.query)
+            ids = posixpath.basename(url.path)
+            if ids:
+                # lookups of games by ID, answered with the game renamed and, for every
+                # other game, with a new cover, so there's something to refresh
+                body = json.dumps([{"id": int(igdb_id), "name": "Refreshed {}".format(igdb_id),
+                                    "cover": {"url": "//images.igdb.com/igdb/image/upload/t_thumb/{}{}.jpg".format(
+                                        igdb_id, "" if int(igdb_id) % 2 else "b")}}
+                                   for igdb_id in ids.split(",")])
+            else:
+                query = params.get("search", [""])[0]
+                limit = int(params.get("limit", [10])[0])
+                first_id = 10 ** 9 + abs(hash(query)) % 10 ** 6
+                body = json.dumps([{"id": first_id + i, "name": "{} {}".format(query.title(), i),
+                                    "cover": {"url": "//images.igdb.com/igdb/image/upload/t_thumb/{}.jpg".format(first_id + i)}}
+                                   for i in range(1, limit + 1)])
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+        # let hundreds of searches connect at once
+        request_queue_size = 1024
+
+    server = Server(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    os.environ["IGDB_URL"] = "http://127.0.0.1:{}/games/".format(server.server_port)
+    os.environ.setdefault("API_KEY", "benchmark")
+    return server
+
+def bench_routes(args):
+    """
+    Drives every main route with concurrent logged in clients against a seeded
+    database and a fake IGDB, reporting latency, throughput and the number of
+    SQL queries per request for each route
+    """
+
+    engine = setup_database(args)
+    rng = random.Random(args.seed)
+
+    # searches for random pairs of words, which the search cache and local index
+    # rarely answer, so that most of them go through to the fake API
+    words = synthetic_words(random.Random(args.seed), 5000)
+    server = start_fake_igdb(delay=args.igdb_delay / 1000.0)
+
+    import threading
+    from sqlalchemy import event
+    import app as tracklog
+
+    # give every client a user of its own, so they don't trip over each other's adds and deletes
+    seeded = seed_database(engine, rng, args.entries,
+                           entries_per_user=max(1, min(1000, args.entries // args.clients)),
+                           password_hash=tracklog.hasher.context.encrypt("password"))
+    platform_names = ["Platform {}".format(i) for i in range(1, seeded["platforms"] + 1)]
+
+    # count the queries each thread runs, so they can be attributed to its current request
+    counter = threading.local()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter.queries = getattr(counter, "queries", 0) + 1
+
+    def request(client, method, url, data=None):
+        """
+        Makes a request, reading the whole response, and returns its
+        status code, latency in milliseconds and number of queries
+        """
+
+        counter.queries = 0
+        start = time.time()
+        response = client.open(url, method=method, data=data)
+        response.get_data()
+        latency = (time.time() - start) * 1000
+        response.close()
+
+        # drop messages a browser would see on the page it gets redirected to,
+        # so they don't pile up in the session cookie
+        if response.status_code == 302:
+            with client.session_transaction() as flask_session:
+                flask_session.pop("_flashes", None)
+
+        return response.status_code, latency, counter.queries
+
+    def user_platforms(user_id):
+        return [name for (name,) in engine.execute(
+            "SELECT platforms.name FROM platforms JOIN user_platforms ON platforms.id = user_platforms.platform_id "
+            "WHERE user_platforms.user_id = {}".format(int(user_id)))]
+
+    # each client gets its own user, with state carried from one route's requests to the next
+    clients = []
+    for i in range(args.clients):
+        user_id = i % seeded["users"] + 1
+        owned = user_platforms(user_id)
+        clients.append({
+            "user_id": user_id,
+            "rng": random.Random(args.seed + i),
+            "client": login_client(tracklog.app, "user{}".format(user_id)),
+            "platforms": owned,
+            "other_platforms": [name for name in platform_names if name not in owned],
+            "added_games": [],
+            "added_platforms": []
+        })
+
+    def login(state):
+        client = tracklog.app.test_client()
+        return request(client, "POST", "/login",
+                       data={"username": "user{}".format(state["user_id"]), "password": "password"})
+
+    def lists(state):
+        return request(state["client"], "GET", "/lists/" + state["rng"].choice(["backlog", "wishlist"]))
+
+    def search(state):
+        query = " ".join(state["rng"].sample(words, 2))
+        return request(state["client"], "GET", "/search?q=" + query)
+
+    def add_game(state):
+        igdb_id = state["rng"].randint(1, seeded["games"])
+        platform = state["rng"].choice(state["platforms"])
+        state["added_games"].append((igdb_id, platform))
+        return request(state["client"], "POST", "/add-game/backlog",
+                       data={"platform": platform, "igdb_id": igdb_id,
+                             "game_name": "Game {}".format(igdb_id), "image_url": ""})
+
+    def delete_game(state):
+        igdb_id, platform = state["added_games"].pop() if state["added_games"] else \
+                            (state["rng"].randint(1, seeded["games"]), state["platforms"][0])
+        return request(state["client"], "POST", "/delete-game/backlog",
+                       data={"igdb_id": igdb_id, "platform": platform})
+
+    def add_platform(state):
+        platform = state["other_platforms"][len(state["added_platforms"]) % len(state["other_platforms"])]
+        if platform not in state["added_platforms"]:
+            state["added_platforms"].append(platform)
+        return request(state["client"], "POST", "/add-platform", data={"platform_name": platform})
+
+    def delete_platform(state):
+        # once the added platforms are gone, delete seeded ones along with their entries
+        platform = (state["added_platforms"] or state["platforms"]).pop()
+        return request(state["client"], "POST", "/delete-platform", data={"platform_name": platform})
+
+    # routes run one after the other, in an order that lets deletes undo the adds before them
+    routes = [("login", login), ("lists", lists), ("search", search), ("add_game", add_game),
+              ("delete_game", delete_game), ("add_platform", add_platform),
+              ("delete_platform", delete_platform)]
+
+    results = {"clients": args.clients, "seeded": seeded, "routes": {}}
+    for name, route in routes:
+        samples = []
+        errors = []
+
+        def run(state):
+            try:
+                for _ in range(max(1, args.repeat // args.clients)):
+                    status, latency, queries = route(state)
+                    samples.append((latency, queries))
+                    if status >= 400:
+                        errors.append(status)
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                tracklog.db_session.remove()
+
+        threads = [threading.Thread(target=run, args=(state,)) for state in clients]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        results["routes"][name] = dict(summarize([latency for latency, _ in samples]),
+                                       requests_per_sec=round(len(samples) / elapsed, 1),
+                                       queries_per_request=round(sum(queries for _, queries in samples) /
+                                                                 float(max(1, len(samples))), 2),
+                                       errors=errors[:10])
+
+    server.shutdown()
+    return results
+
+def bench_bulk(args):
+    """
+    Moves and deletes --entries list entries (1000 by default) with the bulk
+    endpoints, and moves a sample of them one at a time with a delete and an
+    add per entry the way it had to be done before, reporting the cost per entry
+    """
+
+    engine = setup_database(args)
+
+    from database import db_session
+    from models import ListEntry, Game, Platform
+    import app as tracklog
+
+    rng = random.Random(args.seed)
+    entries = args.entries
+    seed_database(engine, rng, entries * 2, entries_per_user=entries * 2,
+                  password_hash=tracklog.hasher.context.encrypt("password"))
+    client = login_client(tracklog.app, "user1")
+
+    def entry_ids(list_type, limit):
+        return [entry_id for (entry_id,) in db_session.query(ListEntry.id).
+                                                       filter(ListEntry.list_type == list_type).
+                                                       order_by(ListEntry.id).limit(limit)]
+
+    def post_json(url, body):
+        start = time.time()
+        response = client.post(url, data=json.dumps(body), content_type="application/json")
+        elapsed = time.time() - start
+        if response.status_code != 200:
+            raise RuntimeError("{} responded with status {}".format(url, response.status_code))
+        return elapsed, json.loads(response.get_data())
+
+    results = {}
+
+    ids = entry_ids("backlog", entries)
+    elapsed, response = post_json("/api/lists/backlog/move", {"entries": ids, "to": "wishlist"})
+    results["bulk_move"] = {"entries": response["moved"], "ms_per_entry": round(elapsed * 1000 / len(ids), 4)}
+
+    ids = entry_ids("wishlist", entries)
+    elapsed, response = post_json("/api/lists/wishlist/delete", {"entries": ids})
+    results["bulk_delete"] = {"entries": response["deleted"], "ms_per_entry": round(elapsed * 1000 / len(ids), 4)}
+
+    # one at a time, as a delete_game and an add_game POST per entry
+    sample = db_session.query(Game.igdb_id, Game.name, Game.image_url, Platform.name.label("platform")). \
+                        select_from(ListEntry).join(Game).join(Platform). \
+                        filter(ListEntry.list_type == "wishlist"). \
+                        order_by(ListEntry.id).limit(min(entries, 100)).all()
+    db_session.remove()
+    start = time.time()
+    for entry in sample:
+        client.post("/delete-game/wishlist", data={"igdb_id": entry.igdb_id, "platform": entry.platform})
+        client.post("/add-game/backlog", data={"igdb_id": entry.igdb_id, "platform": entry.platform,
+                                               "game_name": entry.name, "image_url": entry.image_url})
+        with client.session_transaction() as flask_session:
+            flask_session.pop("_flashes", None)
+    elapsed = time.time() - start
+    results["single_move"] = {"entries": len(sample), "ms_per_entry": round(elapsed * 1000 / len(sample), 4)}
+
+    return results
+
+def bench_delete(args):
+    """
+    Deletes one of the platforms, then the account, of a user with --entries list
+    entries, reporting how long each takes and checking that nothing is left behind
+    """
+
+    engine = setup_database(args)
+
+    from sqlalchemy import func
+    from database import db_session
+    from models import User, UserPlatform, ListEntry
+    import app as tracklog
+
+    rng = random.Random(args.seed)
+    seeded = seed_database(engine, rng, args.entries * 2, entries_per_user=args.entries,
+                           password_hash=tracklog.hasher.context.encrypt("password"))
+    client = login_client(tracklog.app, "user1")
+
+    def count(model, user_id):
+        return db_session.query(func.count(model.id)).filter(model.user_id == user_id).scalar()
+
+    # one of the user's platforms, along with how many entries are under it
+    platform_id, platform_entries = db_session.query(ListEntry.platform_id, func.count(ListEntry.id)). \
+                                               filter(ListEntry.user_id == 1). \
+                                               group_by(ListEntry.platform_id).first()
+    other_user_entries = count(ListEntry, 2)
+    db_session.remove()
+
+    results = {"entries": args.entries}
+
+    start = time.time()
+    client.post("/delete-platform", data={"platform_name": "Platform {}".format(platform_id)})
+    results["delete_platform"] = {
+        "entries": platform_entries,
+        "ms": round((time.time() - start) * 1000, 3),
+        "entries_left": db_session.query(func.count(ListEntry.id)).filter(ListEntry.user_id == 1).
+                                   filter(ListEntry.platform_id == platform_id).scalar()
+    }
+    remaining = count(ListEntry, 1)
+    db_session.remove()
+
+    # the password check dominates an account deletion, so time it on its own
+    password_hash = tracklog.hasher.context.encrypt("password")
+    password_ms = summarize(timed(lambda: tracklog.hasher.verify("password", password_hash), 3))
+    start = time.time()
+    client.post("/delete-account", data={"password": "password"})
+    results["delete_account"] = {
+        "entries": remaining,
+        "ms": round((time.time() - start) * 1000, 3),
+        "password_check_ms": password_ms["p50_ms"],
+        "entries_left": count(ListEntry, 1),
+        "platforms_left": count(UserPlatform, 1),
+        "user_left": db_session.query(User).get(1) is not None,
+        "other_user_entries_kept": count(ListEntry, 2) == other_user_entries
+    }
+
+    return results
+
+def bench_assets(args):
+    """
+    Compares the requests and bytes a cold page load needs for its CSS, JS and
+    fonts, served as they are and as built by assets.py
+    """
+
+    setup_database(args)
+
+    import gzip
+    import re
+    import shutil
+    from io import BytesIO
+    import assets
+    import app as tracklog
+
+    # build a copy of the static folder, leaving any existing build alone
+    static_dir = os.path.join(tempfile.mkdtemp(prefix="tracklog-static-"), "static")
+    shutil.copytree(assets.STATIC_DIR, static_dir)
+    sizes = assets.build(static_dir)
+    client = tracklog.app.test_client()
+
+    def page_load(manifest):
+        tracklog.assets.manifest = manifest
+        html = client.get("/").data.decode("utf-8")
+        urls = re.findall(r'<(?:link[^>]*href|script[^>]*src)="(/static/[^"]+)"', html)
+
+        results = {"requests": 0, "bytes": 0, "cache_control": set()}
+        while urls:
+            url = urls.pop(0)
+            response = client.get(url, headers={"Accept-Encoding": "gzip, br"})
+            results["requests"] += 1
+            results["bytes"] += len(response.data)
+            results["cache_control"].add(response.headers.get("Cache-Control"))
+
+            # browsers only download the first font format they support, woff2 for current ones
+            if url.split("?")[0].endswith(".css"):
+                content = response.data
+                if response.headers.get("Content-Encoding") == "gzip":
+                    content = gzip.GzipFile(fileobj=BytesIO(content)).read()
+                for font in re.findall(r"""url\(['"]?([^'")?#]+\.woff2)""", content.decode("utf-8")):
+                    font_url = posixpath.normpath(posixpath.join(posixpath.dirname(url), font))
+                    if os.path.isfile(os.path.join(static_dir, font_url[len("/static/"):])):
+                        urls.append(font_url)
+
+        results["cache_control"] = sorted(results["cache_control"])
+        return results
+
+    tracklog.assets.static_dir = static_dir
+    with open(os.path.join(static_dir, assets.BUILD_DIR, "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+    original = page_load({})
+    built = page_load(manifest)
+    shutil.rmtree(os.path.dirname(static_dir))
+
+    return {
+        "bundles": sizes,
+        "original": original,
+        "built": built,
+        "bytes_saved": original["bytes"] - built["bytes"],
+        "requests_saved": original["requests"] - built["requests"]
+    }
+
+def bench_search_load(args):
+    """
+    Serves the app with gunicorn, using gunicorn_config.py, and measures the
+    latency of a list page on its own and while --clients concurrent searches
+    wait on a local IGDB taking --igdb-delay milliseconds (2000 by default) to
+    respond, once with sync workers and once with gevent workers
+    """
+
+    engine = setup_database(args)
+
+    import multiprocessing
+    import socket
+    import subprocess
+    import sys
+    import threading
+    import requests
+    from passlib.apps import custom_app_context as pwd_context
+
+    rng = random.Random(args.seed)
+    entries = min(args.entries, 1000)
+    seed_database(engine, rng, entries, entries_per_user=entries, password_hash=pwd_context.encrypt("password"))
+    delay = (args.igdb_delay or 2000) / 1000.0
+
+    # serve IGDB from its own process, so that it isn't slowed down by the searching threads
+    def serve_igdb(queue):
+        start_fake_igdb(delay)
+        queue.put(os.environ["IGDB_URL"])
+        while True:
+            time.sleep(3600)
+
+    queue = multiprocessing.Queue()
+    igdb_process = multiprocessing.Process(target=serve_igdb, args=(queue,))
+    igdb_process.daemon = True
+    igdb_process.start()
+    os.environ["IGDB_URL"] = queue.get()
+    os.environ.setdefault("API_KEY", "benchmark")
+
+    def free_port():
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def run(worker_class):
+        stop = threading.Event()
+        threads = []
+        port = free_port()
+        url = "http://127.0.0.1:{}".format(port)
+        env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY="2", GUNICORN_WORKER_CLASS=worker_class,
+                   SECRET_KEY=os.environ.get("SECRET_KEY", "benchmark"))
+        server = subprocess.Popen([sys.executable, "-c", "from gunicorn.app.wsgiapp import run; run()",
+                                   "-c", "gunicorn_config.py", "app:app"],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+        try:
+            # wait for the workers to start
+            deadline = time.time() + 30
+            while True:
+                try:
+                    requests.get(url + "/", timeout=1)
+                    break
+                except requests.RequestException:
+                    if time.time() > deadline:
+                        raise RuntimeError("gunicorn didn't start")
+                    time.sleep(0.2)
+
+            session = requests.Session()
+            response = session.post(url + "/login", data={"username": "user1", "password": "password"},
+                                    allow_redirects=False)
+            if response.status_code != 302:
+                raise RuntimeError("couldn't log in as user1")
+            cookies = session.cookies.get_dict()
+
+            def pages():
+                latencies = []
+                timeouts = 0
+                for _ in range(args.repeat):
+                    start = time.time()
+                    try:
+                        session.get(url + "/lists/backlog", timeout=10).raise_for_status()
+                        latencies.append((time.time() - start) * 1000)
+                    except requests.Timeout:
+                        timeouts += 1
+                result = summarize(latencies)
+                result["timeouts"] = timeouts
+                return result
+
+            idle = pages()
+
+            # keep --clients searches waiting on IGDB, each for a query it hasn't searched before
+            searches = []
+            def search(client):
+                i = 0
+                while not stop.is_set():
+                    i += 1
+                    start = time.time()
+                    try:
+                        response = requests.get(url + "/search", params={"q": "zq{}x{}".format(client, i)},
+                                                cookies=cookies, timeout=60)
+                        if response.status_code == 200:
+                            searches.append((time.time() - start) * 1000)
+                    except requests.RequestException:
+                        pass
+
+            for client in range(args.clients):
+                threads.append(threading.Thread(target=search, args=(client,)))
+                threads[-1].daemon = True
+                threads[-1].start()
+
+            # measure once every search is waiting on IGDB
+            time.sleep(delay)
+            loaded = pages()
+
+            # give the searches in flight time to finish, then stop
+            # the server, failing any still queued up
+            stop.set()
+            deadline = time.time() + 2 * delay
+            for thread in threads:
+                thread.join(max(0, deadline - time.time()))
+
+            return {"idle": idle, "under_search_load": loaded, "searches": summarize(searches)}
+        finally:
+            stop.set()
+            server.terminate()
+            server.wait()
+            for thread in threads:
+                thread.join()
+
+    results = {
+        "clients": args.clients,
+        "igdb_delay_ms": delay * 1000,
+        "sync": run("sync"),
+        "gevent": run("gevent")
+    }
+    igdb_process.terminate()
+    return results
+
+def bench_list_types(args):
+    """
+    Compares the size of list_entries and its indexes, and the time of the query
+    behind lists(), with list types stored as numbers and as their names
+    """
+
+    engine = setup_database(args)
+
+    from sqlalchemy import Column, Index, MetaData, String, Table, select, text
+    from database import db_session
+    from models import LIST_TYPES, Game, ListEntry, Platform
+
+    rng = random.Random(args.seed)
+    seeded = seed_database(engine, rng, args.entries)
+
+    # a copy of list_entries storing the names, the way it was before
+    table = ListEntry.__table__
+    names = Table("list_entries_names", MetaData(),
+                  *[Column(column.name, String if column.name == "list_type" else column.type,
+                           primary_key=column.primary_key, nullable=column.nullable) for column in table.columns])
+    for index in table.indexes:
+        Index(index.name.replace("list_entries", "list_entries_names"),
+              *[names.c[column.name] for column in index.columns], unique=index.unique)
+    names.create(bind=engine)
+    name_of = "CASE list_type {} END".format(" ".join("WHEN {} THEN '{}'".format(number, name)
+                                                      for name, number in LIST_TYPES.items()))
+    columns = ", ".join(column.name for column in table.columns)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO list_entries_names ({0}) SELECT {1} FROM list_entries".format(
+            columns, columns.replace("list_type", name_of))))
+
+    def sizes(table_name):
+        """
+        Returns the bytes taken up by a table and by each of its indexes
+        """
+
+        if engine.dialect.name == "postgresql":
+            rows = engine.execute(text("SELECT :table, pg_relation_size(:table) UNION ALL "
+                                       "SELECT indexname, pg_relation_size(quote_ident(indexname)) "
+                                       "FROM pg_indexes WHERE tablename = :table"), table=table_name).fetchall()
+        else:
+            # https://sqlite.org/dbstat.html
+            engine.execute(text("ANALYZE"))
+            rows = engine.execute(text("SELECT name, SUM(pgsize) FROM dbstat WHERE name = :table OR name IN "
+                                       "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table) "
+                                       "GROUP BY name"), table=table_name).fetchall()
+        return dict((name.replace(table_name, "list_entries"), int(size)) for name, size in rows)
+
+    # the query behind lists(), run against either table
+    def lists_query(entries):
+        return lambda: db_session.execute(
+            select([entries.c.id, Platform.name.label("platform"), Game.igdb_id, Game.name, Game.image_url]).
+            select_from(entries.join(Game.__table__, entries.c.game_id == Game.id).
+                        join(Platform.__table__, entries.c.platform_id == Platform.id)).
+            where(entries.c.user_id == rng.randint(1, seeded["users"])).
+            where(entries.c.list_type == rng.choice(list(LIST_TYPES))).
+            order_by(Platform.name, Game.name, entries.c.id)).fetchall()
+
+    results = {"entries": seeded["entries"]}
+    for name, entries in [("names", names), ("numbers", table)]:
+        results[name] = {"bytes": sizes(entries.name), "lists": summarize(timed(lists_query(entries), args.repeat))}
+    return results
+
+def bench_entry_writes(args):
+    """
+    Compares the server's work per game added to and deleted from a list of --entries
+    entries, through the form routes followed by the list page they redirect to, and
+    through the JSON routes updating the page in place
+    """
+
+    engine = setup_database(args)
+
+    import collections
+    from sqlalchemy import event
+    from passlib.apps import custom_app_context as pwd_context
+    from database import db_session
+    from models import Platform, UserPlatform
+    import app as tracklog
+
+    rng = random.Random(args.seed)
+    entries = min(args.entries, 5000)
+    seeded = seed_database(engine, rng, entries, entries_per_user=entries,
+                           password_hash=pwd_context.encrypt("password"))
+    client = login_client(tracklog.app, "user1")
+
+    # games the user doesn't have yet, added as though picked from IGDB's search results,
+    # and the platforms they have
+    Picked = collections.namedtuple("Picked", ["igdb_id", "name", "image_url"])
+    words = synthetic_words(rng, 1000)
+    games = [Picked(10 ** 8 + i, synthetic_name(rng, words, i), "//images.igdb.com/igdb/image/upload/t_thumb/a{}.jpg".format(i))
+             for i in range(args.repeat)]
+    platforms = [name for name, in db_session.query(Platform.name).join(UserPlatform).
+                 filter(UserPlatform.user_id == 1)]
+    db_session.remove()
+
+    statements = [0]
+    @event.listens_for(engine, "after_cursor_execute")
+    def count_statement(*args):
+        statements[0] += 1
+
+    def measure(change):
+        """
+        Returns the time, SQL statements and bytes sent for each call of change
+        """
+
+        results = {"ms": [], "statements": [], "bytes": []}
+        for game in games:
+            statements[0] = 0
+            start = time.time()
+            size = change(game)
+            results["ms"].append((time.time() - start) * 1000)
+            results["statements"].append(statements[0])
+            results["bytes"].append(size)
+        return {
+            "latency": summarize(results["ms"]),
+            "statements_per_change": round(float(sum(results["statements"])) / len(games), 2),
+            "bytes_per_change": sum(results["bytes"]) // len(games)
+        }
+
+    def form(game):
+        return {"igdb_id": game.igdb_id, "game_name": game.name, "image_url": game.image_url,
+                "platform": platforms[game.igdb_id % len(platforms)]}
+
+    def redirected(response):
+        """
+        Follows a form route's redirect to the list page, as the browser does
+        """
+
+        if response.status_code != 302:
+            raise RuntimeError("unexpected status {}".format(response.status_code))
+        page = client.get("/lists/backlog")
+        return len(response.data) + len(page.data)
+
+    added = {}
+    def add_json(game):
+        response = client.post("/api/lists/backlog/entries", data=form(game))
+        added[game.igdb_id] = json.loads(response.data)["entry"]["id"]
+        return len(response.data)
+
+    def delete_json(game):
+        return len(client.delete("/api/lists/backlog/entries/{}".format(added[game.igdb_id])).data)
+
+    return {
+        "entries": seeded["entries"],
+        "form_and_page": {
+            "add": measure(lambda game: redirected(client.post("/add-game/backlog", data=form(game)))),
+            "delete": measure(lambda game: redirected(client.post("/delete-game/backlog", data=form(game))))
+        },
+        "json": {
+            "add": measure(add_json),
+            "delete": measure(delete_json)
+        }
+    }
+
+def bench_stats(args):
+    """
+    Compares reading a user's list counts from list_counts with counting their
+    entries with GROUP BY, for a user with --entries entries, and times
+    rebuilding and verifying the counts of every user
+    """
+
+    engine = setup_database(args)
+
+    from sqlalchemy import func
+    from database import db_session
+    from models import ListEntry
+    from queries import count_lists, list_count_drift, list_counts
+
+    rng = random.Random(args.seed)
+    seeded = seed_database(engine, rng, args.entries, entries_per_user=args.entries)
+
+    start = time.time()
+    count_lists(db_session)
+    db_session.commit()
+    rebuild_ms = (time.time() - start) * 1000
+
+    start = time.time()
+    drift = list_count_drift(db_session)
+    verify_ms = (time.time() - start) * 1000
+
+    group_by = lambda: db_session.query(ListEntry.list_type, ListEntry.platform_id, func.count(ListEntry.id)). \
+                                  filter(ListEntry.user_id == 1). \
+                                  group_by(ListEntry.list_type, ListEntry.platform_id). \
+                                  all()
+    if sorted(group_by()) != sorted(list_counts(db_session, 1)):
+        raise RuntimeError("list counts don't match the entries")
+
+    return {
+        "entries": seeded["entries"],
+        "rebuild_ms": round(rebuild_ms, 3),
+        "verify_ms": round(verify_ms, 3),
+        "drift": len(drift),
+        "group_by": summarize(timed(group_by, args.repeat)),
+        "list_counts": summarize(timed(lambda: list_counts(db_session, 1), args.repeat))
+    }
+
+def bench_refresh(args):
+    """
+    Refreshes --games seeded games from a fake IGDB with --igdb-delay latency,
+    stopping halfway and resuming from the checkpoint, and reports the games
+    refreshed per second
+    """
+
+    engine = setup_database(args)
+    server = start_fake_igdb(delay=args.igdb_delay / 1000.0)
+
+    from database import db_session
+    from igdb import client_from_env
+    from models import Game
+    from db_refresh import Checkpoint, refresh_games
+
+    rng = random.Random(args.seed)
+    words = synthetic_words(rng, 5000)
+    games = Game.__table__
+    with engine.begin() as connection:
+        for chunk in chunked([{"igdb_id": i, "name": synthetic_name(rng, words, i),
+                               "image_url": "//images.igdb.com/igdb/image/upload/t_thumb/{}.jpg".format(i)}
+                              for i in range(1, args.games + 1)]):
+            connection.execute(games.insert(), chunk)
+
+    client = client_from_env()
+    checkpoint = Checkpoint(tempfile.mkstemp(prefix="tracklog-refresh-")[1])
+    options = {"chunk_size": 500, "batch_size": 50, "concurrency": args.clients, "rate": 0}
+    chunks = (args.games + options["chunk_size"] - 1) // options["chunk_size"]
+
+    try:
+        # run until halfway, as if interrupted, then pick up from the checkpoint
+        start = time.time()
+        first = refresh_games(db_session, client, checkpoint, max_chunks=chunks // 2, **options)
+        resumed_after = checkpoint.load()
+        second = refresh_games(db_session, client, checkpoint, **options)
+        elapsed = time.time() - start
+    finally:
+        client.session.close()
+        server.shutdown()
+
+    refreshed = db_session.query(Game).filter(Game.name.startswith("Refreshed ")).count()
+    if refreshed != args.games or not second["finished"]:
+        raise RuntimeError("only {} of {} games were refreshed".format(refreshed, args.games))
+
+    checked = first["games"] + second["games"]
+    return {
+        "games": args.games,
+        "checked": checked,
+        "updated": first["updated"] + second["updated"],
+        "resumed_after_game": resumed_after,
+        "requests": first["requests"] + second["requests"],
+        "seconds": round(elapsed, 3),
+        "games_per_second": round(checked / elapsed, 1)
+    }
+
+BENCHMARKS = {
+    "refresh": bench_refresh,
+    "stats": bench_stats,
+    "entry_writes": bench_entry_writes,
+    "list_types": bench_list_types,
+    "search_load": bench_search_load,
+    "assets": bench_assets,
+    "delete": bench_delete,
+    "bulk": bench_bulk,
+    "routes": bench_routes,
+    "login": bench_login,
+    "lists_page": bench_lists_page,
+    "import": bench_import,
+    "add_game": bench_add_game,
+    "catalog": bench_catalog,
+    "indexes": bench_indexes
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run Tracklog benchmarks and print the results as JSON.")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--games", type=int, default=100000, help="number of synthetic games")
+    parser.add_argument("--repeat", type=int, default=200, help="number of timed operations")
+    parser.add_argument("--clients", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("--entries", type=int, default=100000, help="number of list entries to seed")
+    parser.add_argument("--database", help="database URL to seed (default: a temporary SQLite file)")
+    parser.add_argument("--igdb-delay", type=float, default=0, help="latency of the fake IGDB API in milliseconds")
+    parser.add_argument("--seed", type=int, default=27, help="random seed for generated data")
+    args = parser.parse_args()
+
+    print(json.dumps(BENCHMARKS[args.benchmark](args), indent=2, sort_keys=True))
@@ -0,0 +1,267 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+class TTLCache(object):
+    """
+    Thread-safe in-process cache with per-entry expiry and LRU eviction
+    once max_size entries are stored
+
+    get_or_load() merges concurrent misses for the same key into a single
+    call to the loader (single-flight), so a burst of identical requests
+    only costs one trip to the underlying resource
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for key, or default if it's missing or expired
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            # treat expired entries as missing, dropping them on the way
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+
+            # mark the entry as the most recently used one
+            value = self._entries.pop(key)[1]
+            self._entries[key] = (entry[0], value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Stores value under key, evicting the least recently used entries
+        if the cache is full
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Removes key from the cache, if present
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes every entry from the cache
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for key, calling loader() to produce it on a miss
+
+        Only one thread calls loader() for a given key at a time; any other
+        thread missing on the same key waits for that result instead. Errors
+        raised by loader() are passed on to every waiting thread and nothing
+        gets cached.
+        """
+
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        # another thread is already loading this key, wait for its result
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self.set(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def stats(self):
+        """
+        Returns hit/miss counters along with the current number of entries
+        """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries)
+            }
+
+class _Flight(object):
+    """
+    Result of an in-progress load shared between threads missing on the same key
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class SQLiteCache(object):
+    """
+    Cache storing pickled values in a SQLite file, which makes it shared between
+    every worker process on the same machine
+
+    Offers the same get/set/delete interface as TTLCache. Entries expire after ttl
+    seconds and once there are more than max_size of them, the least recently
+    used ones get evicted.
+    """
+
+    # how often (in number of sets) to check whether the cache is over max_size
+    EVICT_EVERY = 100
+
+    def __init__(self, path, ttl, max_size):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._sets = 0
+        self._local = threading.local()
+
+        with self._connect() as connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS cache (
+                                      key TEXT PRIMARY KEY,
+                                      value BLOB NOT NULL,
+                                      expires REAL NOT NULL,
+                                      accessed REAL NOT NULL)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed)")
+
+    def _connect(self):
+        """
+        Returns this thread's connection to the cache file, opening it if needed
+        """
+
+        # connections can't be shared between threads, nor between forked processes
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5)
+            # https://sqlite.org/wal.html
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key, default=None):
+        with self._connect() as connection:
+            row = connection.execute("SELECT value FROM cache WHERE key = ? AND expires > ?",
+                                     (key, time.time())).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            connection.execute("UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key))
+
+        self.hits += 1
+        return pickle.loads(bytes(row[0]))
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                               (key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), now + self.ttl, now))
+
+            # evicting on every set would make sets slow, so only do it every once in a while
+            self._sets += 1
+            if self._sets % self.EVICT_EVERY == 0:
+                connection.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+                connection.execute("""DELETE FROM cache WHERE key IN (
+                                          SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)""",
+                                   (self.max_size,))
+
+    def delete(self, key):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM cache")
+
+    def stats(self):
+        with self._connect() as connection:
+            size = connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": size
+        }
+
+def cache_from_url(url, ttl, max_size):
+    """
+    Creates a cache from a URL, an in-process TTLCache if url is empty or
+    a SQLiteCache for sqlite:///<path> URLs
+    """
+
+    if not url:
+        return TTLCache(ttl, max_size)
+    if url.startswith("sqlite:///"):
+        return SQLiteCache(url[len("sqlite:///"):], ttl, max_size)
+    raise ValueError("unsupported cache URL: {}".format(url))
+
+# key of the list cache under which the version of the games table is kept,
+# changed whenever games are updated outside of the app (e.g. by db_refresh.py)
+GAMES_VERSION = "version:games"
+
+def list_cache_from_env():
+    """
+    Creates the cache of users' list pages configured from the environment variables
+
+    It's kept at LIST_CACHE_URL, by default in a SQLite file shared by every worker
+    process on the machine, since a list changed through one of them must be
+    outdated in all of them. Entries expire after LIST_CACHE_TTL seconds, and at
+    most LIST_CACHE_SIZE of them are kept.
+    """
+
+    url = os.environ.get("LIST_CACHE_URL")
+    if not url:
+        # one file per database, so that lists of different databases never get mixed up
+        database = hashlib.sha1(os.environ.get("DATABASE_URL", "")).hexdigest()[:12]
+        url = "sqlite:///" + os.path.join(tempfile.gettempdir(), "tracklog-lists-{}.db".format(database))
+    return cache_from_url(url,
+                          ttl=int(os.environ.get("LIST_CACHE_TTL", 86400)),
+                          max_size=int(os.environ.get("LIST_CACHE_SIZE", 1000)))
@@ -0,0 +1,259 @@
+import bisect
+import heapq
+import threading
+import time
+
+from collections import namedtuple
+
+def normalize(name):
+    """
+    Lower-cases name and collapses its whitespace, for use as a lookup key
+    """
+
+    return " ".join(name.lower().split())
+
+def trigrams(text):
+    """
+    Returns the set of three-character substrings of text
+    """
+
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+class GameIndex(object):
+    """
+    In-memory typeahead index over the names of games stored in the database
+
+    Queries shorter than three characters are answered by a prefix search over
+    the sorted names, longer ones by intersecting trigram posting sets and
+    keeping the names that actually contain the query
+    """
+
+    def __init__(self):
+        self.version = None
+        self._games = {}
+        self._names = []
+        self._trigrams = {}
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._reloading = threading.Lock()
+
+    def __len__(self):
+        return len(self._games)
+
+    def load(self, rows, version=None):
+        """
+        Replaces the contents of the index with rows of (igdb_id, name, image_url),
+        remembering version as the version of the games they were read from
+        """
+
+        games = {}
+        index = {}
+        for igdb_id, name, image_url in rows:
+            key = normalize(name)
+            games[igdb_id] = (key, _result(igdb_id, name, image_url))
+            for trigram in trigrams(key):
+                index.setdefault(trigram, set()).add(igdb_id)
+
+        names = sorted((key, igdb_id) for igdb_id, (key, result) in games.items())
+
+        with self._lock:
+            self._games = games
+            self._names = names
+            self._trigrams = index
+            self.version = version
+            self._checked_at = time.time()
+
+    def reload(self, version, load, interval):
+        """
+        Reloads the index from the rows returned by load() if version(), the current
+        version of the games, differs from the one it was loaded from, returning
+        whether it did
+
+        version() is called at most every interval seconds. Only one thread reloads
+        the index at a time, the others keep searching its old contents meanwhile.
+        """
+
+        if time.time() - self._checked_at < interval or not self._reloading.acquire(False):
+            return False
+
+        try:
+            # another thread may have checked while this one was getting the lock
+            if time.time() - self._checked_at < interval:
+                return False
+            self._checked_at = time.time()
+
+            current = version()
+            if current == self.version:
+                return False
+            self.load(load(), current)
+            return True
+        finally:
+            self._reloading.release()
+
+    def add(self, igdb_id, name, image_url):
+        """
+        Adds a single game to the index, ignoring games it already holds
+        """
+
+        key = normalize(name)
+
+        with self._lock:
+            if igdb_id in self._games:
+                return
+            self._games[igdb_id] = (key, _result(igdb_id, name, image_url))
+            bisect.insort(self._names, (key, igdb_id))
+            for trigram in trigrams(key):
+                self._trigrams.setdefault(trigram, set()).add(igdb_id)
+
+    def search(self, query, limit):
+        """
+        Returns up to limit games whose name matches query, in the same shape as
+        IGDB search results, names starting with the query first
+        """
+
+        query = normalize(query)
+        if not query:
+            return []
+
+        with self._lock:
+            # short queries don't have any trigrams, so fall back to a prefix search
+            if len(query) < 3:
+                start = bisect.bisect_left(self._names, (query,))
+                matches = []
+                for key, igdb_id in self._names[start:start + limit]:
+                    if not key.startswith(query):
+                        break
+                    matches.append(igdb_id)
+                return [self._games[igdb_id][1] for igdb_id in matches]
+
+            # intersect posting sets starting from the smallest one
+            postings = []
+            for trigram in trigrams(query):
+                posting = self._trigrams.get(trigram)
+                if not posting:
+                    return []
+                postings.append(posting)
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+
+            # trigrams match out of order, so make sure the query really is in the name
+            matches = []
+            for igdb_id in candidates:
+                key = self._games[igdb_id][0]
+                if query in key:
+                    matches.append((not key.startswith(query), key, igdb_id))
+            return [self._games[igdb_id][1] for prefix, key, igdb_id in heapq.nsmallest(limit, matches)]
+
+PlatformEntry = namedtuple("PlatformEntry", ["id", "name"])
+
+class PlatformRegistry(object):
+    """
+    In-memory copy of the platforms table, loaded by calling load(), which
+    returns (id, name) rows
+
+    The table rarely changes, so it's only reloaded once ttl seconds have
+    passed or after invalidate() has been called, or when a platform that
+    another process may have just added is looked up and missing
+    """
+
+    def __init__(self, load, ttl):
+        self.ttl = ttl
+        self._load = load
+        self._loaded_at = None
+        self._by_id = {}
+        self._by_name = {}
+        self._by_lower_name = {}
+        self._sorted = []
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Makes the next lookup reload the platforms
+        """
+
+        self._loaded_at = None
+
+    def _refresh(self):
+        """
+        Reloads the platforms if they're missing or outdated
+        """
+
+        if self._loaded_at is not None and time.time() - self._loaded_at < self.ttl:
+            return
+
+        with self._lock:
+            # another thread may have reloaded them while this one was waiting
+            if self._loaded_at is not None and time.time() - self._loaded_at < self.ttl:
+                return
+
+            platforms = [PlatformEntry(id, name) for id, name in self._load()]
+            self._by_id = dict((platform.id, platform) for platform in platforms)
+            self._by_name = dict((platform.name, platform) for platform in platforms)
+            self._by_lower_name = dict((platform.name.lower(), platform) for platform in platforms)
+            self._sorted = sorted(platforms, key=lambda platform: platform.name)
+            self._loaded_at = time.time()
+
+    def _lookup(self, platforms, key):
+        """
+        Returns the platform under key in platforms(), one of the dicts of platforms,
+        reloading them once if it's missing, or None if it's still missing then
+        """
+
+        self._refresh()
+        platform = platforms().get(key)
+        if platform is None:
+            # misses are rare (bad input costs a query, like it did before platforms were kept in memory)
+            self.invalidate()
+            self._refresh()
+            platform = platforms().get(key)
+        return platform
+
+    def get(self, platform_id):
+        """
+        Returns the platform with the given ID, or None
+        """
+
+        return self._lookup(lambda: self._by_id, platform_id)
+
+    def by_name(self, name):
+        """
+        Returns the platform with exactly the given name, or None
+        """
+
+        return self._lookup(lambda: self._by_name, name)
+
+    def find(self, name):
+        """
+        Returns the platform with the given name, ignoring case, or None
+        """
+
+        return self._lookup(lambda: self._by_lower_name, name.lower())
+
+    def ids(self):
+        """
+        Returns a dict mapping platform names to IDs
+        """
+
+        self._refresh()
+        return dict((name, platform.id) for name, platform in self._by_name.items())
+
+    def all(self):
+        """
+        Returns all platforms, sorted by name
+        """
+
+        self._refresh()
+        return self._sorted
+
+def _result(igdb_id, name, image_url):
+    """
+    Formats a game the way IGDB's search endpoint does, as consumed by createListItem()
+    """
+
+    return {
+        "id": igdb_id,
+        "name": name,
+        "cover": {
+            "url": image_url
+        }
+    }
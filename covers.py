@@ -0,0 +1,206 @@
+import os
+import re
+import tempfile
+import threading
+
+from urlparse import urlparse
+
+import requests
+
+from cache import TTLCache
+
+# IGDB serves each image in several sizes, picked by a token in its URL
+# https://igdb.github.io/api/references/images/
+SIZE_TOKEN = re.compile(r"/t_[a-z0-9_]+/")
+
+# image URLs come from users, so covers are only ever fetched from IGDB's image host,
+# never from wherever a user pointed them (e.g. services on the server's own network)
+IMAGE_HOSTS = ("images.igdb.com",)
+
+# shown instead of covers that are missing, or couldn't be fetched
+PLACEHOLDER_SVG = """<svg xmlns="http://www.w3.org/2000/svg" width="90" height="90" viewBox="0 0 90 90">
+<rect width="90" height="90" fill="#e5e5e5"/>
+<text x="45" y="42" font-family="Helvetica, Arial, sans-serif" font-size="12" fill="#999" text-anchor="middle">Missing</text>
+<text x="45" y="58" font-family="Helvetica, Arial, sans-serif" font-size="12" fill="#999" text-anchor="middle">cover</text>
+</svg>
+"""
+
+def sized_url(image_url, size, hosts=IMAGE_HOSTS):
+    """
+    Returns the URL of an IGDB image in the given size (e.g. "thumb"), or None
+    if image_url isn't the URL of an image on one of hosts
+    """
+
+    if image_url.startswith("//"):
+        image_url = "https:" + image_url
+
+    # compare the whole host, port and credentials included, so nothing else can pass for it
+    url = urlparse(image_url)
+    if url.scheme not in ("http", "https") or url.netloc.lower() not in hosts:
+        return None
+    return SIZE_TOKEN.sub("/t_{}/".format(size), image_url, count=1)
+
+class CoverStore(object):
+    """
+    Cover images fetched from IGDB once and kept in directory, which holds at
+    most about max_bytes of them, the least recently served ones being deleted
+    to make room for new ones
+
+    The directory can be shared by every worker process on the same machine.
+    """
+
+    def __init__(self, directory, max_bytes, size="thumb", timeout=5.0, hosts=IMAGE_HOSTS):
+        self.directory = os.path.join(directory, size)
+        self.max_bytes = max_bytes
+        self.size = size
+        self.timeout = timeout
+        self.hosts = hosts
+        self.session = requests.Session()
+        self._bytes = None
+        self._lock = threading.Lock()
+        self._fetching = {}
+
+        # remember covers that couldn't be fetched for a while, rather than asking for them on every request
+        self._missing = TTLCache(ttl=600, max_size=10000)
+
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # another worker created it first
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def path(self, igdb_id):
+        return os.path.join(self.directory, "{}.jpg".format(int(igdb_id)))
+
+    def forget(self, igdb_id):
+        """
+        Deletes the stored cover of game igdb_id, e.g. once its image URL has changed,
+        so that the new one is fetched the next time it's requested
+        """
+
+        try:
+            size = os.path.getsize(self.path(igdb_id))
+            os.remove(self.path(igdb_id))
+        except OSError:
+            return
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes -= size
+
+    def get(self, igdb_id, image_url):
+        """
+        Returns the cover image of game igdb_id, or None if it doesn't have one
+
+        If the cover isn't stored yet, it's fetched from the URL returned by
+        image_url(), which is only called in that case, as long as it's on one of hosts.
+        """
+
+        path = self.path(igdb_id)
+        image = self._read(path)
+        if image is not None:
+            return image
+
+        url = sized_url(image_url() or "", self.size, self.hosts)
+        if url is None or self._missing.get(url):
+            return None
+
+        # fetch each cover only once, even if it's requested by many threads at the same time
+        with self._lock:
+            lock = self._fetching.setdefault(igdb_id, threading.Lock())
+        with lock:
+            try:
+                image = self._read(path)
+                if image is None:
+                    image = self._fetch(url, path)
+                if image is None:
+                    self._missing.set(url, True)
+                return image
+            finally:
+                with self._lock:
+                    self._fetching.pop(igdb_id, None)
+
+    def _read(self, path):
+        """
+        Returns the stored cover at path, marking it as just served, or None if it isn't stored
+        """
+
+        try:
+            with open(path, "rb") as cover_file:
+                image = cover_file.read()
+        except IOError:
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return image
+
+    def _fetch(self, url, path):
+        """
+        Downloads url to path, returning the downloaded image or None if it couldn't be
+        """
+
+        try:
+            # a redirect could lead anywhere, so don't follow them
+            response = self.session.get(url, timeout=self.timeout, allow_redirects=False)
+        except requests.RequestException:
+            return None
+        if response.status_code != 200 or not response.headers.get("Content-Type", "").startswith("image/"):
+            return None
+
+        # write to a temporary file first so that other workers never serve half-written covers
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as temporary_file:
+            temporary_file.write(response.content)
+        os.rename(temporary_path, path)
+
+        self._added(len(response.content))
+        return response.content
+
+    def _added(self, size):
+        """
+        Keeps track of the directory's size, deleting least recently served covers once it's full
+        """
+
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += size
+                if self._bytes <= self.max_bytes:
+                    return
+
+            # (re)count what's actually stored, since other workers add covers too
+            covers = []
+            for name in os.listdir(self.directory):
+                # leave covers that are still being written alone
+                if not name.endswith(".jpg"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                covers.append((stat.st_mtime, stat.st_size, name))
+            self._bytes = sum(size for _, size, _ in covers)
+
+            # make room for a while rather than evicting on every new cover
+            covers.sort()
+            while covers and self._bytes > self.max_bytes * 0.9:
+                _, size, name = covers.pop(0)
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                self._bytes -= size
+
+def store_from_env():
+    """
+    Creates a cover store configured from the environment variables: covers
+    in COVER_SIZE (an IGDB size, e.g. "thumb" or "cover_small"), keeping at
+    most COVER_CACHE_MB megabytes of them in COVER_CACHE_DIR
+    """
+
+    return CoverStore(os.environ.get("COVER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tracklog-covers")),
+                      max_bytes=int(os.environ.get("COVER_CACHE_MB", 256)) * 1024 * 1024,
+                      size=os.environ.get("COVER_SIZE", "thumb"))
@@ -2,16 +2,107 @@ import os
 
 # http://flask.pocoo.org/docs/0.12/patterns/sqlalchemy/
 
-from sqlalchemy import create_engine
+from flask import _app_ctx_stack
+from sqlalchemy import create_engine, event, exc, select
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
+def engine_from_env(url):
+    """
+    Creates an engine for url, with its connection pool configured from the
+    environment variables:
+
+    DATABASE_POOL_SIZE connections are kept open, with up to DATABASE_MAX_OVERFLOW more
+    opened during bursts (size them to the requests a worker runs at once), waiting at most
+    DATABASE_POOL_TIMEOUT seconds for a free connection. Connections are replaced after
+    DATABASE_POOL_RECYCLE seconds, and checked before use if DATABASE_POOL_PRE_PING is 1.
+    Statements are cancelled after DATABASE_STATEMENT_TIMEOUT milliseconds (PostgreSQL only).
+    """
+
+    options = {}
+    connect_args = {}
+    sqlite = url.startswith("sqlite")
+
+    # SQLite databases don't get a sized pool, as connecting to them is just opening a file
+    # http://docs.sqlalchemy.org/en/latest/dialects/sqlite.html#threading-pooling-behavior
+    if not sqlite:
+        options["pool_size"] = int(os.environ.get("DATABASE_POOL_SIZE", 5))
+        options["max_overflow"] = int(os.environ.get("DATABASE_MAX_OVERFLOW", 10))
+        options["pool_timeout"] = float(os.environ.get("DATABASE_POOL_TIMEOUT", 30))
+        options["pool_recycle"] = int(os.environ.get("DATABASE_POOL_RECYCLE", 1800))
+
+    statement_timeout = int(os.environ.get("DATABASE_STATEMENT_TIMEOUT", 0))
+    if statement_timeout and url.startswith("postgres"):
+        # https://www.postgresql.org/docs/current/static/runtime-config-client.html
+        connect_args["options"] = "-c statement_timeout={}".format(statement_timeout)
+
+    engine = create_engine(url, connect_args=connect_args, **options)
+
+    if os.environ.get("DATABASE_POOL_PRE_PING", "0" if sqlite else "1") == "1":
+        event.listen(engine, "engine_connect", ping_connection)
+
+    # SQLite only enforces foreign keys, and so only cascades deletes, when asked to
+    # https://sqlite.org/foreignkeys.html#fk_enable
+    if sqlite:
+        event.listen(engine, "connect", enable_foreign_keys)
+
+    return engine
+
+def enable_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def ping_connection(connection, branch):
+    """
+    Makes sure a connection checked out from the pool still works, replacing
+    it (and every other connection in the pool) if the database dropped it
+    """
+
+    # http://docs.sqlalchemy.org/en/rel_1_1/core/pooling.html#disconnect-handling-pessimistic
+    if branch:
+        return
+
+    # don't let the ping close the connection, even if it was opened just for one statement
+    should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as e:
+        # the pool is invalidated when a disconnect is detected, so
+        # running the ping again checks out a new connection
+        if e.connection_invalidated:
+            connection.scalar(select([1]))
+        else:
+            raise
+    finally:
+        connection.should_close_with_result = should_close_with_result
+
+# sessions are scoped the way Flask scopes its contexts, per greenlet when running
+# in gevent workers and per thread otherwise (as Flask-SQLAlchemy does)
+# http://docs.sqlalchemy.org/en/latest/orm/contextual.html#using-custom-created-scopes
+scopefunc = _app_ctx_stack.__ident_func__
+
 # http://docs.sqlalchemy.org/en/latest/core/engines.html
-engine = create_engine(os.environ.get("DATABASE_URL"))
+engine = engine_from_env(os.environ.get("DATABASE_URL"))
 
 db_session = scoped_session(sessionmaker(autocommit=False,
                                          autoflush=True,
-                                         bind=engine))
+                                         bind=engine),
+                            scopefunc=scopefunc)
+
+# read-only routes may read from a replica at DATABASE_REPLICA_URL instead,
+# or from the primary database if there isn't one
+if os.environ.get("DATABASE_REPLICA_URL"):
+    replica_engine = engine_from_env(os.environ.get("DATABASE_REPLICA_URL"))
+    replica_session = scoped_session(sessionmaker(autocommit=False,
+                                                  autoflush=False,
+                                                  bind=replica_engine),
+                                     scopefunc=scopefunc)
+else:
+    replica_engine = engine
+    replica_session = db_session
 
 Base = declarative_base()
 Base.query = db_session.query_property()
@@ -0,0 +1,35 @@
+"""
+Checks the list counts served by /stats against the list entries they count,
+and recomputes them from the entries
+
+Usage: python db_counts.py verify    reports counts that are off, exiting with status 1 if any are
+       python db_counts.py rebuild   reports counts that are off, then recomputes all of them
+"""
+
+import argparse
+import sys
+import time
+
+from database import db_session
+from queries import count_lists, list_count_drift
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify or rebuild the per-user list counts.")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    args = parser.parse_args()
+
+    # compare the stored counts with counts of the entries
+    start = time.time()
+    drift = list_count_drift(db_session)
+    for user_id, list_type, platform_id, stored, actual in drift:
+        print("user {}, {}, platform {}: counted {}, has {}".format(user_id, list_type, platform_id, stored, actual))
+    print("{} list counts off, checked in {:.1f}s.".format(len(drift), time.time() - start))
+
+    if args.command == "rebuild":
+        # recompute every count in a single transaction
+        start = time.time()
+        count_lists(db_session)
+        db_session.commit()
+        print("List counts rebuilt in {:.1f}s.".format(time.time() - start))
+    elif drift:
+        sys.exit(1)
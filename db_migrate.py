@@ -0,0 +1,187 @@
+"""
+Brings a database created by an older version of db_create.py up to date with models.py
+
+Every step checks what has already been applied, so it's safe to run more than once.
+Usage: python db_migrate.py
+"""
+
+from sqlalchemy import Integer, create_engine, event, inspect, text
+from sqlalchemy.schema import AddConstraint, CreateIndex, CreateTable
+from models import *
+from database import Base, engine
+from queries import count_lists
+
+# statements removing rows that would violate the unique indexes, games first
+# since merging duplicate games can leave duplicate list entries behind
+REMOVE_DUPLICATES = [
+    # point list entries at the oldest copy of each game
+    """UPDATE list_entries SET game_id = (
+           SELECT MIN(duplicate.id) FROM games duplicate
+           JOIN games game ON game.igdb_id = duplicate.igdb_id
+           WHERE game.id = list_entries.game_id)
+       WHERE game_id IN (
+           SELECT id FROM games WHERE igdb_id IN (
+               SELECT igdb_id FROM games GROUP BY igdb_id HAVING COUNT(*) > 1))""",
+    "DELETE FROM games WHERE id NOT IN (SELECT MIN(id) FROM games GROUP BY igdb_id)",
+    """DELETE FROM list_entries WHERE id NOT IN (
+           SELECT MIN(id) FROM list_entries GROUP BY user_id, game_id, platform_id)""",
+    """DELETE FROM user_platforms WHERE id NOT IN (
+           SELECT MIN(id) FROM user_platforms GROUP BY user_id, platform_id)"""
+]
+
+def remove_duplicates(connection):
+    """
+    Deletes duplicate games, list entries and user platforms, keeping the oldest row of each
+    """
+
+    for statement in REMOVE_DUPLICATES:
+        connection.execute(text(statement))
+
+def create_indexes(connection, tables=None):
+    """
+    Creates the indexes declared in models.py that don't exist yet,
+    on every table unless tables is given
+    """
+
+    for table in tables or Base.metadata.sorted_tables:
+        for index in table.indexes:
+            # both PostgreSQL and SQLite support IF NOT EXISTS, which also covers
+            # expression indexes that SQLAlchemy can't reflect
+            ddl = str(CreateIndex(index).compile(dialect=connection.dialect))
+            ddl = ddl.replace(" INDEX ", " INDEX IF NOT EXISTS ", 1)
+            connection.execute(text(ddl))
+
+def rebuild_table(connection, table, expressions={}):
+    """
+    Recreates a SQLite table as declared in models.py, copying its rows over with
+    the columns in expressions (a dict of column names to SQL expressions) converted
+    https://sqlite.org/lang_altertable.html#otheralter
+    """
+
+    ddl = str(CreateTable(table).compile(dialect=connection.dialect))
+    ddl = ddl.replace("CREATE TABLE {} ".format(table.name), "CREATE TABLE new_{} ".format(table.name), 1)
+    columns = [column.name for column in table.columns]
+    values = [expressions.get(column, column) for column in columns]
+    connection.execute(text(ddl))
+    connection.execute(text("INSERT INTO new_{} ({}) SELECT {} FROM {}".format(
+        table.name, ", ".join(columns), ", ".join(values), table.name)))
+    connection.execute(text("DROP TABLE {}".format(table.name)))
+    connection.execute(text("ALTER TABLE new_{0} RENAME TO {0}".format(table.name)))
+    create_indexes(connection, [table])
+
+# gives every list entry's platform to its user if they don't have it anymore,
+# as the foreign key from list_entries to user_platforms requires
+ADD_MISSING_USER_PLATFORMS = """
+    INSERT INTO user_platforms (user_id, platform_id)
+    SELECT DISTINCT user_id, platform_id FROM list_entries
+    WHERE NOT EXISTS (SELECT 1 FROM user_platforms
+                      WHERE user_platforms.user_id = list_entries.user_id
+                      AND user_platforms.platform_id = list_entries.platform_id)"""
+
+# tables whose foreign keys cascade deletes, in an order they can be rebuilt in
+CASCADING_TABLES = [UserPlatform.__table__, ListEntry.__table__]
+
+def add_cascades(connection):
+    """
+    Replaces the foreign keys of user_platforms and list_entries with the ones
+    declared in models.py, which cascade deletes of users and platforms
+    """
+
+    # the foreign key from list_entries to user_platforms is only there once this has run
+    if any(foreign_key["referred_table"] == "user_platforms"
+           for foreign_key in inspect(connection).get_foreign_keys("list_entries")):
+        return
+
+    connection.execute(text(ADD_MISSING_USER_PLATFORMS))
+
+    if connection.dialect.name == "sqlite":
+        # SQLite can't alter constraints, so rebuild the tables instead
+        for table in CASCADING_TABLES:
+            rebuild_table(connection, table)
+
+        # make sure the copied rows satisfy the new foreign keys
+        result = connection.execute(text("PRAGMA foreign_key_check"))
+        violations = result.fetchall() if result.returns_rows else []
+        if violations:
+            raise RuntimeError("rows violating foreign keys: {}".format(violations))
+    else:
+        for table in CASCADING_TABLES:
+            for foreign_key in inspect(connection).get_foreign_keys(table.name):
+                connection.execute(text("ALTER TABLE {} DROP CONSTRAINT {}".format(table.name, foreign_key["name"])))
+            for constraint in table.foreign_key_constraints:
+                connection.execute(AddConstraint(constraint))
+
+# the number of each list entry's list type, entries of lists that don't exist
+# (e.g. added through a mistyped URL) going to the backlog
+LIST_TYPE_NUMBER = "CASE list_type {} ELSE {} END".format(
+    " ".join("WHEN '{}' THEN {}".format(name, number) for name, number in LIST_TYPES.items()),
+    LIST_TYPES["backlog"])
+
+def number_list_types(connection):
+    """
+    Converts list_entries.list_type from list names to the numbers in LIST_TYPES
+    """
+
+    column = [column for column in inspect(connection).get_columns("list_entries")
+              if column["name"] == "list_type"][0]
+
+    if connection.dialect.name == "sqlite":
+        # names can still be stored in a column declared as a number, e.g. by add_cascades copying them over
+        if isinstance(column["type"], Integer):
+            connection.execute(text("UPDATE list_entries SET list_type = {} "
+                                    "WHERE typeof(list_type) = 'text'".format(LIST_TYPE_NUMBER)))
+        else:
+            rebuild_table(connection, ListEntry.__table__, {"list_type": LIST_TYPE_NUMBER})
+    elif not isinstance(column["type"], Integer):
+        # https://www.postgresql.org/docs/current/static/sql-altertable.html
+        connection.execute(text("ALTER TABLE list_entries ALTER COLUMN list_type TYPE smallint "
+                                "USING {}".format(LIST_TYPE_NUMBER)))
+
+def add_list_counts(connection):
+    """
+    Creates list_counts and counts every user's list entries into it
+    """
+
+    if ListCount.__tablename__ in inspect(connection).get_table_names():
+        return
+
+    ListCount.__table__.create(connection)
+    count_lists(connection)
+
+def migration_engine():
+    """
+    Returns the engine to run the migration with, whose transactions cover every step
+    """
+
+    if engine.dialect.name != "sqlite":
+        return engine
+
+    # pysqlite commits before each DDL statement on its own, and foreign keys have to be
+    # off while tables are rebuilt, so use a connection that leaves both up to us
+    # http://docs.sqlalchemy.org/en/rel_1_1/dialects/sqlite.html#serializable-isolation-savepoints-transactional-ddl
+    sqlite_engine = create_engine(engine.url)
+
+    @event.listens_for(sqlite_engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(sqlite_engine, "begin")
+    def begin(connection):
+        connection.execute("BEGIN")
+
+    return sqlite_engine
+
+if __name__ == "__main__":
+    # create any tables that don't exist yet, except those created (and filled) by the steps below
+    Base.metadata.create_all(bind=engine, tables=[table for table in Base.metadata.sorted_tables
+                                                  if table is not ListCount.__table__])
+
+    # run every step in a single transaction
+    with migration_engine().begin() as connection:
+        remove_duplicates(connection)
+        create_indexes(connection)
+        add_cascades(connection)
+        number_list_types(connection)
+        add_list_counts(connection)
+
+    print("Database is up to date.")
@@ -0,0 +1,203 @@
+"""
+Refreshes the names and covers of the games cached in the database from IGDB,
+fixing ones that were added with stale or wrong details
+
+Games are walked in order of their IDs, a chunk at a time. The games in a chunk are
+looked up a batch of IDs per request, with a few requests running at once and
+no more than a set number started per second, and only the games that changed
+are updated. The last game refreshed is saved in a checkpoint file after each
+chunk, so an interrupted run resumes where it left off.
+
+Once a chunk's changes are committed, the version of the games kept in the list
+cache is changed, which outdates every cached list page and makes the app's
+workers reload their game search indexes.
+
+Usage: python db_refresh.py [--chunk-size N] [--batch-size N] [--concurrency N]
+                            [--rate N] [--checkpoint PATH] [--restart]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from multiprocessing.pool import ThreadPool
+
+from sqlalchemy import bindparam, select
+
+from cache import GAMES_VERSION, list_cache_from_env
+from covers import store_from_env
+from database import db_session
+from igdb import client_from_env
+from models import Game
+
+class RateLimiter(object):
+    """
+    Spaces out calls to wait() so that at most rate of them return per second,
+    across every thread sharing it
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+class Checkpoint(object):
+    """
+    The ID of the last game refreshed, kept in a file at path
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as checkpoint_file:
+                return int(checkpoint_file.read().strip() or 0)
+        except (IOError, ValueError):
+            return 0
+
+    def save(self, game_id):
+        # write to a temporary file first so that a crash never leaves half a checkpoint
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+        with os.fdopen(descriptor, "w") as temporary_file:
+            temporary_file.write(str(game_id))
+        os.rename(temporary_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def game_details(game, name):
+    """
+    Returns the name and image URL of a game as IGDB describes it, keeping
+    name if IGDB doesn't give one
+    """
+
+    cover = game.get("cover") or {}
+    return game.get("name") or name, cover.get("url", "")
+
+def refresh_games(session, client, checkpoint, chunk_size=500, batch_size=50, concurrency=4, rate=4.0,
+                  cover_store=None, list_cache=None, max_chunks=None, progress=None):
+    """
+    Refreshes the games after the one in checkpoint, returning the numbers of
+    games checked and updated and of requests made, and whether the last game was reached
+
+    The checkpoint is cleared once the last game is reached, so that the next
+    run starts over. If list_cache is given, the games' version in it is changed
+    after each chunk that updated any games. If progress is given, it's called
+    with the statistics so far after each chunk.
+    """
+
+    games = Game.__table__
+    update = games.update(). \
+                   where(games.c.id == bindparam("game_id")). \
+                   values(name=bindparam("new_name"), image_url=bindparam("new_image_url"))
+
+    limiter = RateLimiter(rate)
+    stats = {"games": 0, "updated": 0, "requests": 0, "finished": False}
+
+    def fetch(igdb_ids):
+        limiter.wait()
+        return client.games(igdb_ids)
+
+    last_id = checkpoint.load()
+    chunks = 0
+    pool = ThreadPool(concurrency)
+    try:
+        while max_chunks is None or chunks < max_chunks:
+            rows = session.execute(select([games.c.id, games.c.igdb_id, games.c.name, games.c.image_url]).
+                                   where(games.c.id > last_id).
+                                   order_by(games.c.id).
+                                   limit(chunk_size)).fetchall()
+            if not rows:
+                stats["finished"] = True
+                checkpoint.clear()
+                break
+
+            # look the chunk's games up in concurrent batches
+            batches = [[row.igdb_id for row in rows[i:i + batch_size]] for i in range(0, len(rows), batch_size)]
+            found = {}
+            for results in pool.imap_unordered(fetch, batches):
+                found.update((game["id"], game) for game in results)
+            stats["requests"] += len(batches)
+
+            # update only the games whose details changed, all in one statement
+            # (games IGDB no longer knows about are left as they are)
+            changes = []
+            new_covers = []
+            for row in rows:
+                if row.igdb_id not in found:
+                    continue
+                name, image_url = game_details(found[row.igdb_id], row.name)
+                if (name, image_url) != (row.name, row.image_url):
+                    changes.append({"game_id": row.id, "new_name": name, "new_image_url": image_url})
+                if image_url != row.image_url:
+                    new_covers.append(row.igdb_id)
+            if changes:
+                session.execute(update, changes)
+            session.commit()
+
+            last_id = rows[-1].id
+            checkpoint.save(last_id)
+
+            # outdate cached lists and search indexes showing the old details
+            if changes and list_cache is not None:
+                list_cache.set(GAMES_VERSION, uuid.uuid4().hex)
+
+            # drop covers fetched from the old URLs, once the new ones are stored
+            if cover_store is not None:
+                for igdb_id in new_covers:
+                    cover_store.forget(igdb_id)
+
+            chunks += 1
+            stats["games"] += len(rows)
+            stats["updated"] += len(changes)
+            if progress is not None:
+                progress(last_id, stats)
+    finally:
+        pool.terminate()
+
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the games cached in the database from IGDB.")
+    parser.add_argument("--chunk-size", type=int, default=500, help="games read and updated at a time")
+    parser.add_argument("--batch-size", type=int, default=50, help="games looked up per IGDB request")
+    parser.add_argument("--concurrency", type=int, default=4, help="IGDB requests made at once")
+    parser.add_argument("--rate", type=float, default=4, help="most IGDB requests started per second")
+    parser.add_argument("--checkpoint", default=os.environ.get("REFRESH_CHECKPOINT", "db_refresh.checkpoint"),
+                        help="file the last game refreshed is saved in")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first game")
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.clear()
+    elif checkpoint.load():
+        print("Resuming after game {}.".format(checkpoint.load()))
+
+    start = time.time()
+
+    def progress(last_id, stats):
+        print("Refreshed up to game {}: {} games checked, {} updated, {:.1f} games/s.".format(
+            last_id, stats["games"], stats["updated"], stats["games"] / (time.time() - start)))
+
+    stats = refresh_games(db_session, client_from_env(), checkpoint,
+                          chunk_size=args.chunk_size, batch_size=args.batch_size,
+                          concurrency=args.concurrency, rate=args.rate,
+                          cover_store=store_from_env(), list_cache=list_cache_from_env(), progress=progress)
+    print("{} games checked and {} updated with {} requests in {:.1f}s.".format(
+        stats["games"], stats["updated"], stats["requests"], time.time() - start))
@@ -0,0 +1,47 @@
+"""
+Gunicorn settings, used by the Procfile: gunicorn -c gunicorn_config.py app:app
+
+Workers are gevent workers by default, so that a request waiting on IGDB (e.g.
+a search on every keystroke) only holds up a greenlet rather than a whole worker.
+Set GUNICORN_WORKER_CLASS to "sync" or "gthread" to serve without gevent.
+http://docs.gunicorn.org/en/stable/design.html#async-workers
+"""
+
+import os
+
+bind = "0.0.0.0:{}".format(os.environ.get("PORT", 8000))
+
+# Heroku sets WEB_CONCURRENCY according to the dyno's memory
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+
+# requests each gevent worker handles at once
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# threads of gthread workers, only set for them since more than one turns sync workers into gthread ones
+if worker_class == "gthread":
+    threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+
+def on_starting(server):
+    """
+    Starts the metrics that workers add up together from zero, rather than from
+    the totals of the workers of a previous run
+    """
+
+    from metrics import clear_directory, directory_from_env
+    clear_directory(directory_from_env())
+
+def post_fork(server, worker):
+    """
+    Makes psycopg2 wait for PostgreSQL cooperatively in gevent workers, rather than
+    blocking every greenlet of the worker
+    """
+
+    if worker_class != "gevent" or not os.environ.get("DATABASE_URL", "").startswith("postgres"):
+        return
+
+    # https://github.com/psycopg/psycogreen
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
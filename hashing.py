@@ -0,0 +1,212 @@
+import multiprocessing
+import os
+import threading
+
+from passlib.apps import custom_app_context
+from passlib.context import CryptContext
+
+class HashingPoolSaturated(Exception):
+    """
+    Raised when too many passwords are already waiting to be hashed
+    """
+
+def password_context(rounds=None):
+    """
+    Returns the passlib context for hashing passwords with at least the given number
+    of rounds, or passlib's custom_app_context if rounds isn't given
+
+    Hashes made with fewer rounds are reported as needing an update when verified.
+    """
+
+    if not rounds:
+        return custom_app_context
+
+    # same schemes as custom_app_context
+    # https://passlib.readthedocs.io/en/stable/lib/passlib.apps.html#custom-applications
+    return CryptContext(schemes=["sha512_crypt", "sha256_crypt"],
+                        default="sha512_crypt",
+                        all__default_rounds=rounds,
+                        all__min_rounds=rounds,
+                        all__vary_rounds=0.1)
+
+# context used by pool processes, set up by _init_worker
+_worker_context = None
+
+def _init_worker(rounds):
+    global _worker_context
+    _worker_context = password_context(rounds)
+
+def _encrypt(secret):
+    return _worker_context.encrypt(secret)
+
+def _verify_and_update(secret, hash):
+    return _worker_context.verify_and_update(secret, hash)
+
+def _gevent_patched():
+    """
+    Returns whether gevent has patched the standard library, as gunicorn's gevent workers do
+    """
+
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+def _serve(calls, results, rounds):
+    """
+    Runs in the processes of a GeventPool, calling the functions received
+    through calls and sending their results through results
+    """
+
+    _init_worker(rounds)
+    while True:
+        function, args = calls.recv()
+        try:
+            results.send((True, function(*args)))
+        except Exception as e:
+            results.send((False, e))
+
+class GeventPool(object):
+    """
+    Pool of size processes for gevent workers, whose patched threads would block
+    on the pipes of a multiprocessing pool
+
+    Each process has pipes of its own, the one of its results being waited on through
+    gevent's event loop, so the worker keeps serving other requests meanwhile.
+    """
+
+    def __init__(self, size, rounds):
+        from gevent.queue import Queue
+
+        self.rounds = rounds
+        self._idle = Queue()
+        for _ in range(size):
+            self._idle.put(self._start())
+
+    def _start(self):
+        """
+        Starts a process, returning it along with the ends of its pipes
+        """
+
+        # one-way pipes are plain OS pipes, which stay blocking for the process,
+        # unlike duplex ones, which are sockets that gevent makes non-blocking
+        calls_reader, calls = multiprocessing.Pipe(duplex=False)
+        results, results_writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_serve, args=(calls_reader, results_writer, self.rounds))
+        process.daemon = True
+        process.start()
+        calls_reader.close()
+        results_writer.close()
+        return process, calls, results
+
+    def apply(self, function, args, timeout):
+        """
+        Calls function with args in one of the processes, waiting for its result
+        for at most timeout seconds
+        """
+
+        from gevent.queue import Empty
+        from gevent.socket import wait_read
+
+        try:
+            process, calls, results = self._idle.get(timeout=timeout)
+        except Empty:
+            raise multiprocessing.TimeoutError()
+        answered = False
+        try:
+            calls.send((function, args))
+            wait_read(results.fileno(), timeout, multiprocessing.TimeoutError())
+            succeeded, result = results.recv()
+            answered = True
+        finally:
+            # a process that didn't answer may still be working, so replace it with a fresh one
+            if not answered:
+                process.terminate()
+                calls.close()
+                results.close()
+                process, calls, results = self._start()
+            self._idle.put((process, calls, results))
+
+        if not succeeded:
+            raise result
+        return result
+
+class Hasher(object):
+    """
+    Hashes and verifies passwords in a pool of pool_size processes, so that
+    hashing doesn't hold the GIL of the process serving requests
+
+    At most max_pending passwords can be waiting or being hashed at once;
+    any more raise HashingPoolSaturated right away instead of queueing up.
+    With a pool_size of 0, passwords are hashed in the calling thread.
+
+    Under gevent, passwords are hashed in a GeventPool instead of a multiprocessing
+    pool, still in other processes.
+    """
+
+    def __init__(self, rounds=None, pool_size=2, max_pending=8, timeout=30):
+        self.rounds = rounds
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.context = password_context(rounds)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        """
+        Returns this process' pool, starting it if needed
+        """
+
+        # pools don't survive forking (e.g. by gunicorn), so each process starts its own
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                if _gevent_patched():
+                    self._pool = GeventPool(self.pool_size, self.rounds)
+                else:
+                    self._pool = multiprocessing.Pool(self.pool_size, _init_worker, (self.rounds,))
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, function, *args):
+        """
+        Calls function with args in the pool, waiting for its result
+        """
+
+        if not self._slots.acquire(False):
+            raise HashingPoolSaturated()
+        try:
+            pool = self._get_pool()
+            if isinstance(pool, GeventPool):
+                return pool.apply(function, args, self.timeout)
+            return pool.apply_async(function, args).get(self.timeout)
+        finally:
+            self._slots.release()
+
+    def encrypt(self, secret):
+        """
+        Returns a new hash of secret
+        """
+
+        if not self.pool_size:
+            return self.context.encrypt(secret)
+        return self._run(_encrypt, secret)
+
+    def verify_and_update(self, secret, hash):
+        """
+        Checks secret against hash, returning whether it matched and, if hash was
+        made with outdated settings, a new hash of secret (None otherwise)
+        """
+
+        if not self.pool_size:
+            return self.context.verify_and_update(secret, hash)
+        return self._run(_verify_and_update, secret, hash)
+
+    def verify(self, secret, hash):
+        """
+        Returns whether secret matches hash
+        """
+
+        return self.verify_and_update(secret, hash)[0]
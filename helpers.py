@@ -1,9 +1,13 @@
 import os
+import base64
+import json
 
 from functools import wraps
-from flask import request, redirect, url_for
+from flask import current_app, request, redirect, url_for
 from flask_login import current_user
 from urlparse import urlparse, urljoin
+from werkzeug.routing import AnyConverter
+from models import LIST_TYPES
 
 def login_required(f):
     """
@@ -18,6 +22,16 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+class ListTypeConverter(AnyConverter):
+    """
+    URL converter only matching the names of the lists in LIST_TYPES, so that
+    mistyped list URLs aren't found instead of showing an empty list
+    http://werkzeug.pocoo.org/docs/0.14/routing/#custom-converters
+    """
+
+    def __init__(self, url_map):
+        super(ListTypeConverter, self).__init__(url_map, *LIST_TYPES)
+
 def is_safe_url(target):
     """
     http://flask.pocoo.org/snippets/62/
@@ -27,3 +41,48 @@ def is_safe_url(target):
     test_url = urlparse(urljoin(request.host_url, target))
     return test_url.scheme in ('http', 'https') and \
            ref_url.netloc == test_url.netloc
+
+def stream_template(template_name, **context):
+    """
+    Renders a template as it's being sent to the client rather than all at once
+    http://flask.pocoo.org/docs/0.12/patterns/streaming/#streaming-from-templates
+    """
+
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(5)
+    return stream
+
+def encode_cursor(values):
+    """
+    Encodes the values identifying a position in a list as an opaque, URL-safe string
+    """
+
+    return base64.urlsafe_b64encode(json.dumps(values))
+
+def decode_cursor(cursor, size):
+    """
+    Decodes a cursor of size values created by encode_cursor, raising ValueError if it's invalid
+    """
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (TypeError, UnicodeError):
+        raise ValueError("invalid cursor")
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("invalid cursor")
+
+    return values
+
+def collecting(items, callback):
+    """
+    Yields each of items, then calls callback with a list of all of them
+    """
+
+    collected = []
+    for item in items:
+        collected.append(item)
+        yield item
+    callback(collected)
@@ -0,0 +1,171 @@
+import os
+import random
+import threading
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from metrics import Histogram, LATENCY_BUCKETS
+
+# https://igdb.github.io/api/
+DEFAULT_URL = "https://igdbcom-internet-game-database-v1.p.mashape.com/games/"
+
+class IGDBError(Exception):
+    """
+    Raised when a request to IGDB fails
+    """
+
+class IGDBUnavailable(IGDBError):
+    """
+    Raised without contacting IGDB while the circuit breaker is open
+    """
+
+class CircuitBreaker(object):
+    """
+    Stops calls to a failing service for reset_timeout seconds after
+    failure_threshold consecutive failures, then lets a single trial call
+    through to find out whether it has recovered
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns whether a call may be made right now
+        """
+
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at < self.reset_timeout:
+                return False
+            # half-open, let this call through and hold off any others until it's done
+            self.opened_at = time.time()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+    @property
+    def state(self):
+        return "closed" if self.opened_at is None else "open"
+
+class IGDBClient(object):
+    """
+    IGDB API client reusing pooled keep-alive connections, with timeouts,
+    retries with jittered exponential backoff and a circuit breaker
+    """
+
+    def __init__(self, url, api_key, connect_timeout=2.0, read_timeout=5.0, retries=2,
+                 backoff=0.1, pool_size=10, breaker=None):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker(failure_threshold=5, reset_timeout=30)
+        self.latency = Histogram(LATENCY_BUCKETS)
+
+        # http://docs.python-requests.org/en/master/user/advanced/#session-objects
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, path="", params=None):
+        """
+        Sends a GET request to the API and returns the decoded JSON response
+        """
+
+        attempt = 0
+        while True:
+            # fail fast while the API is known to be down
+            if not self.breaker.allow():
+                raise IGDBUnavailable("IGDB circuit breaker is open")
+
+            start = time.time()
+            try:
+                response = self.session.get(self.url + path,
+                    headers={
+                        "X-Mashape-Key": self.api_key,
+                        "Accept": "application/json"
+                    },
+                    params=params,
+                    timeout=self.timeout
+                )
+                error = None
+                if response.status_code == 429 or response.status_code >= 500:
+                    error = IGDBError("IGDB responded with status {}".format(response.status_code))
+                elif response.status_code == 200:
+                    results = response.json()
+            except requests.RequestException as e:
+                error = IGDBError("IGDB request failed: {}".format(e))
+            except ValueError:
+                # like an error page from a proxy in front of the API, sent with a 200
+                error = IGDBError("IGDB responded with a body that isn't JSON")
+            finally:
+                self.latency.observe(time.time() - start)
+
+            if error is None:
+                self.breaker.record_success()
+                # client errors won't go away by retrying, so don't count them against the API
+                if response.status_code != 200:
+                    raise IGDBError("IGDB responded with status {}".format(response.status_code))
+                return results
+
+            self.breaker.record_failure()
+            if attempt >= self.retries:
+                raise error
+
+            # back off exponentially, with full jitter so retries from different
+            # workers don't hit the API at the same time
+            # https://www.awsarchitectureblog.com/2015/03/backoff.html
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+    def search(self, query, limit):
+        """
+        Searches the API for games matching query
+        """
+
+        return self.get(params={
+            "fields": "name,cover",
+            "limit": limit,
+            "search": query
+        })
+
+    def games(self, igdb_ids, fields="name,cover"):
+        """
+        Looks up many games by their IDs in a single request, returning those that exist
+        """
+
+        # https://igdb.github.io/api/references/pagination/#multiple-ids
+        return self.get(",".join(str(int(igdb_id)) for igdb_id in igdb_ids), params={"fields": fields})
+
+def client_from_env():
+    """
+    Creates an IGDB client configured from the environment variables
+    """
+
+    return IGDBClient(os.environ.get("IGDB_URL", DEFAULT_URL),
+                      os.environ.get("API_KEY"),
+                      connect_timeout=float(os.environ.get("IGDB_CONNECT_TIMEOUT", 2)),
+                      read_timeout=float(os.environ.get("IGDB_READ_TIMEOUT", 5)),
+                      retries=int(os.environ.get("IGDB_RETRIES", 2)),
+                      pool_size=int(os.environ.get("IGDB_POOL_SIZE", 10)),
+                      breaker=CircuitBreaker(int(os.environ.get("IGDB_BREAKER_THRESHOLD", 5)),
+                                             float(os.environ.get("IGDB_BREAKER_RESET", 30))))
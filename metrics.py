@@ -0,0 +1,481 @@
+import atexit
+import cProfile
+import errno
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+
+from flask import request
+from sqlalchemy import event
+
+# bucket upper bounds for request and API latencies, in seconds
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# bucket upper bounds for the number of SQL statements run by a request
+QUERY_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50, 100]
+
+class Histogram(object):
+    """
+    Cumulative histogram of observed values, bucketed by upper bound
+    """
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+
+    def snapshot(self):
+        """
+        Returns the bucket counts, total count and sum of observed values
+        """
+
+        with self._lock:
+            return {
+                "buckets": list(zip(self.buckets, self.counts)),
+                "count": self.count,
+                "sum": self.sum
+            }
+
+class RequestStats(object):
+    """
+    What a single request has spent its time on so far
+    """
+
+    def __init__(self, record_statements=False):
+        self.start = time.time()
+        self.endpoint = None
+        self.status = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.external = {}
+        self.statements = [] if record_statements else None
+        self.profiler = None
+
+class Metrics(object):
+    """
+    Collects per-endpoint request latencies, SQL statement counts and times and
+    time spent calling external services, and renders them in Prometheus' text format
+    https://prometheus.io/docs/instrumenting/exposition_formats/
+
+    Requests are measured by middleware wrapping the app, until their response
+    has been sent in full, so streamed pages are measured along with the queries
+    they run while streaming.
+
+    Metrics are kept per process. If directory is given, each process also saves
+    them there, at most every flush_interval seconds, and renders the metrics of
+    every process that saved them, so that scrapes reaching any worker see the
+    same totals. Counters and histograms are summed, keeping those of workers
+    that have exited, while gauges are the highest of the running workers.
+
+    Requests slower than slow_request_ms (if set) are logged along with the
+    SQL statements they ran, and a profile_sample_rate fraction of requests
+    is profiled with cProfile, their profiles saved in profile_dir.
+    """
+
+    def __init__(self, app=None, engine=None, slow_request_ms=0, profile_dir=None, profile_sample_rate=0.01,
+                 directory=None, flush_interval=1.0):
+        self.slow_request_ms = slow_request_ms
+        self.profile_dir = profile_dir
+        self.profile_sample_rate = profile_sample_rate
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._flushed_at = 0
+        self.logger = logging.getLogger("tracklog.slow_requests")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._latencies = {}
+        self._query_counts = {}
+        self._sql_time = {}
+        self._external_time = {}
+        self._collectors = []
+
+        # Flask's own logger only logs in debug mode, so log slow requests to stderr
+        if slow_request_ms and not self.logger.handlers:
+            self.logger.addHandler(logging.StreamHandler())
+
+        # save what was recorded since the last flush when the worker exits
+        if directory:
+            atexit.register(self.flush)
+
+        if app is not None:
+            self.init_app(app)
+        if engine is not None:
+            self.init_engine(engine)
+
+    def init_app(self, app):
+        """
+        Wraps app with the measuring middleware
+        """
+
+        app.wsgi_app = self.middleware(app.wsgi_app)
+
+        @app.before_request
+        def record_endpoint():
+            stats = self.current()
+            if stats is not None:
+                stats.endpoint = request.endpoint
+
+    def init_engine(self, engine):
+        """
+        Counts and times the SQL statements run through engine
+        """
+
+        # http://docs.sqlalchemy.org/en/latest/faq/performance.html#query-profiling
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start_time", []).append(time.time())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.time() - conn.info["query_start_time"].pop()
+            stats = self.current()
+            if stats is None:
+                return
+            stats.queries += 1
+            stats.sql_time += elapsed
+            if stats.statements is not None:
+                stats.statements.append((elapsed, statement))
+
+    def current(self):
+        """
+        Returns the stats of the request being handled by this thread, if any
+        """
+
+        return getattr(self._local, "stats", None)
+
+    @contextmanager
+    def timed(self, service):
+        """
+        Adds the time spent in the with block to the current request's time
+        spent calling service
+        """
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            stats = self.current()
+            if stats is not None:
+                stats.external[service] = stats.external.get(service, 0.0) + time.time() - start
+
+    def collect(self, name, metric_type, description, function):
+        """
+        Adds a metric whose value is read by calling function when rendering
+
+        function returns either a number, a Histogram or a dict mapping
+        label dicts (as tuples of pairs) to numbers.
+        """
+
+        self._collectors.append((name, metric_type, description, function))
+
+    def middleware(self, wsgi_app):
+        def measured_app(environ, start_response):
+            stats = RequestStats(record_statements=bool(self.slow_request_ms))
+            self._local.stats = stats
+
+            if self.profile_dir and random.random() < self.profile_sample_rate:
+                stats.profiler = cProfile.Profile()
+                stats.profiler.enable()
+
+            def measured_start_response(status, headers, exc_info=None):
+                stats.status = status.split(" ", 1)[0]
+                return start_response(status, headers, exc_info)
+
+            try:
+                response = wsgi_app(environ, measured_start_response)
+            except Exception:
+                stats.status = "500"
+                self.finish(stats, environ)
+                raise
+
+            return _MeasuredResponse(response, lambda: self.finish(stats, environ))
+
+        return measured_app
+
+    def finish(self, stats, environ):
+        """
+        Records a finished request's stats
+        """
+
+        elapsed = time.time() - stats.start
+        if self.current() is stats:
+            self._local.stats = None
+        endpoint = stats.endpoint or "none"
+
+        with self._lock:
+            key = (endpoint, stats.status or "none")
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if endpoint not in self._latencies:
+                self._latencies[endpoint] = Histogram(LATENCY_BUCKETS)
+                self._query_counts[endpoint] = Histogram(QUERY_BUCKETS)
+            self._sql_time[endpoint] = self._sql_time.get(endpoint, 0.0) + stats.sql_time
+            for service, seconds in stats.external.items():
+                key = (endpoint, service)
+                self._external_time[key] = self._external_time.get(key, 0.0) + seconds
+        self._latencies[endpoint].observe(elapsed)
+        self._query_counts[endpoint].observe(stats.queries)
+
+        if self.directory and time.time() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+        if stats.profiler is not None:
+            stats.profiler.disable()
+            stats.profiler.dump_stats(os.path.join(self.profile_dir, "{}-{}-{}.prof".format(
+                endpoint, int(stats.start * 1000), threading.current_thread().ident)))
+
+        if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+            lines = ["Slow request: {} {} ({}) took {:.1f}ms, {} SQL statements in {:.1f}ms{}".format(
+                environ.get("REQUEST_METHOD"), environ.get("PATH_INFO"), endpoint, elapsed * 1000,
+                stats.queries, stats.sql_time * 1000,
+                "".join(", {} {:.1f}ms".format(service, seconds * 1000)
+                        for service, seconds in sorted(stats.external.items())))]
+            lines.extend("  {:.1f}ms: {}".format(seconds * 1000, " ".join(statement.split()))
+                         for seconds, statement in stats.statements)
+            self.logger.warning("\n".join(lines))
+
+    def series(self):
+        """
+        Returns this process' metrics as a list of (name, type, description, samples)
+        tuples, samples being (labels, value) pairs whose labels are tuples of pairs
+        and whose values are numbers, or Histogram snapshots for histograms
+        """
+
+        with self._lock:
+            requests = dict(self._requests)
+            latencies = dict(self._latencies)
+            query_counts = dict(self._query_counts)
+            sql_time = dict(self._sql_time)
+            external_time = dict(self._external_time)
+
+        series = [
+            ("tracklog_requests_total", "counter", "Requests handled, by endpoint and status code.",
+             [((("endpoint", endpoint), ("status", status)), count)
+              for (endpoint, status), count in requests.items()]),
+            ("tracklog_request_duration_seconds", "histogram", "Time until the response was sent in full.",
+             [((("endpoint", endpoint),), histogram.snapshot()) for endpoint, histogram in latencies.items()]),
+            ("tracklog_request_sql_queries", "histogram", "SQL statements run per request.",
+             [((("endpoint", endpoint),), histogram.snapshot()) for endpoint, histogram in query_counts.items()]),
+            ("tracklog_request_sql_duration_seconds_total", "counter", "Time spent running SQL statements.",
+             [((("endpoint", endpoint),), seconds) for endpoint, seconds in sql_time.items()]),
+            ("tracklog_request_external_duration_seconds_total", "counter", "Time spent calling external services.",
+             [((("endpoint", endpoint), ("service", service)), seconds)
+              for (endpoint, service), seconds in external_time.items()])
+        ]
+
+        for name, metric_type, description, function in self._collectors:
+            value = function()
+            if isinstance(value, Histogram):
+                samples = [((), value.snapshot())]
+            elif isinstance(value, dict):
+                samples = [(tuple(sorted(labels)), number) for labels, number in value.items()]
+            else:
+                samples = [((), value)]
+            series.append((name, metric_type, description, samples))
+
+        return series
+
+    def _path(self, pid):
+        return os.path.join(self.directory, "{}.json".format(pid))
+
+    def flush(self):
+        """
+        Saves this process' metrics in directory, for the other processes to render
+        """
+
+        self._flushed_at = time.time()
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            # it's there already, created by this process or another one
+            if e.errno != errno.EEXIST:
+                raise
+
+        # write to a temporary file first so that other processes never read half of it
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w") as temporary_file:
+            json.dump(self.series(), temporary_file)
+        os.rename(temporary_path, self._path(os.getpid()))
+
+    def _saved_series(self):
+        """
+        Returns the series saved by every other process, along with whether the process is still running
+        """
+
+        saved = []
+        for name in os.listdir(self.directory):
+            pid, extension = os.path.splitext(name)
+            if extension != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as saved_file:
+                    series = json.load(saved_file)
+            except (IOError, ValueError):
+                continue
+            # JSON turns label tuples into lists
+            series = [(name, metric_type, description,
+                       [(tuple(tuple(label) for label in labels), value) for labels, value in samples])
+                      for name, metric_type, description, samples in series]
+            saved.append((series, _running(int(pid))))
+        return saved
+
+    def render(self):
+        """
+        Returns every metric in Prometheus' text format, those of every process
+        that saved them in directory if it's set
+        """
+
+        series = self.series()
+        if self.directory:
+            self.flush()
+            series = _merge([(series, True)] + self._saved_series())
+
+        lines = []
+        for name, metric_type, description, samples in series:
+            lines.extend(["# HELP {} {}".format(name, description), "# TYPE {} {}".format(name, metric_type)])
+            for labels, value in sorted(samples):
+                if metric_type == "histogram":
+                    lines.extend(_histogram(name, dict(labels), value))
+                else:
+                    lines.append(_sample(name, dict(labels), value))
+
+        return "\n".join(lines) + "\n"
+
+def directory_from_env():
+    """
+    Returns the directory worker processes save their metrics in, METRICS_DIR or by
+    default a temporary directory shared by every worker process on the machine
+    """
+
+    directory = os.environ.get("METRICS_DIR")
+    if not directory:
+        # one directory per database, like the list cache
+        database = hashlib.sha1(os.environ.get("DATABASE_URL", "")).hexdigest()[:12]
+        directory = os.path.join(tempfile.gettempdir(), "tracklog-metrics-{}".format(database))
+    return directory
+
+def clear_directory(directory):
+    """
+    Deletes the metrics saved in directory, e.g. by the workers of a previous run
+    """
+
+    shutil.rmtree(directory, ignore_errors=True)
+
+class _MeasuredResponse(object):
+    """
+    WSGI response calling finish once its last chunk has been sent, or
+    once it's closed if that happens first
+    """
+
+    def __init__(self, response, finish):
+        self.response = response
+        self._finish = finish
+        self._finished = False
+
+    def __iter__(self):
+        for chunk in self.response:
+            yield chunk
+        self.finish()
+
+    def close(self):
+        try:
+            if hasattr(self.response, "close"):
+                self.response.close()
+        finally:
+            self.finish()
+
+    def finish(self):
+        if not self._finished:
+            self._finished = True
+            self._finish()
+
+def _sample(name, labels, value):
+    """
+    Returns a single sample line of a metric
+    """
+
+    if labels:
+        name += "{" + ",".join('{}="{}"'.format(label, str(labels[label]).replace("\\", "\\\\").replace('"', '\\"'))
+                               for label in sorted(labels)) + "}"
+    return "{} {}".format(name, repr(float(value)))
+
+def _histogram(name, labels, snapshot):
+    """
+    Returns the sample lines of a histogram snapshot
+    """
+
+    lines = [_sample(name + "_bucket", dict(labels, le=repr(float(bound))), count)
+             for bound, count in snapshot["buckets"]]
+    lines.append(_sample(name + "_bucket", dict(labels, le="+Inf"), snapshot["count"]))
+    lines.append(_sample(name + "_sum", labels, snapshot["sum"]))
+    lines.append(_sample(name + "_count", labels, snapshot["count"]))
+    return lines
+
+def _running(pid):
+    """
+    Returns whether a process with the given ID is running
+    """
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+def _merge(processes):
+    """
+    Merges the series of several processes, given as (series, running) pairs,
+    summing counters and histograms and taking the highest gauges of running processes
+    """
+
+    merged = []
+    by_name = {}
+    for series, running in processes:
+        for name, metric_type, description, samples in series:
+            if name not in by_name:
+                by_name[name] = (metric_type, {})
+                merged.append((name, metric_type, description, by_name[name][1]))
+            totals = by_name[name][1]
+            if metric_type == "gauge" and not running:
+                continue
+            for labels, value in samples:
+                if labels not in totals:
+                    totals[labels] = value
+                elif metric_type == "histogram":
+                    totals[labels] = _add_snapshots(totals[labels], value)
+                elif metric_type == "gauge":
+                    totals[labels] = max(totals[labels], value)
+                else:
+                    totals[labels] += value
+
+    return [(name, metric_type, description, totals.items()) for name, metric_type, description, totals in merged]
+
+def _add_snapshots(first, second):
+    """
+    Returns the sum of two snapshots of histograms with the same buckets
+    """
+
+    return {
+        "buckets": [(bound, count + other_count)
+                    for (bound, count), (other_bound, other_count) in zip(first["buckets"], second["buckets"])],
+        "count": first["count"] + second["count"],
+        "sum": first["sum"] + second["sum"]
+    }
@@ -1,6 +1,8 @@
 # http://flask.pocoo.org/docs/0.12/patterns/sqlalchemy/
 
-from sqlalchemy import Column, Integer, String, ForeignKey
+from collections import OrderedDict
+from sqlalchemy import Column, Integer, SmallInteger, String, ForeignKey, ForeignKeyConstraint, Index, func
+from sqlalchemy.types import TypeDecorator
 from flask_login import UserMixin
 from database import Base
 
@@ -19,6 +21,23 @@ class User(Base, UserMixin):
     def __repr__(self):
         return "<User %r>" % (self.username)
 
+# speeds up case-insensitive username lookups on login
+Index("ix_users_username_lower", func.lower(User.username))
+
+class CachedUser(UserMixin):
+    """
+    Copy of a user's non-sensitive fields that can be kept in memory between requests,
+    leaving out the password hash
+    """
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+
+    def __repr__(self):
+        return "<CachedUser %r>" % (self.username)
+
 class Platform(Base):
 	__tablename__ = "platforms"
 	id = Column(Integer, primary_key=True)
@@ -29,9 +48,12 @@ class Platform(Base):
 
 class UserPlatform(Base):
 	__tablename__ = "user_platforms"
+	__table_args__ = (
+		Index("ux_user_platforms_user_platform", "user_id", "platform_id", unique=True),
+	)
 	id = Column(Integer, primary_key=True)
-	user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-	platform_id = Column(Integer, ForeignKey("platforms.id"), nullable=False)
+	user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+	platform_id = Column(Integer, ForeignKey("platforms.id", ondelete="CASCADE"), nullable=False)
 
 	def __init__(self, user_id, platform_id):
 		self.user_id = user_id
@@ -40,7 +62,7 @@ class UserPlatform(Base):
 class Game(Base):
 	__tablename__ = "games"
 	id = Column(Integer, primary_key=True)
-	igdb_id = Column(Integer, nullable=False)
+	igdb_id = Column(Integer, nullable=False, index=True, unique=True)
 	name = Column(String, nullable=False)
 	image_url = Column(String, nullable=False)
 
@@ -49,16 +71,66 @@ class Game(Base):
 		self.name = name
 		self.image_url = image_url
 
+# the lists users keep games in, by the number stored for them in list_entries
+# (numbers of existing lists must never change, as they're in the database)
+LIST_TYPES = OrderedDict([("backlog", 1), ("wishlist", 2)])
+LIST_TYPE_NAMES = dict((number, name) for name, number in LIST_TYPES.items())
+
+class ListType(TypeDecorator):
+    """
+    List type stored as its number in LIST_TYPES, and read back as its name
+    """
+
+    impl = SmallInteger
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if value not in LIST_TYPES:
+            raise ValueError("unknown list type: {!r}".format(value))
+        return LIST_TYPES[value]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return LIST_TYPE_NAMES[value]
+
 class ListEntry(Base):
 	__tablename__ = "list_entries"
+	__table_args__ = (
+		Index("ix_list_entries_user_list_type", "user_id", "list_type"),
+		Index("ix_list_entries_user_platform", "user_id", "platform_id"),
+		Index("ux_list_entries_user_game_platform", "user_id", "game_id", "platform_id", unique=True),
+		# entries can only be under one of the user's platforms, and go away along with it
+		ForeignKeyConstraint(["user_id", "platform_id"], ["user_platforms.user_id", "user_platforms.platform_id"],
+		                     name="fk_list_entries_user_platform", ondelete="CASCADE"),
+	)
 	id = Column(Integer, primary_key=True)
-	user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+	user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
 	game_id = Column(Integer, ForeignKey("games.id"), nullable=False)
-	platform_id = Column(Integer, ForeignKey("platforms.id"), nullable=False)
-	list_type = Column(String, nullable=False)
+	platform_id = Column(Integer, ForeignKey("platforms.id", ondelete="CASCADE"), nullable=False)
+	list_type = Column(ListType, nullable=False)
 
 	def __init__(self, user_id, game_id, platform_id, list_type):
 		self.user_id = user_id
 		self.game_id = game_id
 		self.platform_id = platform_id
 		self.list_type = list_type
+
+class ListCount(Base):
+	__tablename__ = "list_counts"
+	__table_args__ = (
+		# counts go away along with the user's platform, like the entries they count
+		ForeignKeyConstraint(["user_id", "platform_id"], ["user_platforms.user_id", "user_platforms.platform_id"],
+		                     name="fk_list_counts_user_platform", ondelete="CASCADE"),
+	)
+	user_id = Column(Integer, primary_key=True, autoincrement=False)
+	list_type = Column(ListType, primary_key=True)
+	platform_id = Column(Integer, primary_key=True, autoincrement=False)
+	entries = Column(Integer, nullable=False)
+
+	def __init__(self, user_id, list_type, platform_id, entries):
+		self.user_id = user_id
+		self.list_type = list_type
+		self.platform_id = platform_id
+		self.entries = entries
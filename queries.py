@@ -0,0 +1,291 @@
+import itertools
+
+from sqlalchemy import select, and_, or_, func, literal
+from models import *
+
+def insert_ignore(session, table):
+    """
+    Returns an INSERT statement for table that silently skips rows
+    violating one of its unique constraints, for either a session or a connection
+    """
+
+    # connections know their dialect, sessions only through their engine
+    dialect = (getattr(session, "dialect", None) or session.get_bind().dialect).name
+
+    # https://www.postgresql.org/docs/current/static/sql-insert.html#SQL-ON-CONFLICT
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+
+    # https://sqlite.org/lang_conflict.html
+    if dialect == "sqlite":
+        return table.insert().prefix_with("OR IGNORE")
+
+    return table.insert().prefix_with("IGNORE")
+
+def get_or_create_game(session, igdb_id, name, image_url):
+    """
+    Inserts a game unless a game with the same IGDB ID already exists
+
+    Returns the stored game's row (id, igdb_id, name, image_url) and whether it was just inserted
+    """
+
+    games = Game.__table__
+
+    # rely on the unique index on igdb_id rather than checking first, so that
+    # users adding the same new game at the same time can't create duplicates
+    created = session.execute(insert_ignore(session, games).
+                              values(igdb_id=igdb_id, name=name, image_url=image_url)).rowcount == 1
+
+    game = session.execute(select([games.c.id, games.c.igdb_id, games.c.name, games.c.image_url]).
+                           where(games.c.igdb_id == igdb_id)).first()
+
+    return game, created
+
+def add_list_entry(session, user_id, game_id, platform_id, list_type):
+    """
+    Inserts a list entry unless the user already has the game under the same platform,
+    counting it in list_counts
+
+    Returns the ID of the inserted entry, or None if it wasn't inserted
+    """
+
+    result = session.execute(insert_ignore(session, ListEntry.__table__).
+                             values(user_id=user_id, game_id=game_id,
+                                    platform_id=platform_id, list_type=list_type))
+    if result.rowcount != 1:
+        return None
+
+    change_list_count(session, user_id, list_type, platform_id, 1)
+    return result.inserted_primary_key[0]
+
+def change_list_count(session, user_id, list_type, platform_id, delta):
+    """
+    Adds delta to the number of entries a user has under platform_id in one of their lists
+    """
+
+    counts = ListCount.__table__
+
+    # make sure there's a row to add to, inserting it separately so that two first
+    # entries added at the same time can't both insert it (one waits for the other)
+    if delta > 0:
+        session.execute(insert_ignore(session, counts).
+                        values(user_id=user_id, list_type=list_type, platform_id=platform_id, entries=0))
+
+    session.execute(counts.update().
+                    where(counts.c.user_id == user_id).
+                    where(counts.c.list_type == list_type).
+                    where(counts.c.platform_id == platform_id).
+                    values(entries=counts.c.entries + delta))
+
+def count_lists(session, user_id=None):
+    """
+    Recomputes the list_counts of one user, or of every user if user_id is None,
+    from their list entries
+
+    Counts are set in place rather than deleted and inserted again, so that entries
+    added at the same time, which insert the counts they're missing, can't conflict
+    with it. Runs on sessions and connections alike.
+    """
+
+    counts = ListCount.__table__
+    entries = ListEntry.__table__
+
+    # add the counts that are missing, leaving alone those that appeared in the meantime
+    missing = select([entries.c.user_id, entries.c.list_type, entries.c.platform_id, literal(0)]).distinct()
+
+    # then set every count to the number of entries it counts
+    actual = select([func.count(entries.c.id)]). \
+                 where(entries.c.user_id == counts.c.user_id). \
+                 where(entries.c.list_type == counts.c.list_type). \
+                 where(entries.c.platform_id == counts.c.platform_id). \
+                 as_scalar()
+    update = counts.update().values(entries=actual)
+
+    if user_id is not None:
+        missing = missing.where(entries.c.user_id == user_id)
+        update = update.where(counts.c.user_id == user_id)
+
+    session.execute(insert_ignore(session, counts).from_select(["user_id", "list_type", "platform_id", "entries"],
+                                                               missing))
+    session.execute(update)
+
+def list_counts(session, user_id):
+    """
+    Returns (list_type, platform_id, entries) rows counting a user's entries in each
+    list under each platform, leaving out those they have none of
+
+    Reads a single row per list and platform of the user, however many entries they have.
+    """
+
+    return session.query(ListCount.list_type, ListCount.platform_id, ListCount.entries). \
+                   filter(ListCount.user_id == user_id). \
+                   filter(ListCount.entries > 0). \
+                   all()
+
+def list_count_drift(session):
+    """
+    Compares every stored list count with the number of entries it counts, returning
+    (user_id, list_type, platform_id, stored, actual) rows for those that don't match
+    """
+
+    entries = ListEntry.__table__
+    actual = dict(((user_id, list_type, platform_id), count) for user_id, list_type, platform_id, count in
+                  session.execute(select([entries.c.user_id, entries.c.list_type, entries.c.platform_id,
+                                          func.count(entries.c.id)]).
+                                  group_by(entries.c.user_id, entries.c.list_type, entries.c.platform_id)))
+    stored = dict(((row.user_id, row.list_type, row.platform_id), row.entries) for row in
+                  session.query(ListCount.user_id, ListCount.list_type, ListCount.platform_id, ListCount.entries))
+
+    return [key + (stored.get(key, 0), actual.get(key, 0)) for key in sorted(set(actual) | set(stored))
+            if stored.get(key, 0) != actual.get(key, 0)]
+
+def list_entries_query(session, user_id, list_type):
+    """
+    Returns a query for the entries in one of a user's lists as rows of
+    (id, platform, igdb_id, name, image_url), ordered by platform and game name
+    """
+
+    return session.query(ListEntry.id, Platform.name.label("platform"), Game.igdb_id, Game.name, Game.image_url). \
+                   join(Game). \
+                   join(Platform). \
+                   filter(ListEntry.user_id == user_id). \
+                   filter(ListEntry.list_type == list_type). \
+                   order_by(Platform.name, Game.name, ListEntry.id)
+
+def list_entries_page(session, user_id, list_type, after=None, limit=100):
+    """
+    Returns up to limit entries of a user's list, starting after the
+    (platform, name, id) of the last entry of the previous page
+
+    Seeking past the previous page rather than using OFFSET keeps every page
+    as cheap to fetch as the first one
+    """
+
+    query = list_entries_query(session, user_id, list_type)
+
+    if after:
+        platform, name, entry_id = after
+        query = query.filter(or_(Platform.name > platform,
+                                 and_(Platform.name == platform,
+                                      or_(Game.name > name,
+                                          and_(Game.name == name, ListEntry.id > entry_id)))))
+
+    return query.limit(limit).all()
+
+def list_groups(session, user_id, list_type):
+    """
+    Yields (platform, entries) pairs for one of a user's lists, one platform at a time,
+    reading entries (as dicts) from the database in batches instead of all at once
+    """
+
+    rows = list_entries_query(session, user_id, list_type).yield_per(500)
+    for platform, entries in itertools.groupby(rows, key=lambda row: row.platform):
+        yield platform, [entry._asdict() for entry in entries]
+
+# how many entry IDs to put in a single IN clause, staying under
+# SQLite's default limit of 999 parameters per statement
+IDS_PER_STATEMENT = 500
+
+def _selected_entries(session, user_id, list_type, entry_ids, platform_id):
+    """
+    Yields queries for the given entries of one of a user's lists, or for all
+    of its entries under platform_id if entry_ids is None
+    """
+
+    query = session.query(ListEntry). \
+                    filter(ListEntry.user_id == user_id). \
+                    filter(ListEntry.list_type == list_type)
+
+    if platform_id is not None:
+        query = query.filter(ListEntry.platform_id == platform_id)
+    if entry_ids is None:
+        yield query
+        return
+
+    entry_ids = sorted(set(entry_ids))
+    for i in range(0, len(entry_ids), IDS_PER_STATEMENT):
+        yield query.filter(ListEntry.id.in_(entry_ids[i:i + IDS_PER_STATEMENT]))
+
+def _locked_entries(session, user_id, list_type, entry_ids, platform_id):
+    """
+    Returns (id, platform_id) rows for the given entries of one of a user's lists, or
+    for all of its entries under platform_id if entry_ids is None, locking them (on
+    databases with row locks) so that nothing else changes them until the transaction ends
+    """
+
+    rows = []
+    for query in _selected_entries(session, user_id, list_type, entry_ids, platform_id):
+        rows.extend(query.with_entities(ListEntry.id, ListEntry.platform_id).with_for_update().all())
+    return rows
+
+def _platform_counts(rows):
+    """
+    Returns (platform_id, entries) pairs counting (id, platform_id) rows under each platform
+    """
+
+    counts = {}
+    for entry_id, platform_id in rows:
+        counts[platform_id] = counts.get(platform_id, 0) + 1
+    return counts.items()
+
+def _changed_entries(session, list_type, rows):
+    """
+    Yields queries for the entries of rows that are still in list_type,
+    IDS_PER_STATEMENT entries at a time
+    """
+
+    entry_ids = [entry_id for entry_id, platform_id in rows]
+    for i in range(0, len(entry_ids), IDS_PER_STATEMENT):
+        yield session.query(ListEntry). \
+                      filter(ListEntry.id.in_(entry_ids[i:i + IDS_PER_STATEMENT])). \
+                      filter(ListEntry.list_type == list_type)
+
+def move_list_entries(session, user_id, list_type, to_list_type, entry_ids=None, platform_id=None):
+    """
+    Moves entries of a user's list to another list, either the given entries or
+    all of those under platform_id, with one UPDATE per IDS_PER_STATEMENT entries,
+    moving their list counts along
+
+    Returns the number of entries moved
+    """
+
+    # lock the entries first and move exactly those, so that the counts moved are those of the entries moved
+    rows = _locked_entries(session, user_id, list_type, entry_ids, platform_id)
+    moved = 0
+    for query in _changed_entries(session, list_type, rows):
+        moved += query.update({ListEntry.list_type: to_list_type}, synchronize_session=False)
+
+    if moved == len(rows):
+        for selected_platform_id, count in _platform_counts(rows):
+            change_list_count(session, user_id, list_type, selected_platform_id, -count)
+            change_list_count(session, user_id, to_list_type, selected_platform_id, count)
+    else:
+        # without row locks (SQLite), some of the entries were changed by someone else
+        # before they could be moved, so count the user's lists again instead
+        count_lists(session, user_id)
+    return moved
+
+def delete_list_entries(session, user_id, list_type, entry_ids=None, platform_id=None):
+    """
+    Deletes entries of a user's list, either the given entries or all of those
+    under platform_id, with one DELETE per IDS_PER_STATEMENT entries, updating
+    their list counts
+
+    Returns the number of entries deleted
+    """
+
+    # lock the entries first and delete exactly those, so that the counts lowered are those of the entries deleted
+    rows = _locked_entries(session, user_id, list_type, entry_ids, platform_id)
+    deleted = 0
+    for query in _changed_entries(session, list_type, rows):
+        deleted += query.delete(synchronize_session=False)
+
+    if deleted == len(rows):
+        for selected_platform_id, count in _platform_counts(rows):
+            change_list_count(session, user_id, list_type, selected_platform_id, -count)
+    else:
+        # without row locks (SQLite), some of the entries were changed by someone else
+        # before they could be deleted, so count the user's lists again instead
+        count_lists(session, user_id)
+    return deleted
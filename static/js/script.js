@@ -1,8 +1,16 @@
 var removeIcon = " <i class='fa fa-times' aria-hidden='true'></i>";
+var trashIcon = "<i class='fa fa-trash' aria-hidden='true'></i>";
 var searchTimer;
 var listTimer;
+var addedPanels = 0;
 var $searchInput;
 var $searchResults;
+var tooltipOptions = {
+    delay: {
+        "show": 500
+    },
+    placement: "bottom"
+};
 
 $(function() {
     // figure out on which page the user is, and set the 
@@ -50,7 +58,8 @@ $(function() {
     });
 
     // toggle between minus and plus signs as the user collapses/expands lists
-    $(".panel-title a").on("click", function() {
+    // (including those added to the page later on)
+    $(document).on("click", ".panel-title a", function() {
         var title = this;
         clearTimeout(listTimer);
         // wait 300 milliseconds to sync in with the slide effect
@@ -64,14 +73,22 @@ $(function() {
         }, 300);
     });
 
+    // add games to the list without reloading it
+    $("#game-form").on("submit", function(event) {
+        event.preventDefault();
+        addEntry($(this));
+    });
+
     // display modal to confirm game/platform deletion
-    $(".delete").on("click", function(event) {
+    // (including that of games added to the page later on)
+    $(document).on("click", ".delete", function(event) {
         // stop form submission
         event.preventDefault();
         var $form = $(this).closest("form");
+        var $entry = $form.closest("li[data-entry-id]");
         // attempt to get game or platform name
-        var game = $("#game-name").text();
-        var platform = $("input[name='platform_name']").val();
+        var game = $("#game-name", $entry).text();
+        var platform = $("input[name='platform_name']", $form).val();
         // show either the game or platform name in the modal body, 
         // depending on context
         $(".modal-body span").text(game || platform);
@@ -79,19 +96,21 @@ $(function() {
         $(".modal").modal({
             keyboard: true
         })
-        // submit form if user has confirmed
+        // delete the game in place, or submit the form, if user has confirmed
+        .off("click", "#confirm")
         .on("click", "#confirm", function() {
-            $form.trigger("submit");
+            if ($entry.length) {
+                $(".modal").modal("hide");
+                deleteEntry($entry);
+            }
+            else {
+                $form.trigger("submit");
+            }
         });
     });
 
     // initialize tooltips
-    $('[data-toggle="tooltip"]').tooltip({
-        delay: {
-            "show": 500
-        },
-        placement: "bottom"
-    });
+    $('[data-toggle="tooltip"]').tooltip(tooltipOptions);
 });
 
 /*
@@ -178,7 +197,7 @@ function createListItem(game) {
         img = game.cover.url;
     }
     else {
-        img = "https://placeholdit.imgix.net/~text?txtsize=22&txt=Missing%20cover&w=90&h=90";
+        img = Flask.url_for("cover_placeholder");
     }
 
     // create a wrapper for list content and append game data to it
@@ -189,7 +208,9 @@ function createListItem(game) {
         src: img,
         alt: game.name
     }).appendTo(wrapper);
-    wrapper.append(game.name);
+    $("<span/>", {
+        text: game.name
+    }).appendTo(wrapper);
 
     // append wrapper with game data to the created list item
     wrapper.appendTo(listItem);
@@ -249,3 +270,263 @@ function closeResultList() {
     // clear the result list and hide it
     $searchResults.html("").hide();
 }
+
+/**
+ * Adds the game selected in the add game form to the current list, and
+ * displays it in the list without reloading the page.
+ *
+ * @param {Object} $form - The add game form.
+ */
+function addEntry($form) {
+    var listType = $form.data("list-type");
+
+    $.ajax({
+        url: Flask.url_for("add_entry_json", { list_type: listType }),
+        method: "POST",
+        data: $form.serialize(),
+        dataType: "json"
+    })
+    .done(function(data) {
+        insertEntry(createEntryItem(data.entry, listType), data.entry.platform);
+
+        // clear the form for the next game
+        clearGameSelection();
+        $("select[name='platform']", $form).prop("selectedIndex", 0);
+
+        showMessage(data.message, "success");
+    })
+    .fail(function(xhr) {
+        showMessage(errorMessage(xhr), "danger");
+    });
+}
+
+/**
+ * Deletes a game from the current list, and removes it from the
+ * list without reloading the page.
+ *
+ * @param {Object} $entry - List item of the game to delete.
+ */
+function deleteEntry($entry) {
+    var listType = $("#game-form").data("list-type");
+
+    $.ajax({
+        url: Flask.url_for("delete_entry_json", { list_type: listType, entry_id: $entry.data("entry-id") }),
+        method: "DELETE",
+        dataType: "json"
+    })
+    .done(function(data) {
+        removeEntry($entry, listType);
+        showMessage(data.message, "success");
+    })
+    .fail(function(xhr) {
+        showMessage(errorMessage(xhr), "danger");
+    });
+}
+
+/**
+ * Creates a list item for a game in one of the user's lists, like the
+ * ones on the list page, and returns it.
+ *
+ * @param {Object} entry - The list entry, as returned by the server.
+ * @param {string} listType - The list the game is in.
+ * @return {Object} listItem - The created list item for entry.
+ */
+function createEntryItem(entry, listType) {
+    // start from a search result item showing the game's cover and name
+    var listItem = createListItem({
+        id: entry.igdb_id,
+        name: entry.name,
+        cover: {
+            url: Flask.url_for("cover", { igdb_id: entry.igdb_id })
+        }
+    });
+    listItem.removeClass("result-item").attr("data-entry-id", entry.id);
+    $(".list-content-wrapper span", listItem).attr("id", "game-name");
+
+    // add a form for deleting the game, which works without JavaScript as well
+    var form = $("<form/>", {
+        action: Flask.url_for("delete_game", { list_type: listType }),
+        method: "post"
+    });
+    $("<input/>", {
+        type: "hidden",
+        name: "igdb_id",
+        value: entry.igdb_id
+    }).appendTo(form);
+    $("<input/>", {
+        type: "hidden",
+        name: "platform",
+        value: entry.platform
+    }).appendTo(form);
+    $("<button/>", {
+        type: "submit",
+        class: "btn btn-default delete",
+        "data-toggle": "tooltip",
+        title: "Delete from " + listType,
+        html: trashIcon
+    }).appendTo(form);
+    form.appendTo($(".list-content-wrapper", listItem));
+
+    return listItem;
+}
+
+/**
+ * Displays a game's list item under its platform, keeping games sorted by name.
+ *
+ * @param {Object} listItem - List item of the game to display.
+ * @param {string} platform - The platform the game was added under.
+ */
+function insertEntry(listItem, platform) {
+    var panel = findPlatformPanel(platform);
+    if (!panel.length) {
+        panel = createPlatformPanel(platform);
+    }
+
+    // put the game before the first one whose name comes after its own
+    var name = $("#game-name", listItem).text();
+    var next = $(".list-group-item", panel).filter(function() {
+        return $("#game-name", this).text() > name;
+    }).first();
+    if (next.length) {
+        listItem.insertBefore(next);
+    }
+    else {
+        listItem.appendTo($(".list-group", panel));
+    }
+
+    $('[data-toggle="tooltip"]', listItem).tooltip(tooltipOptions);
+}
+
+/**
+ * Removes a game's list item, along with its platform's panel if it was
+ * the platform's last game.
+ *
+ * @param {Object} $entry - List item of the game to remove.
+ * @param {string} listType - The list the game was in.
+ */
+function removeEntry($entry, listType) {
+    var panel = $entry.closest(".panel");
+
+    $('[data-toggle="tooltip"]', $entry).tooltip("destroy");
+    $entry.remove();
+
+    if (!$(".list-group-item", panel).length) {
+        panel.remove();
+    }
+
+    // let the user know once the list is empty, as the page does
+    if (!$(".panel-group > .panel").length) {
+        $(".panel-group").html($("<div/>", {
+            class: "alert alert-info text-center",
+            text: "Your " + listType + " is currently empty."
+        }));
+    }
+}
+
+/**
+ * Finds the panel holding a platform's games.
+ *
+ * @param {string} platform - Name of the platform.
+ * @return {Object} The platform's panel, empty if there's none.
+ */
+function findPlatformPanel(platform) {
+    return $(".panel-group > .panel").filter(function() {
+        return $.trim($(".panel-title a", this).text()) === platform;
+    });
+}
+
+/**
+ * Creates an empty panel for a platform's games, like the ones on the
+ * list page, and displays it in order of platform name.
+ *
+ * @param {string} platform - Name of the platform.
+ * @return {Object} panel - The created panel.
+ */
+function createPlatformPanel(platform) {
+    var id = "collapse-added-" + (++addedPanels);
+
+    var panel = $("<div/>", {
+        class: "panel panel-default"
+    });
+    var link = $("<a/>", {
+        role: "button",
+        "data-toggle": "collapse",
+        href: "#" + id,
+        "aria-expanded": "true",
+        "aria-controls": id
+    });
+    $("<i/>", {
+        class: "fa fa-minus-square-o",
+        "aria-hidden": "true"
+    }).appendTo(link);
+    link.append(document.createTextNode(platform));
+    $("<div/>", {
+        class: "panel-heading",
+        role: "tab",
+        html: $("<h4/>", {
+            class: "panel-title",
+            html: link
+        })
+    }).appendTo(panel);
+    $("<div/>", {
+        id: id,
+        class: "panel-collapse collapse in",
+        role: "tabpanel",
+        html: $("<ul/>", {
+            class: "list-group"
+        })
+    }).appendTo(panel);
+
+    // the list isn't empty anymore
+    $(".panel-group > .alert").remove();
+
+    // put the panel before the first one whose platform comes after this one
+    var next = $(".panel-group > .panel").filter(function() {
+        return $.trim($(".panel-title a", this).text()) > platform;
+    }).first();
+    if (next.length) {
+        panel.insertBefore(next);
+    }
+    else {
+        panel.appendTo(".panel-group");
+    }
+
+    return panel;
+}
+
+/**
+ * Displays a message above the list, like the ones the server flashes.
+ *
+ * @param {string} message - The message to display.
+ * @param {string} category - Bootstrap alert category, e.g. "success" or "danger".
+ */
+function showMessage(message, category) {
+    $(".alert[role='alert']").remove();
+
+    var alert = $("<div/>", {
+        class: "alert alert-" + category + " alert-dismissable fade in",
+        role: "alert"
+    });
+    $("<button/>", {
+        type: "button",
+        class: "close",
+        "data-dismiss": "alert",
+        "aria-label": "Close",
+        html: "<span aria-hidden='true'>&times;</span>"
+    }).appendTo(alert);
+    alert.append(document.createTextNode(message));
+    alert.insertBefore("#game-form");
+}
+
+/**
+ * Returns the error message of a failed request to the server.
+ *
+ * @param {Object} xhr - The failed request.
+ * @return {string} The server's error message, or a generic one.
+ */
+function errorMessage(xhr) {
+    if (xhr.responseJSON && xhr.responseJSON.error) {
+        return xhr.responseJSON.error;
+    }
+    return "Uh oh, something went wrong.";
+}
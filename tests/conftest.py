@@ -0,0 +1,107 @@
+"""
+Shared fixtures, run with: python -m pytest tests
+
+Tests run against a SQLite database and caches in a temporary directory, and
+against local fake IGDB and image servers rather than the real ones.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# configure the app before anything imports it, as the database and caches are set up on import
+TEMP_DIR = tempfile.mkdtemp(prefix="tracklog-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(TEMP_DIR, "tracklog.db")
+os.environ["LIST_CACHE_URL"] = "sqlite:///" + os.path.join(TEMP_DIR, "lists.db")
+os.environ["COVER_CACHE_DIR"] = os.path.join(TEMP_DIR, "covers")
+os.environ["METRICS_DIR"] = os.path.join(TEMP_DIR, "metrics")
+os.environ["SECRET_KEY"] = "tests"
+os.environ["API_KEY"] = "tests"
+os.environ["IGDB_URL"] = "http://127.0.0.1:9/games/"
+os.environ["HASH_POOL_SIZE"] = "0"
+os.environ["HASH_ROUNDS"] = "1000"
+os.environ.pop("DATABASE_REPLICA_URL", None)
+
+from tests.fakes import FakeServer, igdb_handler
+
+PLATFORMS = ["PC", "PlayStation 4", "Xbox One"]
+
+# removed at exit, after the app has saved its metrics there one last time
+atexit.register(shutil.rmtree, TEMP_DIR, ignore_errors=True)
+
+@pytest.fixture
+def database():
+    """
+    Empty tables, with the platforms in PLATFORMS
+    """
+
+    from database import Base, engine, db_session
+    from models import Platform
+
+    db_session.remove()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(Platform.__table__.insert(), [{"name": name} for name in PLATFORMS])
+
+    yield engine
+    db_session.remove()
+
+@pytest.fixture
+def tracklog(database):
+    """
+    The app module, with everything it keeps in memory or in its caches reset
+    """
+
+    import app as tracklog
+
+    tracklog.app.config["TESTING"] = True
+    for cache in [tracklog.search_cache, tracklog.user_cache, tracklog.list_cache]:
+        cache.clear()
+    tracklog.platform_registry.invalidate()
+    tracklog.game_index.load([])
+    tracklog.igdb.breaker.record_success()
+    return tracklog
+
+@pytest.fixture
+def client(tracklog):
+    """
+    Test client logged in as bob, who has PC in their platforms
+    """
+
+    client = tracklog.app.test_client()
+    client.post("/register", data={"username": "bob", "email": "bob@example.com",
+                                   "password": "secret", "confirm": "secret"})
+    client.post("/add-platform", data={"platform_name": "PC"})
+    with client.session_transaction() as flask_session:
+        flask_session.pop("_flashes", None)
+    return client
+
+@pytest.fixture
+def fake_igdb(tracklog, monkeypatch):
+    """
+    Fake IGDB server knowing a few games, which the app's IGDB client is pointed at
+    """
+
+    server = FakeServer(igdb_handler({1: "The Legend of Zelda", 2: "Zelda II: The Adventure of Link",
+                                      3: "Super Mario Bros."}))
+    monkeypatch.setattr(tracklog.igdb, "url", server.url + "games/")
+    yield server
+    server.close()
+
+@pytest.fixture
+def queries(database):
+    """
+    List of the SQL statements run while the test is running
+    """
+
+    from sqlalchemy import event
+
+    statements = []
+    record = lambda conn, cursor, statement, parameters, context, executemany: statements.append(statement)
+    event.listen(database, "before_cursor_execute", record)
+    yield statements
+    event.remove(database, "before_cursor_execute", record)
@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+import urlparse
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+class FakeServer(object):
+    """
+    Local HTTP server answering every GET request with handler(path), which returns
+    a (status, content type, body) tuple, or one with a dict of extra headers
+    after the body, after waiting delay seconds
+
+    The paths of the requests it got are kept in requests.
+    """
+
+    def __init__(self, handler, delay=0):
+        self.handler = handler
+        self.delay = delay
+        self.requests = []
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.requests.append(self.path)
+                response = fake.handler(self.path)
+                status, content_type, body = response[:3]
+                headers = response[3] if len(response) > 3 else {}
+                time.sleep(fake.delay)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+            request_queue_size = 128
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/".format(self.server.server_port)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def igdb_handler(games):
+    """
+    Returns a FakeServer handler answering like IGDB's games endpoint from games,
+    a dict of IGDB IDs to names, searching their names or looking them up by ID
+    """
+
+    def handle(path):
+        url = urlparse.urlparse(path)
+        ids = url.path.rstrip("/").rsplit("/", 1)[-1]
+        if ids != "games":
+            found = [int(igdb_id) for igdb_id in ids.split(",") if int(igdb_id) in games]
+        else:
+            query = urlparse.parse_qs(url.query).get("search", [""])[0].lower()
+            found = sorted(igdb_id for igdb_id, name in games.items() if query in name.lower())
+
+        return 200, "application/json", json.dumps([{
+            "id": igdb_id,
+            "name": games[igdb_id],
+            "cover": {"url": "//images.igdb.com/igdb/image/upload/t_thumb/{}.jpg".format(igdb_id)}
+        } for igdb_id in found])
+
+    return handle
@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+
+import pytest
+
+import cache
+from cache import TTLCache
+
+class Clock(object):
+    """
+    Stands in for the time module, with a time that only moves when told to
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+def test_entries_expire_after_ttl(clock):
+    search_cache = TTLCache(ttl=60, max_size=10)
+    search_cache.set("zelda", ["Zelda"])
+
+    clock.now += 59
+    assert search_cache.get("zelda") == ["Zelda"]
+    clock.now += 1
+    assert search_cache.get("zelda") is None
+    assert search_cache.stats()["size"] == 0
+
+def test_least_recently_used_entries_are_evicted(clock):
+    search_cache = TTLCache(ttl=60, max_size=2)
+    search_cache.set("zelda", 1)
+    search_cache.set("mario", 2)
+
+    # using zelda makes mario the least recently used entry
+    search_cache.get("zelda")
+    search_cache.set("fifa", 3)
+
+    assert search_cache.get("mario") is None
+    assert search_cache.get("zelda") == 1
+    assert search_cache.get("fifa") == 3
+
+def test_hits_and_misses_are_counted(clock):
+    search_cache = TTLCache(ttl=60, max_size=10)
+    search_cache.get("zelda")
+    search_cache.set("zelda", 1)
+    search_cache.get("zelda")
+    search_cache.get("zelda")
+
+    assert search_cache.stats() == {"hits": 2, "misses": 1, "size": 1}
+
+def test_concurrent_misses_load_once():
+    search_cache = TTLCache(ttl=60, max_size=10)
+    calls = []
+    release = threading.Event()
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return ["Zelda"]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(search_cache.get_or_load("zelda", load)))
+               for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    # let every thread miss before the first load finishes
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [["Zelda"]] * 10
+    assert search_cache.get("zelda") == ["Zelda"]
+
+def test_load_errors_reach_every_waiter_and_are_not_cached():
+    search_cache = TTLCache(ttl=60, max_size=10)
+    release = threading.Event()
+
+    def load():
+        release.wait(5)
+        raise IOError("IGDB is down")
+
+    errors = []
+    def search():
+        try:
+            search_cache.get_or_load("zelda", load)
+        except IOError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 5
+    assert search_cache.get_or_load("zelda", lambda: ["Zelda"]) == ["Zelda"]
+
+def test_search_asks_igdb_once_per_normalized_query(client, fake_igdb):
+    responses = [client.get(url) for url in ["/search?q=Zelda", "/search?q=zelda", "/search?q=%20ZELDA%20%20"]]
+
+    assert [response.status_code for response in responses] == [200] * 3
+    results = [json.loads(response.get_data())["results"] for response in responses]
+    assert results[0] == results[1] == results[2]
+    assert [game["id"] for game in results[0]] == [1, 2]
+    assert len(fake_igdb.requests) == 1
+    assert "search=zelda" in fake_igdb.requests[0]
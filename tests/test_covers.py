@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+from covers import CoverStore, sized_url
+from database import db_session
+from models import Game
+from tests.fakes import FakeServer
+
+def serve_images(path):
+    if "/moved/" in path:
+        return 302, "image/jpeg", "", {"Location": path.replace("/moved/", "/")}
+    if not path.endswith(".jpg"):
+        return 404, "text/plain", "not found"
+    return 200, "image/jpeg", "jpeg:" + path
+
+@pytest.fixture
+def image_server():
+    server = FakeServer(serve_images)
+    yield server
+    server.close()
+
+@pytest.fixture
+def store(image_server, tmpdir):
+    return CoverStore(str(tmpdir), max_bytes=1024 * 1024, hosts=(image_server.url.split("/")[2],))
+
+def image_url(server, name, size="t_cover_big"):
+    return "{}igdb/image/upload/{}/{}.jpg".format(server.url, size, name)
+
+@pytest.mark.parametrize("url, resized", [
+    ("//images.igdb.com/igdb/image/upload/t_cover_big/co1.jpg",
+     "https://images.igdb.com/igdb/image/upload/t_thumb/co1.jpg"),
+    ("http://Images.IGDB.com/igdb/image/upload/t_cover_big/co1.jpg",
+     "http://Images.IGDB.com/igdb/image/upload/t_thumb/co1.jpg")
+])
+def test_igdb_image_urls_are_resized(url, resized):
+    assert sized_url(url, "thumb") == resized
+
+@pytest.mark.parametrize("url", [
+    "",
+    "/covers/placeholder.svg",
+    "file:///etc/passwd",
+    "http://127.0.0.1:8000/t_thumb/co1.jpg",
+    "http://169.254.169.254/latest/meta-data/",
+    "//example.com/igdb/image/upload/t_thumb/co1.jpg",
+    "https://images.igdb.com.example.com/t_thumb/co1.jpg",
+    "https://images.igdb.com@example.com/t_thumb/co1.jpg",
+    "https://images.igdb.com:8080/t_thumb/co1.jpg"
+])
+def test_other_urls_are_never_fetched(url):
+    assert sized_url(url, "thumb") is None
+
+def test_covers_are_fetched_once_in_the_stored_size(store, image_server):
+    url = image_url(image_server, "co1")
+
+    assert store.get(1, lambda: url) == "jpeg:/igdb/image/upload/t_thumb/co1.jpg"
+    assert store.get(1, lambda: url) == "jpeg:/igdb/image/upload/t_thumb/co1.jpg"
+    assert image_server.requests == ["/igdb/image/upload/t_thumb/co1.jpg"]
+
+def test_missing_covers_are_remembered(store, image_server):
+    url = image_server.url + "igdb/image/upload/t_thumb/co1.png"
+
+    assert store.get(1, lambda: url) is None
+    assert store.get(1, lambda: url) is None
+    assert len(image_server.requests) == 1
+
+def test_redirects_are_never_followed(store, image_server):
+    url = image_url(image_server, "moved/co1")
+
+    assert store.get(1, lambda: url) is None
+    assert image_server.requests == ["/igdb/image/upload/t_thumb/moved/co1.jpg"]
+
+def test_least_recently_served_covers_make_room(image_server, tmpdir):
+    store = CoverStore(str(tmpdir), max_bytes=200, hosts=(image_server.url.split("/")[2],))
+
+    # each cover is about 40 bytes, so only four or five fit
+    for igdb_id in range(1, 7):
+        store.get(igdb_id, lambda: image_url(image_server, "co{}".format(igdb_id)))
+        os.utime(store.path(igdb_id), (igdb_id, igdb_id))
+
+    stored = sorted(name for name in os.listdir(store.directory) if name.endswith(".jpg"))
+    assert sum(os.path.getsize(os.path.join(store.directory, name)) for name in stored) <= 200
+    assert "6.jpg" in stored and "1.jpg" not in stored
+
+def test_cover_route_never_fetches_from_other_hosts(client, image_server):
+    db_session.add(Game(1, "Zelda", image_url(image_server, "co1")))
+    db_session.commit()
+
+    response = client.get("/covers/1")
+
+    assert response.status_code == 200
+    assert response.mimetype == "image/svg+xml"
+    assert image_server.requests == []
+
+def test_cover_route_serves_cached_covers(client, tracklog, store, image_server, monkeypatch):
+    monkeypatch.setattr(tracklog, "cover_store", store)
+    db_session.add(Game(1, "Zelda", image_url(image_server, "co1")))
+    db_session.commit()
+
+    response = client.get("/covers/1")
+    assert response.status_code == 200
+    assert response.mimetype == "image/jpeg"
+    assert response.get_data() == "jpeg:/igdb/image/upload/t_thumb/co1.jpg"
+    assert response.cache_control.max_age == tracklog.COVER_MAX_AGE
+
+    response = client.get("/covers/1", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert len(image_server.requests) == 1
@@ -0,0 +1,136 @@
+import imp
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib2
+
+import pytest
+
+from tests.fakes import FakeServer, igdb_handler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_config(monkeypatch, **environ):
+    for name, value in environ.items():
+        monkeypatch.setenv(name, value)
+    return imp.load_source("gunicorn_config_test", os.path.join(ROOT, "gunicorn_config.py"))
+
+def test_workers_are_gevent_workers_by_default(monkeypatch):
+    monkeypatch.delenv("GUNICORN_WORKER_CLASS", raising=False)
+    config = load_config(monkeypatch)
+
+    assert config.worker_class == "gevent"
+    assert not hasattr(config, "threads")
+
+def test_threads_are_only_set_for_gthread_workers(monkeypatch):
+    assert not hasattr(load_config(monkeypatch, GUNICORN_WORKER_CLASS="sync"), "threads")
+    assert load_config(monkeypatch, GUNICORN_WORKER_CLASS="gthread", GUNICORN_THREADS="4").threads == 4
+
+def test_sessions_are_scoped_per_greenlet(database):
+    gevent = pytest.importorskip("gevent")
+    from database import db_session
+
+    greenlets = [gevent.spawn(lambda: (db_session(), db_session())) for _ in range(3)]
+    gevent.joinall(greenlets)
+    sessions = [greenlet.value for greenlet in greenlets]
+
+    # the same session throughout a greenlet, and a different one in each greenlet
+    assert all(first is second for first, second in sessions)
+    assert len(set(id(first) for first, second in sessions)) == 3
+
+# hashes a few passwords at once in a gevent-patched process, printing the longest the
+# event loop went without running a greenlet that wakes up every 10ms
+HASH_UNDER_GEVENT = """
+from gevent import monkey; monkey.patch_all()
+import time, gevent
+from hashing import Hasher
+
+hasher = Hasher(rounds=200000, pool_size=2)
+hasher.encrypt("warm up")
+
+ticks = []
+def tick():
+    while True:
+        ticks.append(time.time())
+        gevent.sleep(0.01)
+gevent.spawn(tick)
+
+hashes = [gevent.spawn(hasher.encrypt, "secret") for _ in range(4)]
+gevent.joinall(hashes, raise_error=True)
+assert all(hasher.verify("secret", greenlet.value) for greenlet in hashes)
+print(max(later - earlier for earlier, later in zip(ticks, ticks[1:])))
+"""
+
+def test_hashing_doesnt_block_gevent_workers():
+    pytest.importorskip("gevent")
+
+    output = subprocess.check_output([sys.executable, "-c", HASH_UNDER_GEVENT], cwd=ROOT)
+
+    # hashing in the worker's own process would stall it for the length of a hash
+    assert float(output.strip().splitlines()[-1]) < 0.1
+
+def free_port():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+def get(url, timeout=10):
+    """
+    Returns the status of a GET request to url and how long it took
+    """
+
+    start = time.time()
+    try:
+        status = urllib2.urlopen(url, timeout=timeout).getcode()
+    except urllib2.HTTPError as e:
+        status = e.code
+    return status, time.time() - start
+
+def test_pages_stay_fast_while_searches_wait_on_igdb(database):
+    pytest.importorskip("gevent")
+    pytest.importorskip("gunicorn")
+
+    # every search waits on IGDB for two seconds
+    igdb = FakeServer(igdb_handler({1: "The Legend of Zelda"}), delay=2)
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY="1", GUNICORN_WORKER_CLASS="gevent",
+               IGDB_URL=igdb.url + "games/")
+    server = subprocess.Popen([sys.executable, "-c", "from gunicorn.app.wsgiapp import run; run()",
+                               "-c", "gunicorn_config.py", "app:app"], cwd=ROOT, env=env)
+    url = "http://127.0.0.1:{}/".format(port)
+    try:
+        deadline = time.time() + 20
+        while True:
+            try:
+                get(url, timeout=1)
+                break
+            except IOError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError("gunicorn didn't start")
+                time.sleep(0.1)
+
+        # tie the only worker up with more searches than a sync worker would ever get through
+        searches = []
+        threads = [threading.Thread(target=lambda i=i: searches.append(get(url + "search?q=zelda+{}".format(i))))
+                   for i in range(50)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+
+        status, elapsed = get(url)
+        for thread in threads:
+            thread.join(10)
+    finally:
+        server.terminate()
+        server.wait()
+        igdb.close()
+
+    assert status == 200
+    assert elapsed < 1
+    assert len(searches) == 50
+    assert all(status == 200 for status, elapsed in searches)
@@ -0,0 +1,120 @@
+import json
+import time
+import urlparse
+
+import pytest
+
+from igdb import CircuitBreaker, IGDBClient, IGDBError, IGDBUnavailable
+from tests.fakes import FakeServer
+
+def responding(*statuses):
+    """
+    Returns a FakeServer handler answering with each of statuses in turn, then with the last one
+    """
+
+    statuses = list(statuses)
+    def handle(path):
+        status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+        return status, "application/json", json.dumps([{"id": 1, "name": "Zelda"}] if status == 200 else {})
+    return handle
+
+@pytest.fixture
+def server():
+    server = FakeServer(responding(200))
+    yield server
+    server.close()
+
+def make_client(server, **options):
+    options.setdefault("backoff", 0)
+    return IGDBClient(server.url + "games/", "key", **options)
+
+def test_get_returns_decoded_response(server):
+    client = make_client(server)
+
+    assert client.search("zelda", 10) == [{"id": 1, "name": "Zelda"}]
+    url = urlparse.urlparse(server.requests[0])
+    assert url.path == "/games/"
+    assert urlparse.parse_qs(url.query) == {"fields": ["name,cover"], "limit": ["10"], "search": ["zelda"]}
+    assert client.latency.snapshot()["count"] == 1
+
+def test_server_errors_are_retried(server):
+    server.handler = responding(500, 503, 200)
+    client = make_client(server, retries=2)
+
+    assert client.get() == [{"id": 1, "name": "Zelda"}]
+    assert len(server.requests) == 3
+    assert client.breaker.state == "closed"
+
+def test_retries_are_bounded(server):
+    server.handler = responding(500)
+    client = make_client(server, retries=2)
+
+    with pytest.raises(IGDBError):
+        client.get()
+    assert len(server.requests) == 3
+
+def test_client_errors_are_not_retried_nor_held_against_the_api(server):
+    server.handler = responding(404)
+    client = make_client(server, retries=2)
+
+    with pytest.raises(IGDBError):
+        client.get()
+    assert len(server.requests) == 1
+    assert client.breaker.failures == 0
+
+def test_slow_responses_time_out():
+    server = FakeServer(responding(200), delay=0.5)
+    try:
+        client = make_client(server, read_timeout=0.1, retries=0)
+        start = time.time()
+        with pytest.raises(IGDBError):
+            client.get()
+        assert time.time() - start < 0.4
+    finally:
+        server.close()
+
+def test_bodies_that_arent_json_are_errors(server):
+    server.handler = lambda path: (200, "text/html", "<html>Bad gateway</html>")
+    client = make_client(server, retries=1)
+
+    with pytest.raises(IGDBError):
+        client.get()
+    assert len(server.requests) == 2
+    assert client.breaker.failures == 2
+
+def test_breaker_fails_fast_once_open_then_lets_a_trial_through(server):
+    server.handler = responding(500, 500, 200)
+    client = make_client(server, retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+
+    for _ in range(2):
+        with pytest.raises(IGDBError):
+            client.get()
+    assert client.breaker.state == "open"
+
+    # no requests are sent while the breaker is open
+    with pytest.raises(IGDBUnavailable):
+        client.get()
+    assert len(server.requests) == 2
+
+    # until the trial request after reset_timeout succeeds and closes it
+    time.sleep(0.25)
+    assert client.get() == [{"id": 1, "name": "Zelda"}]
+    assert client.breaker.state == "closed"
+
+def test_search_falls_back_to_local_results_when_igdb_fails(client, tracklog, fake_igdb):
+    fake_igdb.handler = responding(500)
+    tracklog.game_index.add(7, "Zelda: Breath of the Wild", "")
+
+    response = client.get("/search?q=zelda")
+
+    assert response.status_code == 200
+    assert [game["id"] for game in json.loads(response.get_data())["results"]] == [7]
+
+def test_search_falls_back_to_local_results_when_igdb_responds_with_garbage(client, tracklog, fake_igdb):
+    fake_igdb.handler = lambda path: (200, "text/html", "<html>Bad gateway</html>")
+    tracklog.game_index.add(7, "Zelda: Breath of the Wild", "")
+
+    response = client.get("/search?q=zelda")
+
+    assert response.status_code == 200
+    assert [game["id"] for game in json.loads(response.get_data())["results"]] == [7]
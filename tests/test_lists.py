@@ -0,0 +1,127 @@
+import json
+
+import pytest
+
+def add(client, igdb_id, name, list_type="backlog", platform="PC"):
+    response = client.post("/api/lists/{}/entries".format(list_type),
+                           data=json.dumps({"igdb_id": igdb_id, "game_name": name, "platform": platform,
+                                            "image_url": ""}),
+                           content_type="application/json")
+    assert response.status_code == 201
+    return json.loads(response.get_data())["entry"]
+
+def get_json(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return json.loads(response.get_data())
+
+@pytest.fixture
+def backlog(client):
+    """
+    Five games in bob's backlog
+    """
+
+    return [add(client, igdb_id, name) for igdb_id, name in enumerate(["Echo", "Bravo", "Delta", "Alpha", "Charlie"], 1)]
+
+def test_pages_walk_the_list_in_order(client, backlog):
+    names = []
+    url = "/api/lists/backlog?limit=2"
+    while url:
+        page = get_json(client, url)
+        assert len(page["entries"]) <= 2
+        names.extend(entry["name"] for entry in page["entries"])
+        url = page["next"] and "/api/lists/backlog?limit=2&after=" + page["next"]
+
+    assert names == ["Alpha", "Bravo", "Charlie", "Delta", "Echo"]
+
+@pytest.mark.parametrize("limit", ["0", "-1"])
+def test_limits_below_one_return_single_entry_pages(client, backlog, limit):
+    page = get_json(client, "/api/lists/backlog?limit=" + limit)
+
+    assert [entry["name"] for entry in page["entries"]] == ["Alpha"]
+    assert page["next"]
+
+def test_invalid_cursors_are_rejected(client, backlog):
+    assert client.get("/api/lists/backlog?after=nonsense").status_code == 400
+
+def test_unchanged_lists_are_revalidated_with_304(client, backlog):
+    # streamed pages need reading in full before the next request
+    response = client.get("/lists/backlog")
+    etag = response.headers["ETag"]
+
+    assert response.status_code == 200
+    assert "Echo" in response.get_data()
+    assert client.get("/lists/backlog", headers={"If-None-Match": etag}).status_code == 304
+
+    add(client, 6, "Foxtrot")
+    response = client.get("/lists/backlog", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "Foxtrot" in response.get_data()
+
+def test_changes_through_one_worker_outdate_the_pages_of_the_others(client, tracklog, backlog, monkeypatch):
+    from cache import list_cache_from_env
+
+    # the page is cached by one worker, then a game is added through another
+    # worker, which has a cache of its own pointing at the same store
+    response = client.get("/lists/backlog")
+    response.get_data()
+    etag = response.headers["ETag"]
+    worker_cache = tracklog.list_cache
+    monkeypatch.setattr(tracklog, "list_cache", list_cache_from_env())
+    add(client, 6, "Foxtrot")
+    monkeypatch.setattr(tracklog, "list_cache", worker_cache)
+
+    response = client.get("/lists/backlog", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "Foxtrot" in response.get_data()
+
+def test_list_cache_is_shared_between_processes_by_default(monkeypatch, tmpdir):
+    import tempfile
+    from cache import SQLiteCache, list_cache_from_env
+
+    monkeypatch.delenv("LIST_CACHE_URL")
+    monkeypatch.setattr(tempfile, "tempdir", str(tmpdir))
+
+    list_cache = list_cache_from_env()
+    assert isinstance(list_cache, SQLiteCache)
+    list_cache.set("version:1", "a")
+    assert list_cache_from_env().get("version:1") == "a"
+
+@pytest.mark.parametrize("operation, body", [
+    ("move", []),
+    ("move", "wishlist"),
+    ("move", {"entries": [1], "to": []}),
+    ("move", {"entries": [1], "to": {"list": "wishlist"}}),
+    ("move", {"entries": [1], "to": "backlog"}),
+    ("move", {"entries": [1]}),
+    ("move", {"platform": ["PC"], "to": "wishlist"}),
+    ("delete", [1, 2]),
+    ("delete", {"platform": {"name": "PC"}}),
+    ("delete", {"entries": ["1"]}),
+    ("delete", {})
+])
+def test_invalid_bulk_operations_are_rejected(client, backlog, operation, body):
+    response = client.post("/api/lists/backlog/" + operation, data=json.dumps(body), content_type="application/json")
+
+    assert response.status_code == 400
+    assert len(get_json(client, "/api/lists/backlog")["entries"]) == 5
+
+@pytest.mark.parametrize("body", [
+    [],
+    ["PC", 1],
+    {"igdb_id": 1, "game_name": "Zelda", "platform": ["PC"]},
+    {"igdb_id": 1, "game_name": "Zelda", "platform": {"name": "PC"}},
+    {"igdb_id": 1, "game_name": ["Zelda"], "platform": "PC"},
+    {"igdb_id": 1, "game_name": 42, "platform": "PC"},
+    {"igdb_id": 1, "game_name": "Zelda", "platform": "PC", "image_url": {"url": "x"}},
+    {"igdb_id": [1], "game_name": "Zelda", "platform": "PC"},
+    {"igdb_id": 1, "platform": "PC"}
+])
+def test_invalid_entries_are_rejected_before_being_written(client, tracklog, body):
+    response = client.post("/api/lists/backlog/entries", data=json.dumps(body), content_type="application/json")
+
+    assert response.status_code == 400
+    assert json.loads(response.get_data())["error"]
+    assert get_json(client, "/api/lists/backlog")["entries"] == []
+    assert tracklog.db_session.query(tracklog.Game).count() == 0
+    assert len(tracklog.game_index) == 0
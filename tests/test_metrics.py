@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from flask import Flask
+
+from metrics import Metrics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a worker process handling some requests, whose circuit breaker is open, then
+# waiting for a line on its standard input before exiting
+WORKER = """
+import sys
+from flask import Flask
+from metrics import Metrics
+
+app = Flask(__name__)
+app.route("/")(lambda: "hello")
+metrics = Metrics(app, directory=sys.argv[1], flush_interval=0)
+metrics.collect("tracklog_igdb_circuit_open", "gauge", "Whether the circuit is open.", lambda: True)
+client = app.test_client()
+for _ in range(int(sys.argv[2])):
+    client.get("/").get_data()
+print("ready")
+sys.stdout.flush()
+sys.stdin.readline()
+"""
+
+def start_worker(directory, requests):
+    worker = subprocess.Popen([sys.executable, "-c", WORKER, directory, str(requests)], cwd=ROOT,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    assert worker.stdout.readline().strip() == "ready"
+    return worker
+
+def stop_worker(worker):
+    worker.stdin.write("\n")
+    worker.stdin.flush()
+    worker.wait()
+
+@pytest.fixture
+def metrics(tmpdir):
+    app = Flask(__name__)
+    app.route("/")(lambda: "hello")
+    metrics = Metrics(app, directory=str(tmpdir), flush_interval=0)
+    metrics.collect("tracklog_igdb_circuit_open", "gauge", "Whether the circuit is open.", lambda: False)
+    metrics.client = app.test_client()
+    return metrics
+
+def sample(rendered, line_start):
+    return [float(line.split()[-1]) for line in rendered.splitlines() if line.startswith(line_start)]
+
+def test_metrics_add_up_every_workers(metrics, tmpdir):
+    metrics.client.get("/").get_data()
+    workers = [start_worker(str(tmpdir), requests) for requests in [2, 3]]
+    try:
+        rendered = metrics.render()
+    finally:
+        for worker in workers:
+            stop_worker(worker)
+
+    assert sample(rendered, 'tracklog_requests_total{endpoint="<lambda>",status="200"}') == [6]
+    assert sample(rendered, 'tracklog_request_duration_seconds_count{endpoint="<lambda>"}') == [6]
+    assert sample(rendered, 'tracklog_request_duration_seconds_bucket{endpoint="<lambda>",le="+Inf"}') == [6]
+    assert sample(rendered, "tracklog_igdb_circuit_open ") == [1]
+    # each metric is only described once
+    assert rendered.count("# TYPE tracklog_requests_total counter") == 1
+
+def test_exited_workers_keep_counting_but_not_their_gauges(metrics, tmpdir):
+    stop_worker(start_worker(str(tmpdir), 2))
+
+    rendered = metrics.render()
+
+    assert sample(rendered, 'tracklog_requests_total{endpoint="<lambda>",status="200"}') == [2]
+    assert sample(rendered, "tracklog_igdb_circuit_open ") == [0]
+
+def test_metrics_are_saved_at_most_every_flush_interval(metrics, tmpdir):
+    metrics.flush_interval = 3600
+    metrics.client.get("/").get_data()
+    metrics.client.get("/").get_data()
+    saved = tmpdir.join("{}.json".format(os.getpid()))
+    saved_requests = lambda: json.loads(saved.read())[0][3][0][1]
+
+    # the first request is saved right away, but the second one waits for the next flush
+    assert saved_requests() == 1
+    metrics.render()
+    assert saved_requests() == 2
@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the tables as the first version of db_create.py created them
+OLD_SCHEMA = """
+CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR, email VARCHAR, password VARCHAR,
+                    PRIMARY KEY (id), UNIQUE (username), UNIQUE (email));
+CREATE TABLE platforms (id INTEGER NOT NULL, name VARCHAR NOT NULL, PRIMARY KEY (id));
+CREATE TABLE games (id INTEGER NOT NULL, igdb_id INTEGER NOT NULL, name VARCHAR NOT NULL,
+                    image_url VARCHAR NOT NULL, PRIMARY KEY (id));
+CREATE TABLE user_platforms (id INTEGER NOT NULL, user_id INTEGER NOT NULL, platform_id INTEGER NOT NULL,
+                             PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id),
+                             FOREIGN KEY(platform_id) REFERENCES platforms (id));
+CREATE TABLE list_entries (id INTEGER NOT NULL, user_id INTEGER NOT NULL, game_id INTEGER NOT NULL,
+                           platform_id INTEGER NOT NULL, list_type VARCHAR NOT NULL, PRIMARY KEY (id),
+                           FOREIGN KEY(user_id) REFERENCES users (id), FOREIGN KEY(game_id) REFERENCES games (id),
+                           FOREIGN KEY(platform_id) REFERENCES platforms (id));
+
+INSERT INTO users (id, username, email, password) VALUES (1, 'bob', 'bob@example.com', 'hash');
+INSERT INTO platforms (id, name) VALUES (1, 'PC'), (2, 'PlayStation 4');
+INSERT INTO user_platforms (id, user_id, platform_id) VALUES (1, 1, 1), (2, 1, 1);
+
+-- the same game stored twice, each copy in bob's backlog
+INSERT INTO games (id, igdb_id, name, image_url) VALUES (1, 10, 'Zelda', ''), (2, 10, 'Zelda', ''),
+                                                        (3, 20, 'Mario', '');
+INSERT INTO list_entries (id, user_id, game_id, platform_id, list_type) VALUES
+    (1, 1, 1, 1, 'backlog'), (2, 1, 2, 1, 'backlog'), (3, 1, 3, 1, 'wishlist'),
+    -- on a platform bob no longer has
+    (4, 1, 3, 2, 'backlog');
+"""
+
+@pytest.fixture
+def old_database(tmpdir):
+    path = str(tmpdir.join("old.db"))
+    connection = sqlite3.connect(path)
+    connection.executescript(OLD_SCHEMA)
+    connection.close()
+    return path
+
+def migrate(path):
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + path)
+    process = subprocess.Popen([sys.executable, "db_migrate.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    assert process.returncode == 0, output
+    return output
+
+def rows(path, statement):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(statement).fetchall()
+    finally:
+        connection.close()
+
+def test_old_databases_are_brought_up_to_date(old_database):
+    assert "Database is up to date." in migrate(old_database)
+
+    assert rows(old_database, "SELECT id, igdb_id FROM games ORDER BY id") == [(1, 10), (3, 20)]
+    assert rows(old_database, "SELECT game_id, platform_id, list_type FROM list_entries ORDER BY id") == \
+           [(1, 1, 1), (3, 1, 2), (3, 2, 1)]
+    assert rows(old_database, "SELECT user_id, platform_id FROM user_platforms ORDER BY platform_id") == \
+           [(1, 1), (1, 2)]
+    assert rows(old_database, "SELECT list_type, platform_id, entries FROM list_counts "
+                              "ORDER BY list_type, platform_id") == [(1, 1, 1), (1, 2, 1), (2, 1, 1)]
+    assert rows(old_database, "PRAGMA foreign_key_check") == []
+
+def test_migrating_twice_changes_nothing(old_database):
+    migrate(old_database)
+    tables = ["games", "list_entries", "user_platforms", "list_counts"]
+    before = [rows(old_database, "SELECT * FROM " + table) for table in tables]
+
+    migrate(old_database)
+
+    assert [rows(old_database, "SELECT * FROM " + table) for table in tables] == before
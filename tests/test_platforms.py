@@ -0,0 +1,65 @@
+import json
+import re
+
+from database import db_session
+from models import Game, ListCount, ListEntry, Platform, UserPlatform
+
+def platform_queries(statements):
+    return [statement for statement in statements if re.search(r"\bplatforms\b", statement)]
+
+def test_routes_dont_query_platforms_once_warm(client, queries):
+    client.get("/account-settings")
+    client.post("/add-game/backlog", data={"igdb_id": 1, "game_name": "Zelda", "platform": "PC", "image_url": ""})
+    client.post("/add-platform", data={"platform_name": "playstation 4"})
+    del queries[:]
+
+    assert client.get("/account-settings").status_code == 200
+    client.post("/add-game/backlog", data={"igdb_id": 2, "game_name": "Zelda II", "platform": "PC", "image_url": ""})
+    client.post("/add-platform", data={"platform_name": "xbox one"})
+
+    assert queries
+    assert platform_queries(queries) == []
+
+def test_changed_platforms_are_reloaded(client, tracklog):
+    assert tracklog.platform_registry.find("switch") is None
+
+    db_session.add(Platform("Switch"))
+    db_session.commit()
+
+    assert tracklog.platform_registry.find("switch").name == "Switch"
+    assert [platform.name for platform in tracklog.platform_registry.all()] == \
+           ["PC", "PlayStation 4", "Switch", "Xbox One"]
+
+def add_platform_elsewhere(database, name):
+    """
+    Adds a platform, with a game in bob's backlog under it, the way another
+    worker process would, without this process' registry knowing
+    """
+
+    with database.begin() as connection:
+        platform_id = connection.execute(Platform.__table__.insert().values(name=name)).inserted_primary_key[0]
+        connection.execute(UserPlatform.__table__.insert().values(user_id=1, platform_id=platform_id))
+        connection.execute(Game.__table__.insert().values(id=100, igdb_id=100, name="Zelda", image_url=""))
+        connection.execute(ListEntry.__table__.insert().values(user_id=1, game_id=100, platform_id=platform_id,
+                                                               list_type="backlog"))
+        connection.execute(ListCount.__table__.insert().values(user_id=1, list_type="backlog",
+                                                               platform_id=platform_id, entries=1))
+
+def test_platforms_added_by_other_workers_are_found(client, tracklog, database):
+    assert client.get("/stats").status_code == 200
+    add_platform_elsewhere(database, "Switch")
+
+    response = client.get("/stats")
+    assert response.status_code == 200
+    assert json.loads(response.get_data())["lists"]["backlog"]["platforms"] == {"Switch": 1}
+
+    response = client.get("/account-settings")
+    assert response.status_code == 200
+    assert "Switch" in response.get_data()
+
+def test_platforms_missing_from_the_database_too_are_reloaded_once(client, tracklog, queries):
+    client.get("/stats")
+    del queries[:]
+
+    assert tracklog.platform_registry.by_name("Dreamcast") is None
+    assert len(platform_queries(queries)) == 1
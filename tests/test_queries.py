@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+
+from models import User, UserPlatform, Game, ListEntry
+from queries import get_or_create_game, add_list_entry
+
+@pytest.fixture
+def session(database):
+    session = sessionmaker(bind=database)()
+    session.add(User("bob", "bob@example.com", "hash"))
+    session.flush()
+    session.add(UserPlatform(1, 1))
+    session.commit()
+    yield session
+    session.close()
+
+def test_get_or_create_game_inserts_each_game_once(session):
+    game, created = get_or_create_game(session, 1, "The Legend of Zelda", "//images.igdb.com/a.jpg")
+    assert created
+    again, created = get_or_create_game(session, 1, "Spoofed", "//example.com/b.jpg")
+    assert not created
+
+    assert again == game
+    assert (game.igdb_id, game.name) == (1, "The Legend of Zelda")
+    assert session.query(func.count(Game.id)).scalar() == 1
+
+def test_add_list_entry_skips_entries_the_user_has(session):
+    game, created = get_or_create_game(session, 1, "The Legend of Zelda", "")
+
+    entry_id = add_list_entry(session, 1, game.id, 1, "backlog")
+    assert entry_id == session.query(ListEntry.id).scalar()
+    assert add_list_entry(session, 1, game.id, 1, "wishlist") is None
+    assert session.query(func.count(ListEntry.id)).scalar() == 1
+
+def test_parallel_adds_of_a_new_game_leave_no_duplicates(session):
+    Session = sessionmaker(bind=session.get_bind())
+    start = threading.Event()
+    results = []
+    errors = []
+
+    def add():
+        thread_session = Session()
+        try:
+            start.wait(5)
+            game, created = get_or_create_game(thread_session, 1, "The Legend of Zelda", "")
+            entry_id = add_list_entry(thread_session, 1, game.id, 1, "backlog")
+            thread_session.commit()
+            results.append((created, entry_id))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            thread_session.close()
+
+    threads = [threading.Thread(target=add) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert errors == []
+    assert len(results) == 10
+    assert [created for created, entry_id in results].count(True) == 1
+    assert len([entry_id for created, entry_id in results if entry_id]) == 1
+    assert session.query(func.count(Game.id)).scalar() == 1
+    assert session.query(func.count(ListEntry.id)).scalar() == 1
@@ -0,0 +1,152 @@
+import json
+
+import pytest
+
+from cache import GAMES_VERSION
+from db_refresh import Checkpoint, refresh_games
+from database import db_session
+from igdb import IGDBClient
+from models import Game
+from tests.fakes import FakeServer, igdb_handler
+from tests.test_lists import add
+
+class CoverStore(object):
+    """
+    Stand-in cover store remembering the games whose covers were forgotten
+    """
+
+    def __init__(self):
+        self.forgotten = []
+
+    def forget(self, igdb_id):
+        self.forgotten.append(igdb_id)
+
+@pytest.fixture
+def igdb_games():
+    """
+    Names of the games the fake IGDB server knows, which tests may change
+    """
+
+    return {igdb_id: "Game {}".format(igdb_id) for igdb_id in range(1, 11)}
+
+@pytest.fixture
+def igdb_server(igdb_games):
+    server = FakeServer(igdb_handler(igdb_games))
+    yield server
+    server.close()
+
+@pytest.fixture
+def client_igdb(igdb_server):
+    return IGDBClient(igdb_server.url + "games/", "tests", retries=0, backoff=0)
+
+@pytest.fixture
+def games(database, igdb_games):
+    """
+    The fake IGDB server's games, stored with their current details
+    """
+
+    for igdb_id, name in sorted(igdb_games.items()):
+        db_session.add(Game(igdb_id, name, "//images.igdb.com/igdb/image/upload/t_thumb/{}.jpg".format(igdb_id)))
+    db_session.commit()
+
+@pytest.fixture
+def checkpoint(tmpdir):
+    return Checkpoint(str(tmpdir.join("checkpoint")))
+
+def refresh(client_igdb, checkpoint, **options):
+    options.setdefault("rate", 0)
+    stats = refresh_games(db_session, client_igdb, checkpoint, **options)
+    db_session.remove()
+    return stats
+
+def stored_names():
+    return dict(db_session.query(Game.igdb_id, Game.name).all())
+
+def test_games_are_looked_up_many_at_a_time(client_igdb, igdb_server):
+    games = client_igdb.games([3, 1, 42])
+
+    assert sorted(game["id"] for game in games) == [1, 3]
+    assert igdb_server.requests[0].startswith("/games/3,1,42?")
+
+def test_only_changed_games_are_updated(client_igdb, igdb_games, games, checkpoint, queries):
+    igdb_games[2] = "Game Two"
+    igdb_games[3] = "Game Three"
+    del igdb_games[9]
+
+    stats = refresh(client_igdb, checkpoint, chunk_size=4, batch_size=2)
+
+    assert stats == {"games": 10, "updated": 2, "requests": 5, "finished": True}
+    names = stored_names()
+    assert names[2] == "Game Two" and names[3] == "Game Three"
+    # games IGDB no longer knows about are kept as they are
+    assert names[9] == "Game 9"
+    # the changes of a chunk are written in a single statement
+    assert len([statement for statement in queries if statement.startswith("UPDATE games")]) == 1
+
+def test_interrupted_refreshes_resume_from_the_checkpoint(client_igdb, igdb_server, igdb_games, games, checkpoint):
+    stats = refresh(client_igdb, checkpoint, chunk_size=4, batch_size=4, max_chunks=2)
+    assert stats["games"] == 8 and not stats["finished"]
+    assert checkpoint.load() == 8
+
+    igdb_games[1] = "Game One"
+    igdb_games[10] = "Game Ten"
+    del igdb_server.requests[:]
+    stats = refresh(client_igdb, checkpoint, chunk_size=4, batch_size=4)
+
+    assert stats == {"games": 2, "updated": 1, "requests": 1, "finished": True}
+    assert igdb_server.requests[0].startswith("/games/9,10?")
+    assert stored_names()[1] == "Game 1"
+    # the next run starts over
+    assert checkpoint.load() == 0
+
+def test_covers_with_new_urls_are_forgotten(client_igdb, igdb_games, games, checkpoint):
+    db_session.query(Game).filter(Game.igdb_id.in_([4, 5])).update({Game.image_url: ""}, synchronize_session=False)
+    db_session.commit()
+    igdb_games[6] = "Game Six"
+    cover_store = CoverStore()
+
+    refresh(client_igdb, checkpoint, cover_store=cover_store)
+
+    # renamed games keep their covers
+    assert sorted(cover_store.forgotten) == [4, 5]
+
+def test_refreshes_outdate_cached_lists(client, tracklog, client_igdb, igdb_games, checkpoint):
+    add(client, 3, "Game 3")
+    assert "Game 3" in client.get("/lists/backlog").get_data()
+
+    igdb_games[3] = "Game Three"
+    refresh(client_igdb, checkpoint, list_cache=tracklog.list_cache)
+
+    page = client.get("/lists/backlog").get_data()
+    assert "Game Three" in page and "Game 3" not in page
+
+def test_lists_stay_cached_when_nothing_changed(client, tracklog, client_igdb, igdb_games, checkpoint):
+    # games IGDB doesn't know about are left as they are
+    del igdb_games[3]
+    add(client, 3, "Game 3")
+    response = client.get("/lists/backlog")
+    response.get_data()
+
+    refresh(client_igdb, checkpoint, list_cache=tracklog.list_cache)
+
+    assert client.get("/lists/backlog", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+def test_refreshes_reload_search_indexes(client, tracklog, client_igdb, igdb_games, games, checkpoint, monkeypatch):
+    monkeypatch.setattr(tracklog, "LOCAL_SEARCH_MIN", 1)
+    tracklog.game_index.load(tracklog.all_games(), tracklog.current_version(GAMES_VERSION))
+
+    def search(q):
+        response = client.get("/search?q=" + q)
+        assert response.status_code == 200
+        return [game["name"] for game in json.loads(response.get_data())["results"]]
+
+    assert search("game 3") == ["Game 3"]
+
+    igdb_games[3] = "Renamed Game"
+    refresh(client_igdb, checkpoint, list_cache=tracklog.list_cache)
+
+    # the index is only checked every GAME_INDEX_CHECK seconds
+    assert search("renamed") == []
+    monkeypatch.setattr(tracklog, "GAME_INDEX_CHECK", 0)
+    assert search("renamed") == ["Renamed Game"]
+    assert search("game 3") == []
@@ -0,0 +1,95 @@
+import imp
+import json
+import os
+import shutil
+import time
+
+import pytest
+
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+import database
+from tests.test_lists import add
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_database(monkeypatch, replica_url=None):
+    if replica_url:
+        monkeypatch.setenv("DATABASE_REPLICA_URL", replica_url)
+    else:
+        monkeypatch.delenv("DATABASE_REPLICA_URL", raising=False)
+    return imp.load_source("database_test", os.path.join(ROOT, "database.py"))
+
+def test_reads_go_to_the_primary_database_without_a_replica(monkeypatch, tmpdir, client, tracklog):
+    module = load_database(monkeypatch)
+    assert module.replica_session is module.db_session
+    assert module.replica_engine is module.engine
+
+    module = load_database(monkeypatch, "sqlite:///" + str(tmpdir.join("replica.db")))
+    assert module.replica_session is not module.db_session
+    assert str(module.replica_engine.url).endswith("replica.db")
+
+    # without a replica, writes don't pin reads to the primary database
+    add(client, 1, "Zelda")
+    with client.session_transaction() as flask_session:
+        assert "read_primary_until" not in flask_session
+    assert json.loads(client.get("/stats").get_data())["total"] == 1
+
+@pytest.fixture
+def replica(client, tracklog, monkeypatch, tmpdir):
+    """
+    Function copying the primary database to a replica that read-only routes
+    query, simulating the replica catching up
+    """
+
+    primary_path = tracklog.engine.url.database
+    replica_path = str(tmpdir.join("replica.db"))
+    replica_engine = database.engine_from_env("sqlite:///" + replica_path)
+    monkeypatch.setattr(tracklog, "replica_session", scoped_session(sessionmaker(bind=replica_engine),
+                                                                   scopefunc=database.scopefunc))
+
+    def catch_up():
+        tracklog.replica_session.remove()
+        replica_engine.dispose()
+        shutil.copy(primary_path, replica_path)
+
+    catch_up()
+    yield catch_up
+    replica_engine.dispose()
+
+def stop_reading_primary(client):
+    with client.session_transaction() as flask_session:
+        flask_session.pop("read_primary_until", None)
+
+def total(client):
+    return json.loads(client.get("/stats").get_data())["total"]
+
+def test_reads_go_to_the_replica(client, replica):
+    add(client, 1, "Zelda")
+    stop_reading_primary(client)
+
+    # the replica hasn't got the new entry yet
+    assert total(client) == 0
+    replica()
+    assert total(client) == 1
+
+def test_writes_keep_the_users_reads_on_the_primary_for_a_while(client, tracklog, replica):
+    before = time.time()
+    add(client, 1, "Zelda")
+
+    with client.session_transaction() as flask_session:
+        read_primary_until = flask_session["read_primary_until"]
+    assert before + tracklog.REPLICA_LAG <= read_primary_until <= time.time() + tracklog.REPLICA_LAG
+    assert total(client) == 1
+
+    with client.session_transaction() as flask_session:
+        flask_session["read_primary_until"] = time.time() - 1
+    assert total(client) == 0
+
+def test_lists_read_from_a_lagging_replica_arent_cached(client, replica):
+    add(client, 1, "Zelda")
+    stop_reading_primary(client)
+
+    assert "Zelda" not in client.get("/lists/backlog").get_data()
+    replica()
+    assert "Zelda" in client.get("/lists/backlog").get_data()
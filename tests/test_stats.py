@@ -0,0 +1,121 @@
+import json
+
+import pytest
+
+from sqlalchemy.orm import sessionmaker
+
+import queries
+from database import db_session
+from models import ListCount, ListEntry
+from queries import count_lists, list_count_drift
+from tests.test_lists import add
+
+def stats(client):
+    response = client.get("/stats")
+    assert response.status_code == 200
+    return json.loads(response.get_data())
+
+def post_json(client, url, body):
+    response = client.post(url, data=json.dumps(body), content_type="application/json")
+    assert response.status_code == 200
+    return json.loads(response.get_data())
+
+def assert_counted(client, backlog, wishlist):
+    """
+    Checks that no list count is off, and that /stats serves backlog
+    and wishlist, dicts of platform names to numbers of entries
+    """
+
+    db_session.remove()
+    assert list_count_drift(db_session) == []
+
+    lists = stats(client)["lists"]
+    assert lists["backlog"] == {"total": sum(backlog.values()), "platforms": backlog}
+    assert lists["wishlist"] == {"total": sum(wishlist.values()), "platforms": wishlist}
+
+@pytest.fixture
+def lists(client):
+    """
+    Four games in bob's backlog and two in his wishlist, under PC and PlayStation 4
+    """
+
+    client.post("/add-platform", data={"platform_name": "PlayStation 4"})
+    entries = [add(client, igdb_id, "Game {}".format(igdb_id), list_type, platform) for igdb_id, list_type, platform in
+               [(1, "backlog", "PC"), (2, "backlog", "PC"), (3, "backlog", "PlayStation 4"),
+                (4, "backlog", "PlayStation 4"), (5, "wishlist", "PC"), (6, "wishlist", "PlayStation 4")]]
+    return dict((entry["igdb_id"], entry["id"]) for entry in entries)
+
+def test_adds_are_counted(client, lists):
+    assert_counted(client, {"PC": 2, "PlayStation 4": 2}, {"PC": 1, "PlayStation 4": 1})
+
+    client.post("/add-game/wishlist", data={"igdb_id": 7, "game_name": "Game 7", "platform": "PC", "image_url": ""})
+    # adding an entry the user already has changes nothing
+    client.post("/add-game/wishlist", data={"igdb_id": 7, "game_name": "Game 7", "platform": "PC", "image_url": ""})
+    assert_counted(client, {"PC": 2, "PlayStation 4": 2}, {"PC": 2, "PlayStation 4": 1})
+
+def test_deletes_are_counted(client, lists):
+    client.post("/delete-game/backlog", data={"igdb_id": 1, "platform": "PC"})
+    assert client.delete("/api/lists/backlog/entries/{}".format(lists[3])).status_code == 200
+    # deleting an entry that's gone changes nothing
+    assert client.delete("/api/lists/backlog/entries/{}".format(lists[3])).status_code == 404
+
+    assert_counted(client, {"PC": 1, "PlayStation 4": 1}, {"PC": 1, "PlayStation 4": 1})
+
+def test_bulk_moves_are_counted(client, lists):
+    assert post_json(client, "/api/lists/backlog/move", {"entries": [lists[1], lists[3]], "to": "wishlist"}) == \
+           {"moved": 2}
+    assert_counted(client, {"PC": 1, "PlayStation 4": 1}, {"PC": 2, "PlayStation 4": 2})
+
+    assert post_json(client, "/api/lists/wishlist/move", {"platform": "PlayStation 4", "to": "backlog"}) == \
+           {"moved": 2}
+    assert_counted(client, {"PC": 1, "PlayStation 4": 3}, {"PC": 2})
+
+def test_bulk_deletes_are_counted(client, lists):
+    assert post_json(client, "/api/lists/backlog/delete", {"entries": [lists[1], lists[5]]}) == {"deleted": 1}
+    assert_counted(client, {"PC": 1, "PlayStation 4": 2}, {"PC": 1, "PlayStation 4": 1})
+
+    assert post_json(client, "/api/lists/backlog/delete", {"platform": "PlayStation 4"}) == {"deleted": 2}
+    assert_counted(client, {"PC": 1}, {"PC": 1, "PlayStation 4": 1})
+
+def test_deleted_platforms_are_uncounted(client, lists):
+    client.post("/delete-platform", data={"platform_name": "PlayStation 4"})
+
+    assert_counted(client, {"PC": 2}, {"PC": 1})
+
+def test_imports_are_counted(client, lists):
+    from tests.test_transfer import upload, entries
+
+    upload(client, json.dumps(entries(3, start=10)))
+
+    assert_counted(client, {"PC": 5, "PlayStation 4": 2}, {"PC": 1, "PlayStation 4": 1})
+
+@pytest.mark.parametrize("operation", ["move", "delete"])
+def test_entries_changed_by_someone_else_meanwhile_are_not_counted(client, lists, monkeypatch, operation):
+    # another request deletes one of the entries right after they've been selected, which
+    # SQLite, lacking row locks, doesn't prevent
+    locked_entries = queries._locked_entries
+    def select_then_delete(*args):
+        rows = locked_entries(*args)
+        other_session = sessionmaker(bind=db_session.get_bind())()
+        other_session.query(ListEntry).filter(ListEntry.id == lists[1]).delete()
+        other_session.commit()
+        other_session.close()
+        return rows
+    monkeypatch.setattr(queries, "_locked_entries", select_then_delete)
+
+    body = {"entries": [lists[1], lists[2]], "to": "wishlist"}
+    changed = post_json(client, "/api/lists/backlog/{}".format(operation), body)
+
+    assert changed.values() == [1]
+    assert list_count_drift(db_session) == []
+
+def test_count_lists_fixes_counts_in_place(client, lists):
+    db_session.query(ListCount).filter(ListCount.list_type == "backlog").update({ListCount.entries: 42})
+    db_session.query(ListCount).filter(ListCount.list_type == "wishlist").delete()
+    db_session.commit()
+    assert len(list_count_drift(db_session)) == 4
+
+    count_lists(db_session, 1)
+    db_session.commit()
+
+    assert_counted(client, {"PC": 2, "PlayStation 4": 2}, {"PC": 1, "PlayStation 4": 1})
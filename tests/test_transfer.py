@@ -0,0 +1,60 @@
+import json
+
+from io import BytesIO
+
+from sqlalchemy import func
+
+from models import Game, ListEntry
+
+def upload(client, content, filename="tracklog.json"):
+    response = client.post("/import", data={"file": (BytesIO(content), filename)},
+                           content_type="multipart/form-data")
+    with client.session_transaction() as flask_session:
+        flashes = flask_session.pop("_flashes", [])
+    return response, flashes
+
+def entries(count, start=1):
+    return [{"list_type": "backlog", "platform": "PC", "igdb_id": igdb_id, "name": "Game {}".format(igdb_id),
+             "image_url": ""} for igdb_id in range(start, start + count)]
+
+def test_import_adds_entries_and_makes_their_games_searchable(client, tracklog, database):
+    response, flashes = upload(client, json.dumps(entries(3)))
+
+    assert response.status_code == 302
+    assert flashes == [("success", "3 game(s) imported, 0 skipped (already in your lists or missing data).")]
+    assert database.scalar(ListEntry.__table__.count()) == 3
+    assert [game["id"] for game in tracklog.game_index.search("game", 10)] == [1, 2, 3]
+
+def test_import_rejects_json_items_that_arent_objects(client, database):
+    response, flashes = upload(client, "[1, 2, 3]")
+
+    assert response.status_code == 302
+    assert flashes[0][0] == "danger"
+    assert database.scalar(ListEntry.__table__.count()) == 0
+
+def test_failed_import_leaves_no_games_behind(client, tracklog, database):
+    # the first batch of entries is inserted before the file turns out to be invalid
+    content = json.dumps(entries(1000) + [1])
+
+    response, flashes = upload(client, content)
+
+    assert flashes[0][0] == "danger"
+    assert database.scalar(Game.__table__.count()) == 0
+    assert tracklog.game_index.search("game", 10) == []
+
+def test_import_skips_rows_with_malformed_fields(client, tracklog, database):
+    malformed = [dict(entry, **fields) for entry, fields in zip(entries(6, start=10), [
+        {"platform": ["PC"]},
+        {"platform": {"name": "PC"}},
+        {"list_type": ["backlog"]},
+        {"name": ["Game"]},
+        {"name": 42},
+        {"image_url": {"url": "x"}}
+    ])]
+
+    response, flashes = upload(client, json.dumps(entries(2) + malformed))
+
+    assert response.status_code == 302
+    assert flashes == [("success", "2 game(s) imported, 6 skipped (already in your lists or missing data).")]
+    assert database.scalar(ListEntry.__table__.count()) == 2
+    assert sorted(game["id"] for game in tracklog.game_index.search("game", 10)) == [1, 2]
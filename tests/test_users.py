@@ -0,0 +1,141 @@
+import re
+
+import pytest
+
+from cache import TTLCache
+from hashing import Hasher, HashingPoolSaturated
+
+def cached_user(tracklog):
+    """
+    Returns bob as cached by this process, or None if he isn't
+    """
+
+    return tracklog.user_cache.get(tracklog.user_cache_key(1))
+
+def user_queries(statements):
+    return [statement for statement in statements if re.search(r"\bFROM users\b", statement)]
+
+def test_logged_in_requests_dont_load_the_user_once_cached(client, tracklog, queries):
+    client.get("/stats")
+    del queries[:]
+    assert client.get("/stats").status_code == 200
+    warm = list(queries)
+
+    tracklog.user_cache.clear()
+    del queries[:]
+    assert client.get("/stats").status_code == 200
+    cold = list(queries)
+
+    assert user_queries(warm) == []
+    assert len(user_queries(cold)) == 1
+    assert len(warm) == len(cold) - 1
+
+def test_cached_users_have_no_password_hash(client, tracklog):
+    client.get("/stats")
+
+    user = cached_user(tracklog)
+    assert user.username == "bob"
+    assert not hasattr(user, "password")
+
+def test_changing_email_or_password_uncaches_the_user(client, tracklog):
+    client.get("/stats")
+    client.post("/change-email", data={"password": "secret", "email": "robert@example.com"})
+    assert cached_user(tracklog) is None
+
+    client.get("/stats")
+    assert cached_user(tracklog).email == "robert@example.com"
+
+    client.post("/change-password", data={"current_password": "secret", "new_password": "hunter2",
+                                          "confirm_password": "hunter2"})
+    assert cached_user(tracklog) is None
+
+    # the new password is checked against the database, not against anything cached
+    client.get("/logout")
+    response = client.post("/login", data={"username": "bob", "password": "secret"})
+    assert response.status_code == 200
+    response = client.post("/login", data={"username": "bob", "password": "hunter2"})
+    assert response.status_code == 302
+
+@pytest.fixture
+def workers(tracklog, monkeypatch):
+    """
+    Function switching the app over to the user cache of worker process 0 or 1
+    """
+
+    caches = [tracklog.user_cache, TTLCache(ttl=60, max_size=100)]
+    return lambda worker: monkeypatch.setattr(tracklog, "user_cache", caches[worker])
+
+def test_changes_outdate_users_cached_by_other_workers(client, tracklog, workers):
+    for worker in [0, 1]:
+        workers(worker)
+        client.get("/stats")
+        assert cached_user(tracklog).email == "bob@example.com"
+
+    workers(0)
+    client.post("/change-email", data={"password": "secret", "email": "robert@example.com"})
+
+    workers(1)
+    assert cached_user(tracklog) is None
+    assert tracklog.load_user("1").email == "robert@example.com"
+
+def test_deleted_users_are_logged_out_by_other_workers(client, tracklog, workers):
+    for worker in [1, 0]:
+        workers(worker)
+        client.get("/stats")
+
+    client.post("/delete-account", data={"password": "secret"})
+
+    workers(1)
+    assert tracklog.load_user("1") is None
+
+def stored_hash(tracklog):
+    tracklog.db_session.remove()
+    return tracklog.db_session.query(tracklog.User.password).filter(tracklog.User.id == 1).scalar()
+
+def hash_rounds(password_hash):
+    return int(re.match(r"\$6\$rounds=(\d+)\$", password_hash).group(1))
+
+def test_logging_in_rehashes_passwords_hashed_with_fewer_rounds(client, tracklog, monkeypatch):
+    client.get("/logout")
+    old_hash = stored_hash(tracklog)
+    assert hash_rounds(old_hash) >= 1000
+
+    monkeypatch.setattr(tracklog, "hasher", Hasher(rounds=2000, pool_size=0))
+    assert client.post("/login", data={"username": "bob", "password": "secret"}).status_code == 302
+
+    new_hash = stored_hash(tracklog)
+    assert hash_rounds(new_hash) >= 2000
+    assert tracklog.hasher.verify("secret", new_hash)
+
+    # hashes that are up to date are left as they are
+    client.get("/logout")
+    client.post("/login", data={"username": "bob", "password": "secret"})
+    assert stored_hash(tracklog) == new_hash
+
+@pytest.fixture
+def pooled_hasher(tracklog, monkeypatch):
+    """
+    Hasher with a single process, which only takes a single password at a time
+    """
+
+    hasher = Hasher(rounds=1000, pool_size=1, max_pending=1)
+    monkeypatch.setattr(tracklog, "hasher", hasher)
+    yield hasher
+    if hasher._pool is not None:
+        hasher._pool.terminate()
+
+def test_logins_are_turned_away_while_the_hashing_pool_is_full(client, pooled_hasher):
+    client.get("/logout")
+
+    # another request is using the only slot
+    pooled_hasher._slots.acquire()
+    with pytest.raises(HashingPoolSaturated):
+        pooled_hasher.verify("secret", "hash")
+    response = client.post("/login", data={"username": "bob", "password": "secret"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    # once it's free, passwords are hashed in the pool's process
+    pooled_hasher._slots.release()
+    assert client.post("/login", data={"username": "bob", "password": "secret"}).status_code == 302
+    assert pooled_hasher._pool is not None
@@ -0,0 +1,203 @@
+import codecs
+import csv
+import json
+import re
+
+from io import BytesIO
+from sqlalchemy import select, func
+from models import *
+from queries import insert_ignore, count_lists
+
+# columns of exported and imported files
+FIELDS = ["list_type", "platform", "igdb_id", "name", "image_url"]
+
+WHITESPACE = re.compile(r"\s*")
+
+def export_entries(session, user_id):
+    """
+    Yields all of a user's list entries as dicts keyed by FIELDS, without
+    loading them all into memory at once
+    """
+
+    query = session.query(ListEntry.list_type, Platform.name, Game.igdb_id, Game.name, Game.image_url). \
+                    join(Game). \
+                    join(Platform). \
+                    filter(ListEntry.user_id == user_id). \
+                    order_by(ListEntry.list_type, Platform.name, Game.name). \
+                    yield_per(1000)
+
+    for row in query:
+        yield dict(zip(FIELDS, row))
+
+def to_csv(entries):
+    """
+    Yields entries formatted as CSV, one line at a time
+    """
+
+    buffer = BytesIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(FIELDS)
+    for entry in entries:
+        yield line([_encode(entry[field]) for field in FIELDS])
+
+def to_json(entries):
+    """
+    Yields entries formatted as a JSON array, one entry at a time
+    """
+
+    separator = "[\n"
+    for entry in entries:
+        yield separator + json.dumps(entry, sort_keys=True)
+        separator = ",\n"
+
+    # an empty export still needs its opening bracket
+    yield "[\n]\n" if separator == "[\n" else "\n]\n"
+
+def from_csv(stream):
+    """
+    Yields the rows of a CSV file with a header line as dicts, one at a time
+    """
+
+    for row in csv.DictReader(stream):
+        yield dict((key, value.decode("utf-8")) for key, value in row.items() if key and value)
+
+def from_json(stream, chunk_size=65536):
+    """
+    Yields the objects of a JSON array one at a time, reading stream in chunks
+    rather than loading the whole file, raising ValueError if it holds anything else
+    """
+
+    decoder = json.JSONDecoder()
+    decode = codecs.getincrementaldecoder("utf-8")().decode
+    buffer, position, state, eof = u"", 0, "start", False
+
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+
+        if position < len(buffer):
+            char = buffer[position]
+            if state == "start":
+                if char != u"[":
+                    raise ValueError("expected a JSON array")
+                position, state = position + 1, "first"
+                continue
+            if state in ("first", "separator") and char == u"]":
+                return
+            if state == "separator":
+                if char != u",":
+                    raise ValueError("expected ',' or ']' in JSON array")
+                position, state = position + 1, "item"
+                continue
+
+            # the next value may be cut off at the end of the buffer,
+            # in which case read more of the file and try again
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                if not isinstance(value, dict):
+                    raise ValueError("expected a JSON array of objects")
+                state = "separator"
+                yield value
+                continue
+        elif eof:
+            raise ValueError("unexpected end of JSON array")
+
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer, position = buffer[position:] + decode(chunk, final=eof), 0
+
+def import_entries(session, user_id, rows, platform_ids=None, batch_size=1000, on_games=None):
+    """
+    Adds the entries in rows (dicts keyed by FIELDS) to a user's lists, in
+    batches of batch_size rows, adding the games and user platforms they need
+
+    Entries the user already has are left as they are. Rows with a missing
+    or malformed field or an unknown platform or list type are skipped. Platforms are looked up in
+    platform_ids, a dict of platform names to IDs, or in the database if it's
+    not given. on_games, if given, is called with the (igdb_id, name, image_url)
+    of each batch's games.
+
+    Recounts the user's list_counts once done. Returns the number of imported rows
+    and of rows that were skipped or already in the user's lists. Nothing is committed.
+    """
+
+    # platforms are a small table, so look all of them up once
+    platforms = platform_ids or dict(session.query(Platform.name, Platform.id).all())
+
+    count_entries = lambda: session.query(func.count(ListEntry.id)). \
+                                    filter(ListEntry.user_id == user_id).scalar()
+    before = count_entries()
+    total = 0
+
+    for batch in _batches(rows, batch_size):
+        total += len(batch)
+
+        # keep the rows that have everything needed to add them
+        valid = []
+        for row in batch:
+            # JSON rows may hold anything, so make sure the fields are text first
+            fields = [row.get("platform"), row.get("list_type"), row.get("name"), row.get("image_url") or u""]
+            if not all(isinstance(field, basestring) for field in fields):
+                continue
+            igdb_id = u"{}".format(row.get("igdb_id", "")).strip()
+            platform_id = platforms.get(row["platform"])
+            if not all([row["list_type"] in LIST_TYPES, row["name"], igdb_id.isdigit(), platform_id]):
+                continue
+            valid.append((row, int(igdb_id), platform_id))
+        if not valid:
+            continue
+
+        # insert the games the database doesn't have yet, then look up the IDs of all of them
+        games = dict((igdb_id, {"igdb_id": igdb_id, "name": row["name"], "image_url": row.get("image_url") or u""})
+                     for row, igdb_id, platform_id in valid)
+        session.execute(insert_ignore(session, Game.__table__), list(games.values()))
+        game_ids = dict(session.execute(select([Game.__table__.c.igdb_id, Game.__table__.c.id]).
+                                        where(Game.__table__.c.igdb_id.in_(list(games)))).fetchall())
+        if on_games:
+            on_games([(game["igdb_id"], game["name"], game["image_url"]) for game in games.values()])
+
+        # make sure the user has every platform they're adding games under
+        platform_ids = set(platform_id for row, igdb_id, platform_id in valid)
+        session.execute(insert_ignore(session, UserPlatform.__table__),
+                        [{"user_id": user_id, "platform_id": platform_id} for platform_id in platform_ids])
+
+        session.execute(insert_ignore(session, ListEntry.__table__),
+                        [{"user_id": user_id, "game_id": game_ids[igdb_id], "platform_id": platform_id,
+                          "list_type": row["list_type"]} for row, igdb_id, platform_id in valid])
+
+    imported = count_entries() - before
+    if imported:
+        count_lists(session, user_id)
+    return imported, total - imported
+
+def _batches(rows, size):
+    """
+    Groups rows into lists of at most size rows
+    """
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _encode(value):
+    """
+    Encodes unicode values as UTF-8, which is what Python 2's csv module expects
+    """
+
+    return value.encode("utf-8") if isinstance(value, unicode) else value